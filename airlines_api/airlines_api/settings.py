@@ -41,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'bookings.middleware.UpstreamBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'airlines_api.urls'
@@ -137,4 +138,98 @@ CACHES ={
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+# Upstream SOAP endpoints, each with its own keep-alive connection pool.
+# Operations not listed in SOAP_OPERATION_ENDPOINTS use the 'default' endpoint.
+
+SOAP_ENDPOINTS = {
+    'default': {
+        'URL': config('SOAP_ENDPOINT_URL', default=''),
+        'POOL_SIZE': config('SOAP_POOL_SIZE', default=10, cast=int),
+        'CONNECT_TIMEOUT': config('SOAP_CONNECT_TIMEOUT', default=3.05, cast=float),
+        'READ_TIMEOUT': config('SOAP_READ_TIMEOUT', default=30, cast=float),
+        'ASYNC_POOL_SIZE': config('SOAP_ASYNC_POOL_SIZE', default=200, cast=int),
+    },
+}
+
+SOAP_OPERATION_ENDPOINTS = {}
+
+# Upstream resilience: every request gets REQUEST_BUDGET seconds for all of
+# its SOAP calls; idempotent operations are retried up to RETRIES times with
+# jittered backoff; an endpoint failing BREAKER_FAILURES calls in a row is
+# short-circuited for BREAKER_RESET seconds.
+SOAP_RESILIENCE = {
+    'REQUEST_BUDGET': config('SOAP_REQUEST_BUDGET', default=30, cast=float),
+    'RETRIES': config('SOAP_RETRIES', default=2, cast=int),
+    'BACKOFF': 0.2,
+    'BACKOFF_MAX': 2,
+    'BREAKER_FAILURES': config('SOAP_BREAKER_FAILURES', default=5, cast=int),
+    'BREAKER_RESET': config('SOAP_BREAKER_RESET', default=30, cast=float),
+}
+
+# Hedged reads (off by default): a GetFlightDetail, GetItinerary or CheckBalance
+# call still waiting after the PERCENTILE of recent latencies is sent once more
+# and the first answer wins; hedges are capped at MAX_PERCENT of calls.
+SOAP_HEDGING = {
+    'ENABLED': config('SOAP_HEDGING', default=False, cast=bool),
+    'PERCENTILE': config('SOAP_HEDGING_PERCENTILE', default=95, cast=float),
+    'MAX_PERCENT': config('SOAP_HEDGING_MAX_PERCENT', default=5, cast=float),
+}
+
+# flight_availability fan-out: per-airline deadline (seconds) and worker threads
+AVAILABILITY_FAN_OUT = {
+    'DEADLINE': config('AVAILABILITY_FAN_OUT_DEADLINE', default=8, cast=float),
+    'MAX_WORKERS': config('AVAILABILITY_FAN_OUT_WORKERS', default=16, cast=int),
+}
+
+# flight_availability search cache: entries are fresh for TTL seconds, then
+# served stale for up to STALE_TTL more while one background refresh runs
+# on its own pool of REFRESH_WORKERS threads.
+# Entries are shared by all agencies; each agency's commission rates are
+# kept for COMMISSION_TTL and applied on top.
+AVAILABILITY_CACHE = {
+    'TTL': config('AVAILABILITY_CACHE_TTL', default=60, cast=int),
+    'STALE_TTL': config('AVAILABILITY_CACHE_STALE_TTL', default=240, cast=int),
+    'REFRESH_TIMEOUT': 30,
+    'REFRESH_WORKERS': 4,
+    'COMMISSION_TTL': 60 * 60 * 24,
+}
+
+# XML parser for SOAP responses: 'lxml', 'etree' or 'auto' (lxml when installed)
+SOAP_XML_BACKEND = config('SOAP_XML_BACKEND', default='auto')
+
+# How often (seconds) each worker checks whether its in-process Sector and
+# Airline lookup tables are still current
+LOOKUP_TABLES_CHECK_INTERVAL = 1.0
+
+# sales_report is cached per user and issue day; days already in the past
+# keep PAST_TTL, today and later only TODAY_TTL. See bookings/sales.py.
+SALES_REPORT_CACHE = {
+    'PAST_TTL': 60 * 60 * 24 * 30,
+    'TODAY_TTL': 60 * 5,
+    'WINDOW_DAYS': 31,
+    'MAX_WORKERS': 8,
+}
+
+# Identical concurrent upstream calls (availability misses, sector_code,
+# sales_report windows) wait on one leader, across workers through a cache
+# lock held at most LOCK_TIMEOUT seconds. See bookings/singleflight.py.
+SINGLE_FLIGHT = {
+    'LOCK_TIMEOUT': 30,
+    'RESULT_TTL': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+# batch_flight_detail / batch_itinerary: items per request and the worker
+# threads their upstream calls share. See bookings/batch.py.
+BATCH_LOOKUPS = {
+    'MAX_ITEMS': config('BATCH_LOOKUPS_MAX_ITEMS', default=50, cast=int),
+    'MAX_WORKERS': config('BATCH_LOOKUPS_WORKERS', default=16, cast=int),
+}
+
+# issue_ticket with "async": true is queued as a TicketJob and run on this
+# many threads per worker; manage.py run_ticket_jobs picks up jobs left queued.
+TICKET_JOBS = {
+    'MAX_WORKERS': config('TICKET_JOBS_WORKERS', default=4, cast=int),
+}
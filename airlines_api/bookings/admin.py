@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Sector, Airline, Passenger, Booking
+from .models import Sector, Airline, Passenger, Booking, TicketJob
 
 admin.site.register(Sector)
 admin.site.register(Airline)
 admin.site.register(Passenger)
-admin.site.register(Booking)
\ No newline at end of file
+admin.site.register(Booking)
+admin.site.register(TicketJob)
@@ -0,0 +1,97 @@
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
+from django.views import View
+from .serializer import FlightAvailabilitySerializer, GetFlightDetailsSerializer
+from .mixins import UserAuthenticationMixin
+from . import soap, parsers, envelopes, availability
+
+
+def upstream_error(exc):
+    status_code, headers = soap.http_status(exc)
+    return JsonResponse({'error': str(exc)}, status=status_code, headers=headers)
+
+
+class AsyncBookingView(UserAuthenticationMixin, View):
+    """Base for native async versions of the BookingViewSet actions.
+
+    Served under ASGI these never block a worker thread while waiting on
+    the upstream. Under WSGI Django runs each call in a one-off event
+    loop, which would take a fresh httpx client (and any background task)
+    down with it, so there they use the pooled sync transport instead.
+    """
+
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'},
+                status=403
+            )
+        request.user = user
+        self.native = isinstance(request, ASGIRequest)
+
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': 'JSON parse error'}, status=400)
+
+        return await self.handle(data)
+
+    async def handle(self, data):
+        raise NotImplementedError
+
+
+class FlightAvailabilityView(AsyncBookingView):
+    async def handle(self, data):
+        serializer = FlightAvailabilitySerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=400)
+
+        user_creds = self.get_user_credentials()
+        data = serializer.validated_data
+        airline_ids = await sync_to_async(serializer.fan_out_airlines)() if data['fan_out'] else None
+        cache_key = availability.search_key(data, airline_ids)
+
+        try:
+            if self.native:
+                if airline_ids is not None:
+                    afetch = lambda: availability.afan_out(user_creds, data, airline_ids)
+                else:
+                    afetch = lambda: availability.asearch(user_creds, data)
+                result, cache_state = await availability.acached_search(cache_key, user_creds['strAgencyId'], afetch)
+            else:
+                if airline_ids is not None:
+                    fetch = lambda: availability.fan_out(user_creds, data, airline_ids)
+                else:
+                    fetch = lambda: availability.search(user_creds, data)
+                result, cache_state = await sync_to_async(availability.cached_search)(
+                    cache_key, user_creds['strAgencyId'], fetch
+                )
+            return JsonResponse(result, headers={'X-Cache': cache_state})
+        except soap.UpstreamError as e:
+            return upstream_error(e)
+        except Exception:
+            return HttpResponse(status=500)
+
+
+class FlightDetailView(AsyncBookingView):
+    async def handle(self, data):
+        serializer = GetFlightDetailsSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        soap_body = envelopes.get_flight_detail(self.get_user_id(), serializer.validated_data['flight_id'])
+        try:
+            if self.native:
+                response = await soap.acall('GetFlightDetail', soap_body)
+            else:
+                response = await sync_to_async(soap.call)('GetFlightDetail', soap_body)
+            return JsonResponse({'flight_detail': parsers.parse_flight_detail(response.content)})
+        except soap.UpstreamError as e:
+            return upstream_error(e)
+        except Exception:
+            return HttpResponse(status=500)
@@ -0,0 +1,399 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.cache import cache
+from . import soap, parsers, envelopes, singleflight, resilience
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAN_OUT = {
+    'DEADLINE': 8,
+    'MAX_WORKERS': 16,
+}
+
+DEFAULT_CACHE = {
+    'TTL': 60,
+    'STALE_TTL': 240,
+    'REFRESH_TIMEOUT': 30,
+    'REFRESH_WORKERS': 4,
+    'COMMISSION_TTL': 60 * 60 * 24,
+}
+
+#agency-specific fields of a parsed Availability; everything else is the same for every agency
+COMMISSION_FIELDS = ('agency_commission', 'child_commission')
+
+_executor = None
+_executor_lock = threading.Lock()
+_refresh_executor = None
+
+
+def fan_out_config():
+    return {**DEFAULT_FAN_OUT, **getattr(settings, 'AVAILABILITY_FAN_OUT', {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=fan_out_config()['MAX_WORKERS'],
+                    thread_name_prefix='availability'
+                )
+    return _executor
+
+
+def cache_config():
+    return {**DEFAULT_CACHE, **getattr(settings, 'AVAILABILITY_CACHE', {})}
+
+
+def get_refresh_executor():
+    #stale-entry refreshes get their own threads: on the fan-out pool they would hold workers
+    #their own carrier searches then queue behind
+    global _refresh_executor
+    if _refresh_executor is None:
+        with _executor_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(
+                    max_workers=cache_config()['REFRESH_WORKERS'],
+                    thread_name_prefix='availability-refresh'
+                )
+    return _refresh_executor
+
+
+def read_availability(response):
+    #parse the raw bytes while the body is still downloading
+    with response:
+        return parsers.parse_flight_availability_stream(
+            response.raw.stream(parsers.CHUNK_SIZE, decode_content=True)
+        )
+
+
+async def aread_availability(response):
+    try:
+        return await parsers.aparse_flight_availability_stream(response.aiter_bytes(parsers.CHUNK_SIZE))
+    finally:
+        await response.aclose()
+
+
+def search(user_creds, data):
+    response = soap.call('FlightAvailability', envelopes.flight_availability(user_creds, data), stream=True)
+    return read_availability(response)
+
+
+async def asearch(user_creds, data):
+    response = await soap.acall('FlightAvailability', envelopes.flight_availability(user_creds, data), stream=True)
+    return await aread_availability(response)
+
+
+def search_airline(user_creds, data, airline_id, deadline):
+    response = soap.call(
+        'FlightAvailability',
+        envelopes.flight_availability(user_creds, data, airline_id=airline_id),
+        timeout=deadline,
+        stream=True
+    )
+    return read_availability(response)
+
+
+def merge_results(airline_ids, results, errors):
+    """Merge per-airline availability into one response, cheapest fares first."""
+    outbound_flights = []
+    inbound_flights = []
+    carriers = {}
+    for airline_id in airline_ids:
+        if airline_id in results:
+            outbound_flights.extend(results[airline_id]['outbound_flights'])
+            inbound_flights.extend(results[airline_id]['inbound_flights'])
+            carriers[airline_id] = 'ok'
+        else:
+            carriers[airline_id] = errors.get(airline_id, 'timeout')
+
+    outbound_flights.sort(key=lambda f: f['total_adult_fare'])
+    inbound_flights.sort(key=lambda f: f['total_adult_fare'])
+    return {
+        'outbound_flights': outbound_flights,
+        'inbound_flights': inbound_flights,
+        'carriers': carriers,
+        #carriers cancelled at the deadline didn't answer in time either
+        'timed_out': [a for a, state in carriers.items() if state in ('timeout', 'skipped')],
+    }
+
+
+def fan_out(user_creds, data, airline_ids, deadline=None):
+    #query every airline at once; total latency is the slowest carrier's, capped by the deadline
+    deadline = deadline or fan_out_config()['DEADLINE']
+    executor = get_executor()
+    #the deadline runs from here: a search that waited for a free thread only gets what is left of it,
+    #and each thread runs in a copy of this context, so it also keeps the request's upstream budget
+    with resilience.budget(deadline):
+        futures = {
+            executor.submit(contextvars.copy_context().run, search_airline, user_creds, data, airline_id, deadline): airline_id
+            for airline_id in airline_ids
+        }
+    done, not_done = wait(futures, timeout=deadline)
+
+    results = {}
+    errors = {}
+    for future in not_done:
+        #still queued behind other requests' searches: never sent, and no longer worth sending
+        if future.cancel():
+            errors[futures[future]] = 'skipped'
+    for future in done:
+        airline_id = futures[future]
+        try:
+            results[airline_id] = future.result()
+        except Exception as e:
+            errors[airline_id] = 'timeout' if soap.is_timeout(e) else 'error'
+    return merge_results(airline_ids, results, errors)
+
+
+async def _asearch_airline(user_creds, data, airline_id):
+    response = await soap.acall(
+        'FlightAvailability',
+        envelopes.flight_availability(user_creds, data, airline_id=airline_id),
+        stream=True
+    )
+    return await aread_availability(response)
+
+
+async def asearch_airline(user_creds, data, airline_id, deadline):
+    return await asyncio.wait_for(_asearch_airline(user_creds, data, airline_id), timeout=deadline)
+
+
+async def afan_out(user_creds, data, airline_ids, deadline=None):
+    deadline = deadline or fan_out_config()['DEADLINE']
+    replies = await asyncio.gather(
+        *(asearch_airline(user_creds, data, airline_id, deadline) for airline_id in airline_ids),
+        return_exceptions=True
+    )
+
+    results = {}
+    errors = {}
+    for airline_id, reply in zip(airline_ids, replies):
+        if isinstance(reply, BaseException):
+            errors[airline_id] = 'timeout' if soap.is_timeout(reply) else 'error'
+        else:
+            results[airline_id] = reply
+    return merge_results(airline_ids, results, errors)
+
+
+def search_key(data, airline_ids=None):
+    """Cache key for a validated FlightAvailabilitySerializer payload.
+
+    client_ip and the agency are left out so one entry serves every
+    agency searching the same route, dates and pax mix.
+    """
+    normalized = {
+        'sector_from': data['sector_from'].sector_code,
+        'sector_to': data['sector_to'].sector_code,
+        'flight_date': data['flight_date'].strip().upper(),
+        'return_date': (data.get('return_date') or '').strip().upper(),
+        'trip_type': data['trip_type'].strip().upper(),
+        'nationality': data['nationality'].strip().upper(),
+        'adult': data['adult'],
+        'child': data['child'],
+        'airlines': sorted(airline_ids) if data.get('fan_out') else None,
+    }
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return f"availability_{digest}"
+
+
+def commission_key(agency_id):
+    return f"availability_commission_{agency_id}"
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'hit': 0, 'stale': 0, 'miss': 0}
+
+    def record(self, state):
+        with self._lock:
+            self.counts[state] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = sum(counts.values())
+        counts['hit_ratio'] = (counts['hit'] + counts['stale']) / lookups if lookups else 0.0
+        return counts
+
+
+cache_stats = CacheStats()
+
+
+def cacheable(result):
+    #a fan-out with a missing carrier should not be served to the next searcher
+    return all(state == 'ok' for state in result.get('carriers', {}).values())
+
+
+def _fare(flight):
+    #commission may be flat or tiered, so a learned amount only applies to the very same fare
+    return f"{flight['airline']}:{flight.get('flight_class_code') or ''}:{flight['adult_fare']}:{flight['child_fare']}"
+
+
+def shared_inventory(result):
+    """Strip the agency commission from a parsed result."""
+    return {
+        **result,
+        'outbound_flights': [
+            {k: v for k, v in flight.items() if k not in COMMISSION_FIELDS}
+            for flight in result['outbound_flights']
+        ],
+    }
+
+
+def commission_amounts(result):
+    #the agency's commission as returned upstream, per airline, fare class and fare
+    return {
+        _fare(flight): (flight.get('agency_commission', 0), flight.get('child_commission', 0))
+        for flight in result['outbound_flights']
+    }
+
+
+def apply_commission(shared, amounts):
+    """Overlay an agency's commission amounts on shared inventory.
+
+    Returns None when the agency hasn't been quoted one of the fares
+    yet, in which case the search has to go upstream for it; nothing is
+    extrapolated from other fares.
+    """
+    outbound_flights = []
+    for flight in shared['outbound_flights']:
+        amount = amounts.get(_fare(flight))
+        if amount is None:
+            return None
+        outbound_flights.append({**flight, 'agency_commission': amount[0], 'child_commission': amount[1]})
+    return {**shared, 'outbound_flights': outbound_flights}
+
+
+def _lookup(key, agency_id, values):
+    #(result, state) from a get_many() of the shared entry and the agency's commission amounts
+    entry = values.get(key)
+    if entry is None:
+        return None, 'miss'
+    result = apply_commission(entry['data'], values.get(commission_key(agency_id)) or {})
+    if result is None:
+        return None, 'miss'
+    return result, 'hit' if entry['fresh_until'] > time.time() else 'stale'
+
+
+def _entries(key, agency_id, result, amounts):
+    conf = cache_config()
+    entries = {commission_key(agency_id): {**amounts, **commission_amounts(result)}}
+    if cacheable(result):
+        entries[key] = {'data': shared_inventory(result), 'fresh_until': time.time() + conf['TTL']}
+    return entries
+
+
+def store(key, agency_id, result, amounts=None):
+    conf = cache_config()
+    entries = _entries(key, agency_id, result, amounts or {})
+    cache.set(commission_key(agency_id), entries.pop(commission_key(agency_id)), timeout=conf['COMMISSION_TTL'])
+    if entries:
+        cache.set(key, entries[key], timeout=conf['TTL'] + conf['STALE_TTL'])
+
+
+def coalesced(key, agency_id, fetch):
+    """fetch() shared with every concurrent search for the same key.
+
+    Followers from another agency get the leader's inventory with their
+    own commission applied, or fetch for themselves when it has fares
+    they haven't been quoted yet.
+    """
+    leader_agency, result = singleflight.do(
+        singleflight.flight_key('FlightAvailability', key), lambda: (agency_id, fetch())
+    )
+    if leader_agency == agency_id:
+        return result
+    own = apply_commission(shared_inventory(result), cache.get(commission_key(agency_id)) or {})
+    return own if own is not None else fetch()
+
+
+def _refresh(key, agency_id, fetch):
+    store(key, agency_id, fetch(), cache.get(commission_key(agency_id)))
+
+
+def _refreshed(key):
+    #done-callback of a background refresh: nobody waits on its future, so failures are logged here
+    def done(future):
+        cache.delete(f"{key}_refresh")
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Availability refresh of %s failed', key, exc_info=future.exception())
+    return done
+
+
+def cached_search(key, agency_id, fetch):
+    """Return (result, state) where state is HIT, STALE or MISS.
+
+    The cached entry holds agency-neutral inventory; the requesting
+    agency's commission is applied on the way out. A stale entry is
+    served as is while a single background refresh, claimed with
+    cache.add across all workers, fetches a new one. Concurrent misses
+    for the same key share one upstream search.
+    """
+    values = cache.get_many([key, commission_key(agency_id)])
+    result, state = _lookup(key, agency_id, values)
+    cache_stats.record(state)
+
+    if result is not None and state == 'stale' and cache.add(f"{key}_refresh", 1, timeout=cache_config()['REFRESH_TIMEOUT']):
+        get_refresh_executor().submit(_refresh, key, agency_id, fetch).add_done_callback(_refreshed(key))
+    if result is not None:
+        return result, state.upper()
+
+    result = coalesced(key, agency_id, fetch)
+    store(key, agency_id, result, values.get(commission_key(agency_id)))
+    return result, 'MISS'
+
+
+_background_tasks = set()
+
+
+async def astore(key, agency_id, result, amounts=None):
+    conf = cache_config()
+    entries = _entries(key, agency_id, result, amounts or {})
+    await cache.aset(commission_key(agency_id), entries.pop(commission_key(agency_id)), timeout=conf['COMMISSION_TTL'])
+    if entries:
+        await cache.aset(key, entries[key], timeout=conf['TTL'] + conf['STALE_TTL'])
+
+
+async def acoalesced(key, agency_id, afetch):
+    async def afn():
+        return agency_id, await afetch()
+
+    leader_agency, result = await singleflight.ado(singleflight.flight_key('FlightAvailability', key), afn)
+    if leader_agency == agency_id:
+        return result
+    own = apply_commission(shared_inventory(result), await cache.aget(commission_key(agency_id)) or {})
+    return own if own is not None else await afetch()
+
+
+async def _arefresh(key, agency_id, afetch):
+    try:
+        await astore(key, agency_id, await afetch(), await cache.aget(commission_key(agency_id)))
+    finally:
+        await cache.adelete(f"{key}_refresh")
+
+
+async def acached_search(key, agency_id, afetch):
+    values = await cache.aget_many([key, commission_key(agency_id)])
+    result, state = _lookup(key, agency_id, values)
+    cache_stats.record(state)
+
+    if result is not None and state == 'stale' and await cache.aadd(f"{key}_refresh", 1, timeout=cache_config()['REFRESH_TIMEOUT']):
+        task = asyncio.create_task(_arefresh(key, agency_id, afetch))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    if result is not None:
+        return result, state.upper()
+
+    result = await acoalesced(key, agency_id, afetch)
+    await astore(key, agency_id, result, values.get(commission_key(agency_id)))
+    return result, 'MISS'
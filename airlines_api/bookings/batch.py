@@ -0,0 +1,84 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from . import soap, parsers, envelopes, tickets
+
+DEFAULT_BATCH = {
+    'MAX_ITEMS': 50,
+    'MAX_WORKERS': 16,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULT_BATCH, **getattr(settings, 'BATCH_LOOKUPS', {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config()['MAX_WORKERS'],
+                    thread_name_prefix='batch'
+                )
+    return _executor
+
+
+def flight_detail(user_id, flight_id):
+    response = soap.call('GetFlightDetail', envelopes.get_flight_detail(user_id, flight_id))
+    return {'flight_detail': parsers.parse_flight_detail(response.content)}
+
+
+def itinerary_key(item):
+    #batch_itinerary results are keyed by PNR, or by ticket number for lookups without one
+    return item['pnr_no'] or item['ticket_no']
+
+
+def itinerary(pnr_no, ticket_no, airline_id):
+    response = soap.call('GetItinerary', envelopes.get_itinerary(pnr_no, ticket_no, airline_id))
+    return {'itinerary': parsers.parse_itinerary(response.content)}
+
+
+def _item(fn, args):
+    #one item's outcome; a failure stays with its item instead of failing the batch
+    try:
+        return {'status': 200, **fn(*args)}
+    except soap.UpstreamError as e:
+        status_code, headers = soap.http_status(e)
+        return {'status': status_code, 'error': str(e)}
+    except Exception as e:
+        return {'status': 500, 'error': str(e)}
+
+
+def run(fn, items):
+    """Call fn(*args) for every (key, args) in items, concurrently.
+
+    The calls share one bounded pool and the request's upstream budget.
+    Returns {key: result}, where each result carries its own status and
+    either fn's payload or an error.
+    """
+    futures = {
+        key: get_executor().submit(contextvars.copy_context().run, _item, fn, args)
+        for key, args in items
+    }
+    return {key: future.result() for key, future in futures.items()}
+
+
+def itineraries(user, items):
+    """run() for {key: (pnr_no, ticket_no, airline_id)}, the user's stored itineraries first.
+
+    The local lookups happen in the calling thread, so pool threads never
+    hold database connections; only the misses go upstream.
+    """
+    results = {}
+    for key, (pnr_no, ticket_no, airline_id) in items.items():
+        stored = tickets.find_itinerary(user, pnr_no, ticket_no, airline_id)
+        if stored is not None:
+            results[key] = {'status': 200, 'itinerary': stored}
+    results.update(run(itinerary, [(key, args) for key, args in items.items() if key not in results]))
+    return {key: results[key] for key in items}
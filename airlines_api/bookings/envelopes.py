@@ -0,0 +1,165 @@
+from xml.sax.saxutils import escape
+
+ENVELOPE_HEAD = (
+    b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"'
+    b' xmlns:book="http://booking.us.org/"><soapenv:Body>'
+)
+ENVELOPE_TAIL = b'</soapenv:Body></soapenv:Envelope>'
+
+
+def _encode(value):
+    if value is None:
+        return b''
+    return escape(str(value)).encode('utf-8')
+
+
+class Template:
+    """Precompiled XML template: a fixed sequence of child elements.
+
+    Tags are encoded to bytes once; build() only escapes the values and
+    joins everything in a single pass, producing compact UTF-8 bytes that
+    can be handed to the transport as is. Optional fields are left out
+    when their value is empty; cdata fields take already-built XML bytes.
+    """
+
+    def __init__(self, head, fields, tail, optional=(), cdata=()):
+        self.head = head
+        self.tail = tail
+        self.fields = [
+            (name, f'<{name}>'.encode(), f'</{name}>'.encode(), name in optional, name in cdata)
+            for name in fields
+        ]
+
+    def build(self, values):
+        parts = [self.head]
+        for name, open_tag, close_tag, optional, cdata in self.fields:
+            value = values.get(name)
+            if optional and not value:
+                continue
+            parts.append(open_tag)
+            if cdata:
+                parts.extend((b'<![CDATA[', value, b']]>'))
+            else:
+                parts.append(_encode(value))
+            parts.append(close_tag)
+        parts.append(self.tail)
+        return b''.join(parts)
+
+
+def operation(name, fields, **kwargs):
+    return Template(
+        ENVELOPE_HEAD + f'<book:{name}>'.encode(),
+        fields,
+        f'</book:{name}>'.encode() + ENVELOPE_TAIL,
+        **kwargs
+    )
+
+
+SECTOR_CODE = operation('SectorCode', ['strUserId'])
+
+CHECK_BALANCE = operation('CheckBalance', ['strUserId', 'strAirlineId'])
+
+FLIGHT_AVAILABILITY = operation('FlightAvailability', [
+    'strUserId', 'strPassword', 'strAgencyId', 'strSectorFrom', 'strSectorTo',
+    'strFlightDate', 'strReturnDate', 'strTripType', 'strNationality',
+    'intAdult', 'intChild', 'strClientIP', 'strAirlineId',
+], optional=('strAirlineId',))
+
+RESERVATION = operation('Reservation', ['strFlightId', 'strReturnFlightId'])
+
+ISSUE_TICKET = operation('IssueTicket', [
+    'strFlightId', 'strReturnFlightId', 'strContactName', 'strContactEmail',
+    'strContactMobile', 'strPassengerDetail',
+], cdata=('strPassengerDetail',))
+
+PASSENGER = Template(b'<Passenger>', [
+    'PaxType', 'Title', 'Gender', 'FirstName', 'LastName', 'Nationality', 'PaxRemarks',
+], b'</Passenger>')
+
+GET_ITINERARY = operation('GetItinerary', ['strPnoNo', 'strTicketNo', 'strAgencyId'])
+
+GET_FLIGHT_DETAIL = operation('GetFlightDetail', ['strUserId', 'strFlightId'])
+
+GET_PNR_DETAIL = operation('GetPnrDetail', [
+    'strUserId', 'strPassword', 'strAgencyId', 'strPnrNo', 'strLastName',
+])
+
+SALES_REPORT = operation('SalesReport', [
+    'strUserId', 'strPassword', 'strAgencyId', 'strPnrNo', 'strTicketNo',
+])
+
+
+def sector_code(user_id):
+    return SECTOR_CODE.build({'strUserId': user_id})
+
+
+def check_balance(user_id, airline_id):
+    return CHECK_BALANCE.build({'strUserId': user_id, 'strAirlineId': airline_id})
+
+
+def flight_availability(user_creds, data, airline_id=''):
+    return FLIGHT_AVAILABILITY.build({
+        **user_creds,
+        'strSectorFrom': data['sector_from'].sector_code,
+        'strSectorTo': data['sector_to'].sector_code,
+        'strFlightDate': data['flight_date'],
+        'strReturnDate': data.get('return_date', ''),
+        'strTripType': data['trip_type'],
+        'strNationality': data['nationality'],
+        'intAdult': data['adult'],
+        'intChild': data['child'],
+        'strClientIP': data['client_ip'],
+        'strAirlineId': airline_id,
+    })
+
+
+def reservation(data):
+    return RESERVATION.build({
+        'strFlightId': data['flight_id'],
+        'strReturnFlightId': data.get('return_flight_id', ''),
+    })
+
+
+def passenger_detail(passengers):
+    #the PassengerDetail document IssueTicket expects inside strPassengerDetail
+    return b''.join([
+        b'<?xml version="1.0" ?><PassengerDetail>',
+        *(PASSENGER.build({
+            'PaxType': pax['pax_type'],
+            'Title': pax['title'],
+            'Gender': pax['gender'],
+            'FirstName': pax['first_name'],
+            'LastName': pax['last_name'],
+            'Nationality': pax['nationality'],
+            'PaxRemarks': pax.get('remarks', 'N/A'),
+        }) for pax in passengers),
+        b'</PassengerDetail>',
+    ])
+
+
+def issue_ticket(data):
+    return ISSUE_TICKET.build({
+        'strFlightId': data['flight_id'],
+        'strReturnFlightId': data.get('return_flight_id', ''),
+        'strContactName': data['contact_name'],
+        'strContactEmail': data['contact_email'],
+        'strContactMobile': data['contact_mobile'],
+        'strPassengerDetail': passenger_detail(data['passenger_detail']),
+    })
+
+
+def get_itinerary(pnr_no, ticket_no, airline_id):
+    return GET_ITINERARY.build({'strPnoNo': pnr_no, 'strTicketNo': ticket_no, 'strAgencyId': airline_id})
+
+
+def get_flight_detail(user_id, flight_id):
+    return GET_FLIGHT_DETAIL.build({'strUserId': user_id, 'strFlightId': flight_id})
+
+
+def get_pnr_detail(user_creds, pnr_no, last_name):
+    return GET_PNR_DETAIL.build({**user_creds, 'strPnrNo': pnr_no, 'strLastName': last_name})
+
+
+def sales_report(user_creds, from_date, to_date):
+    #the upstream takes the report range in its strPnrNo/strTicketNo fields
+    return SALES_REPORT.build({**user_creds, 'strPnrNo': from_date, 'strTicketNo': to_date})
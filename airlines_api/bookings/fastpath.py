@@ -0,0 +1,62 @@
+from rest_framework import serializers
+from .models import Passenger
+from .serializer import BookingSerializer, PassengerSerializer
+
+#fields whose representation isn't the column value itself
+CONVERTED = (serializers.DecimalField, serializers.DateField, serializers.TimeField, serializers.DateTimeField)
+
+
+def columns(serializer_class, skip=()):
+    """(output key, .values() column, converter) per field, in the serializer's field order.
+
+    Taken from the serializer itself so both paths always emit the same
+    keys; related fields read the raw <name>_id column instead of a join.
+    """
+    spec = []
+    for name, field in serializer_class().fields.items():
+        if name in skip:
+            continue
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            spec.append((name, f"{field.source}_id", None))
+        else:
+            spec.append((name, field.source, field.to_representation if isinstance(field, CONVERTED) else None))
+    return spec
+
+
+PASSENGER_COLUMNS = columns(PassengerSerializer)
+BOOKING_COLUMNS = columns(BookingSerializer, skip=('passengers',))
+
+
+def render(row, spec):
+    out = {}
+    for key, column, convert in spec:
+        value = row[column]
+        out[key] = value if convert is None or value is None else convert(value)
+    return out
+
+
+def passenger_values(queryset):
+    return queryset.values(*[column for key, column, convert in PASSENGER_COLUMNS])
+
+
+def booking_values(queryset):
+    #created_at and id are what KeysetPagination orders and builds cursors on
+    return queryset.prefetch_related(None).values('id', 'created_at', *[column for key, column, convert in BOOKING_COLUMNS])
+
+
+def passengers(rows):
+    """PassengerSerializer(many=True).data for passenger_values() rows."""
+    return [render(row, PASSENGER_COLUMNS) for row in rows]
+
+
+def bookings(rows):
+    """BookingSerializer(many=True).data for booking_values() rows.
+
+    All passengers of the page come from one .values() query and are
+    grouped by booking id, instead of a nested serializer per booking.
+    """
+    rows = list(rows)
+    grouped = {row['id']: [] for row in rows}
+    for passenger in passenger_values(Passenger.objects.filter(booking_id__in=list(grouped)).order_by('pk')):
+        grouped[passenger['booking_id']].append(render(passenger, PASSENGER_COLUMNS))
+    return [{**render(row, BOOKING_COLUMNS), 'passengers': grouped[row['id']]} for row in rows]
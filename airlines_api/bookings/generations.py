@@ -0,0 +1,66 @@
+import time
+from django.core.cache import cache
+from django.db import transaction
+
+#cached collections that are invalidated as a whole whenever one of their rows changes
+NAMESPACES = ('sector', 'airline', 'booking', 'passenger')
+
+
+def key(namespace):
+    return f"generation_{namespace}"
+
+
+def current(namespace):
+    """The namespace's generation; every cache key in it embeds this number.
+
+    A missing counter (never set, or evicted) starts from the clock so it
+    can never fall back to a generation that still has entries cached.
+    """
+    generation = cache.get(key(namespace))
+    if generation is None:
+        cache.add(key(namespace), time.time_ns() // 1000, timeout=None)
+        generation = cache.get(key(namespace))
+    return generation
+
+
+def modified_key(namespace):
+    return f"generation_{namespace}_modified"
+
+
+def modified(namespace):
+    """When the namespace last changed, in seconds: the Last-Modified of anything cached in it.
+
+    An unknown time (never bumped, or evicted) starts from now, which can
+    only make clients fetch once more, never keep an outdated copy.
+    """
+    stamp = cache.get(modified_key(namespace))
+    if stamp is None:
+        cache.add(modified_key(namespace), int(time.time()), timeout=None)
+        stamp = cache.get(modified_key(namespace))
+    return stamp
+
+
+def _touch(namespace):
+    #strictly later than the previous stamp, so a change in the same second still counts as newer
+    previous = cache.get(modified_key(namespace)) or 0
+    cache.set(modified_key(namespace), max(int(time.time()), previous + 1), timeout=None)
+
+
+def prefix(namespace):
+    return f"{namespace}_g{current(namespace)}"
+
+
+def bump(*namespaces):
+    #one INCR per namespace; entries of the old generation simply expire
+    for namespace in namespaces:
+        try:
+            cache.incr(key(namespace))
+        except ValueError:
+            cache.add(key(namespace), time.time_ns() // 1000, timeout=None)
+        _touch(namespace)
+
+
+def invalidate(*namespaces):
+    #bumped once the change is committed, so nothing can re-cache the old rows under the new generation
+    transaction.on_commit(lambda: bump(*namespaces))
+
@@ -0,0 +1,83 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+from .models import TicketJob, TicketJobStatus
+from . import soap, parsers, envelopes, tickets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = {
+    'MAX_WORKERS': 4,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def config():
+    return {**DEFAULT_JOBS, **getattr(settings, 'TICKET_JOBS', {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config()['MAX_WORKERS'],
+                    thread_name_prefix='ticket-jobs'
+                )
+    return _executor
+
+
+def enqueue(user, data):
+    """Save an issue_ticket job and hand it to the pool once the row is committed."""
+    job = TicketJob.objects.create(user=user if user.is_authenticated else None, payload=data)
+    transaction.on_commit(lambda: get_executor().submit(run, job.pk))
+    return job
+
+
+def claim(job_id):
+    #IssueTicket isn't idempotent: only the caller that moves the job out of QUEUED runs it
+    return TicketJob.objects.filter(pk=job_id, status=TicketJobStatus.QUEUED).update(
+        status=TicketJobStatus.RUNNING, started_at=timezone.now()
+    ) == 1
+
+
+def finish(job, status, **fields):
+    for field, value in fields.items():
+        setattr(job, field, value)
+    job.status = status
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', *fields])
+
+
+def execute(job):
+    data = job.payload
+    try:
+        response = soap.call('IssueTicket', envelopes.issue_ticket(data))
+        passengers = parsers.parse_issue_ticket(response.content)
+    except soap.UpstreamError as e:
+        return finish(job, TicketJobStatus.FAILED, error=str(e), error_status=soap.http_status(e)[0])
+    except Exception:
+        logger.exception('Ticket job %s failed', job.pk)
+        return finish(job, TicketJobStatus.FAILED, error='Ticket could not be issued', error_status=500)
+
+    if job.user is not None:
+        tickets.save_issued(job.user, data, passengers)
+    finish(job, TicketJobStatus.DONE, itinerary=passengers)
+
+
+def run(job_id):
+    """Issue the ticket of a queued job and record the outcome on it."""
+    try:
+        if claim(job_id):
+            execute(TicketJob.objects.select_related('user').get(pk=job_id))
+    except Exception:
+        logger.exception('Ticket job %s could not be run', job_id)
+    finally:
+        #pool threads outlive requests, so nothing else closes their connections
+        close_old_connections()
@@ -0,0 +1,61 @@
+import threading
+import time
+from django.conf import settings
+from .models import Sector, Airline
+from . import generations
+
+
+class LookupTable:
+    """Read-mostly, per-process copy of a small reference table.
+
+    The rows are loaded once per worker and indexed by the given fields.
+    The namespace's generation (see generations.py) is compared at most
+    once per LOOKUP_TABLES_CHECK_INTERVAL seconds; bookings/signals.py
+    bumps it whenever a row changes, so every worker reloads on its next
+    access.
+    """
+
+    def __init__(self, model, name, indexes):
+        self.model = model
+        self.namespace = name
+        self.indexes = indexes
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        rows = list(self.model.objects.order_by('pk'))
+        snapshot = {'all': rows}
+        for field in self.indexes:
+            snapshot[field] = {getattr(row, field): row for row in rows}
+        return snapshot
+
+    def _current(self):
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < getattr(settings, 'LOOKUP_TABLES_CHECK_INTERVAL', 1.0):
+            return snapshot
+
+        version = generations.current(self.namespace)
+        with self._lock:
+            if self._snapshot is None or version != self._version:
+                self._snapshot = self._load()
+                self._version = version
+            self._checked_at = now
+            return self._snapshot
+
+    def get(self, field, value):
+        return self._current()[field].get(value)
+
+    def all(self):
+        return self._current()['all']
+
+    def invalidate(self):
+        #this process reloads right away, other workers once the change is committed
+        self._snapshot = None
+        generations.invalidate(self.namespace)
+
+
+sectors = LookupTable(Sector, 'sector', indexes=('pk', 'sector_code'))
+airlines = LookupTable(Airline, 'airline', indexes=('pk', 'airline_id'))
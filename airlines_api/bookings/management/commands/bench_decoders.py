@@ -0,0 +1,95 @@
+import timeit
+import xml.etree.ElementTree as ET
+from django.core.management.base import BaseCommand
+from bookings import parsers
+
+AVAILABILITY_XML = """
+<Availability>
+    <Airline>U4</Airline>
+    <AirlineLogo>http://test.com/U4.jpg</AirlineLogo>
+    <FlightDate>30-SEP-2025</FlightDate>
+    <FlightNo>U4123</FlightNo>
+    <Departure>KATHMANDU</Departure>
+    <DepartureTime>10:00</DepartureTime>
+    <Arrival>POKHARA</Arrival>
+    <ArrivalTime>10:30</ArrivalTime>
+    <AircraftType>ATR72</AircraftType>
+    <Adult>1</Adult>
+    <Child>0</Child>
+    <Infant>0</Infant>
+    <FlightId>abc-123-def</FlightId>
+    <FlightClassCode>Y</FlightClassCode>
+    <Currency>NPR</Currency>
+    <AdultFare>5000</AdultFare>
+    <ChildFare>3500</ChildFare>
+    <InfantFare>500</InfantFare>
+    <FuelSurcharge>1500</FuelSurcharge>
+    <Tax>200</Tax>
+    <ChildTaxAdjustment>100</ChildTaxAdjustment>
+    <Refundable>T</Refundable>
+    <FreeBaggage>20KG</FreeBaggage>
+    <AgencyCommission>500</AgencyCommission>
+    <ChildCommission>300</ChildCommission>
+</Availability>
+"""
+
+
+def find_per_field(a):
+    #the decoder flight_availability used before parsers.Schema, kept as the baseline
+    adult_fare = float(a.find('AdultFare').text)
+    child_fare = float(a.find('ChildFare').text)
+    fuel_surcharge = float(a.find('FuelSurcharge').text)
+    tax = float(a.find('Tax').text)
+    child_tax_adj = float(a.find('ChildTaxAdjustment').text) if a.find('ChildTaxAdjustment') is not None else 0
+
+    return {
+        'airline': a.find('Airline').text,
+        'airline_logo': a.find('AirlineLogo').text,
+        'flight_date': a.find('FlightDate').text,
+        'flight_no': a.find('FlightNo').text,
+        'departure': a.find('Departure').text,
+        'departure_time': a.find('DepartureTime').text,
+        'arrival': a.find('Arrival').text,
+        'arrival_time': a.find('ArrivalTime').text,
+        'aircraft_type': a.find('AircraftType').text,
+        'adult': int(a.find('Adult').text),
+        'child': int(a.find('Child').text),
+        'infant': int(a.find('Infant').text),
+        'flight_id': a.find('FlightId').text,
+        'flight_class_code': a.find('FlightClassCode').text,
+        'currency': a.find('Currency').text,
+        'adult_fare': adult_fare,
+        'child_fare': child_fare,
+        'infant_fare': float(a.find('InfantFare').text),
+        'fuel_surcharge': fuel_surcharge,
+        'tax': tax,
+        'child_tax_adjustment': child_tax_adj,
+        'total_adult_fare': adult_fare + fuel_surcharge + tax,
+        'total_child_fare': child_fare + fuel_surcharge + tax + child_tax_adj,
+        'refundable': a.find('Refundable').text,
+        'free_baggage': a.find('FreeBaggage').text,
+        'agency_commission': float(a.find('AgencyCommission').text),
+        'child_commission': float(a.find('ChildCommission').text) if a.find('ChildCommission') is not None else 0,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the per-element Availability decoder against the find()-per-field baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        element = ET.fromstring(AVAILABILITY_XML)
+        if find_per_field(element) != parsers.AVAILABILITY.decode(element):
+            raise AssertionError('Schema decoder output differs from the baseline')
+
+        number, repeat = options['number'], options['repeat']
+        timings = {}
+        for name, decode in (('find per field', find_per_field), ('schema', parsers.AVAILABILITY.decode)):
+            best = min(timeit.repeat(lambda: decode(element), number=number, repeat=repeat))
+            timings[name] = best / number * 1e6
+            self.stdout.write(f"{name:>15}: {timings[name]:.2f} us/element")
+
+        self.stdout.write(f"speedup: {timings['find per field'] / timings['schema']:.2f}x")
@@ -0,0 +1,77 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from bookings import fastpath
+from bookings.models import User, Airline, Sector, Booking, Passenger
+from bookings.serializer import BookingSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+def create_bookings(count, passengers_per_booking):
+    user = User.objects.create_user(username='bench_serializers', user_id='BENCH_SERIALIZERS')
+    airline = Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+    ktm = Sector.objects.create(sector_code='XKT', sector_name='Kathmandu')
+    pkr = Sector.objects.create(sector_code='XPK', sector_name='Pokhara')
+    bookings = Booking.objects.bulk_create([
+        Booking(
+            user=user, pnr=f"PNR{n:06}", airline=airline, flight_id=f"F{n}", flight_no='U4123',
+            flight_date=date(2025, 11, 1), departure=ktm, arrival=pkr, contact_name='TANCHHO LIMBU',
+            contact_email='a@b.com', contact_mobile='9999999999', reservation_status='ISSUED',
+            ttl_date=date(2025, 10, 31),
+        )
+        for n in range(count)
+    ])
+    Passenger.objects.bulk_create([
+        Passenger(
+            booking=booking, title='MR', gender='M', first_name=f"PAX{i}", last_name='LIMBU',
+            nationality='NP', ticket_no=f"{booking.pk:08}{i}", fuel_surcharge=1500, tax=200,
+            itinerary={'pnr_no': booking.pnr, 'free_baggage': '20KG'},
+        )
+        for booking in bookings for i in range(passengers_per_booking)
+    ])
+    return Booking.objects.filter(user=user).order_by('-created_at', '-id')
+
+
+class Command(BaseCommand):
+    help = 'Compare BookingSerializer with the fastpath .values() reader on pages of bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000])
+        parser.add_argument('--passengers', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        #everything runs in a transaction that is rolled back, so the database is left as it was
+        try:
+            with transaction.atomic():
+                queryset = create_bookings(max(options['sizes']), options['passengers'])
+                for size in options['sizes']:
+                    self.bench(queryset[:size], size, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench(self, page, size, repeat):
+        def serializer():
+            return BookingSerializer(page.prefetch_related('passengers'), many=True).data
+
+        def fast():
+            return fastpath.bookings(fastpath.booking_values(page))
+
+        if fast() != serializer():
+            raise AssertionError('fastpath output differs from BookingSerializer')
+
+        rates = {}
+        for name, read in (('serializer', serializer), ('fastpath', fast)):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                read()
+                timings.append(time.perf_counter() - start)
+            rates[name] = size / min(timings)
+            self.stdout.write(f"{size:>5} bookings {name:>10}: {rates[name]:,.0f} rows/s")
+        self.stdout.write(f"{size:>5} bookings    speedup: {rates['fastpath'] / rates['serializer']:.2f}x")
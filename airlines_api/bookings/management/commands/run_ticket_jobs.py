@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from bookings import jobs
+from bookings.models import TicketJob, TicketJobStatus
+
+
+class Command(BaseCommand):
+    help = 'Run issue_ticket jobs still queued after --older-than seconds, e.g. after a worker restarted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=60)
+
+    def handle(self, *args, **options):
+        #jobs left RUNNING are not retried: the ticket may already be issued upstream
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        queued = TicketJob.objects.filter(status=TicketJobStatus.QUEUED, created_at__lt=cutoff).order_by('created_at')
+        count = 0
+        for job_id in queued.values_list('pk', flat=True):
+            jobs.run(job_id)
+            count += 1
+        self.stdout.write(f"Ran {count} queued ticket jobs")
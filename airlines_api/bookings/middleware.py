@@ -0,0 +1,30 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from . import soap, resilience
+
+
+class UpstreamBudgetMiddleware:
+    """Give each request one time budget for all of its upstream SOAP calls.
+
+    Calls made while handling the request get whatever is left of
+    SOAP_RESILIENCE['REQUEST_BUDGET'] as their timeout, so a slow
+    upstream can't hold a worker longer than that, however many calls
+    the view makes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with resilience.budget(soap.resilience_config()['REQUEST_BUDGET']):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with resilience.budget(soap.resilience_config()['REQUEST_BUDGET']):
+            return await self.get_response(request)
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:21
+
+import django.contrib.auth.models
+import django.contrib.auth.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Airline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('airline_id', models.CharField(max_length=50)),
+                ('airline_name', models.CharField(max_length=100)),
+                ('fare', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Sector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sector_code', models.CharField(max_length=3, unique=True)),
+                ('sector_name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=150, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('user_id', models.CharField(max_length=100, unique=True)),
+                ('api_password', models.CharField(max_length=100)),
+                ('agency_id', models.CharField(max_length=100)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Booking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pnr', models.CharField(max_length=50)),
+                ('flight_id', models.CharField(max_length=100)),
+                ('flight_no', models.CharField(max_length=20)),
+                ('flight_date', models.DateField()),
+                ('contact_name', models.CharField(max_length=100)),
+                ('contact_email', models.EmailField(max_length=254)),
+                ('contact_mobile', models.CharField(max_length=20)),
+                ('reservation_status', models.CharField(max_length=20)),
+                ('ttl_date', models.DateField(blank=True, null=True)),
+                ('ttl_time', models.TimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('airline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bookings.airline')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('arrival', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arrivals', to='bookings.sector')),
+                ('departure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='departures', to='bookings.sector')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Passenger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pax_type', models.CharField(choices=[('ADT', 'Adult'), ('CHD', 'Child'), ('INF', 'Infant')], default='ADT')),
+                ('title', models.CharField(max_length=10)),
+                ('gender', models.CharField(max_length=1)),
+                ('first_name', models.CharField(max_length=100)),
+                ('last_name', models.CharField(max_length=100)),
+                ('nationality', models.CharField(max_length=2)),
+                ('ticket_no', models.CharField(blank=True, max_length=50, null=True)),
+                ('fuel_surcharge', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('tax', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('itinerary', models.JSONField(blank=True, default=dict)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passengers', to='bookings.booking')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['pnr'], name='booking_pnr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-created_at'], name='booking_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['flight_date'], name='booking_flight_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('ttl_date__isnull', False)), fields=['ttl_date', 'ttl_time'], name='booking_ttl_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='passenger',
+            index=models.Index(condition=models.Q(('ticket_no__isnull', False)), fields=['ticket_no'], name='passenger_ticket_no_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='passenger',
+            index=models.Index(fields=['booking', 'last_name'], name='passenger_booking_name_idx'),
+        ),
+    ]
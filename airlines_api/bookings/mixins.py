@@ -1,3 +1,9 @@
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from . import generations
+
 class UserAuthenticationMixin:
 
     def get_user_credentials(self):
@@ -15,4 +21,42 @@ class UserAuthenticationMixin:
         return self.request.user.api_password
     
     def get_agency_id(self):
-        return self.request.user.agency_id
\ No newline at end of file
+        return self.request.user.agency_id
+
+class SharedListMixin:
+    """Serve list() from one cached representation shared by every user.
+
+    The representation is keyed by the namespace's generation (see
+    generations.py), which also makes up a strong ETag; Last-Modified is
+    the time the generation was last bumped. Conditional requests are
+    answered with 304 from those two alone, without touching the
+    database, the serializer or the cached body.
+    """
+
+    list_namespace = None
+    list_timeout = 60 * 15
+
+    def list(self, request, *args, **kwargs):
+        generation = generations.current(self.list_namespace)
+        #one body per negotiated format, e.g. json vs the browsable API
+        fmt = request.accepted_renderer.format
+        etag = quote_etag(f"{self.list_namespace}-{generation}-{fmt}")
+        last_modified = generations.modified(self.list_namespace)
+        headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'private, no-cache'}
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return self._not_modified(not_modified, headers)
+
+        key = f"{self.list_namespace}_g{generation}_data"
+        data = cache.get(key)
+        if data is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            data = self.get_serializer(queryset, many=True).data
+            cache.set(key, data, timeout=self.list_timeout)
+        return Response(data, headers=headers)
+
+    def _not_modified(self, response, headers):
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
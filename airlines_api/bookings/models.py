@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
@@ -38,6 +39,21 @@ class Booking(models.Model):
     ttl_time = models.TimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            #get_itinerary / get_pnr_detail
+            models.Index(fields=['pnr'], name='booking_pnr_idx'),
+            #a user's bookings, newest first
+            models.Index(fields=['user', '-created_at'], name='booking_user_created_idx'),
+            models.Index(fields=['flight_date'], name='booking_flight_date_idx'),
+            #only held reservations have a ticketing time limit
+            models.Index(
+                fields=['ttl_date', 'ttl_time'],
+                condition=models.Q(ttl_date__isnull=False),
+                name='booking_ttl_idx',
+            ),
+        ]
+
 
 class Passenger(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='passengers')
@@ -53,4 +69,44 @@ class Passenger(models.Model):
     ticket_no = models.CharField(max_length=50, blank=True, null=True)
     fuel_surcharge = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     tax = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
-    
+    #the passenger's itinerary row as parsed from IssueTicket, served back by get_itinerary
+    itinerary = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            #passengers are only ticketed once issued
+            models.Index(
+                fields=['ticket_no'],
+                condition=models.Q(ticket_no__isnull=False),
+                name='passenger_ticket_no_idx',
+            ),
+            #(pnr, last_name): the booking is found by pnr, then its passenger by last name
+            models.Index(fields=['booking', 'last_name'], name='passenger_booking_name_idx'),
+        ]
+
+
+class TicketJobStatus(models.TextChoices):
+    QUEUED = 'queued', 'Queued'
+    RUNNING = 'running', 'Running'
+    DONE = 'done', 'Done'
+    FAILED = 'failed', 'Failed'
+
+#an issue_ticket request accepted in async mode, run by bookings/jobs.py
+class TicketJob(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=TicketJobStatus.choices, default=TicketJobStatus.QUEUED)
+    #the validated IssueTicketSerializer data
+    payload = models.JSONField()
+    itinerary = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    error_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            #run_ticket_jobs picks up jobs left queued
+            models.Index(fields=['status', 'created_at'], name='ticketjob_status_idx'),
+        ]
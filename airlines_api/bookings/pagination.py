@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor (keyset) pagination: every page is one indexed range scan.
+
+    Unlike page numbers there is no COUNT(*) and no OFFSET, so the cost
+    of a page does not grow with the table or with how deep the client
+    has paged. Ordering ends in the primary key to keep it total.
+    """
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
+
+class IdKeysetPagination(KeysetPagination):
+    #for models without a created_at
+    ordering = ('-id',)
@@ -0,0 +1,362 @@
+from xml.parsers import expat
+from . import xmlbackend
+
+BOOK_NS = '{http://booking.us.org/}'
+
+CHUNK_SIZE = 64 * 1024
+
+
+#converters; TEXT keeps the element text as is
+TEXT = None
+INT = int
+FLOAT = float
+
+
+class Schema:
+    """Compiled field table for one kind of record element.
+
+    Each field is (tag, output key, converter, default). decode() walks
+    the element's children once and looks each tag up in a dict instead
+    of running a find() per field; keys whose tag is missing or empty keep
+    their default. Keys listed in derived are computed from the decoded
+    record.
+    """
+
+    def __init__(self, fields, derived=None, namespace=''):
+        self.fields = fields
+        self.derived = derived or {}
+        self.namespace = namespace
+        self.by_tag = {
+            namespace + tag: (key, convert, default)
+            for tag, key, convert, default in fields if tag is not None
+        }
+        self.defaults = {key: default for tag, key, convert, default in fields}
+
+    def with_namespace(self, namespace):
+        return Schema(self.fields, self.derived, namespace)
+
+    def decode(self, elem):
+        record = self.defaults.copy()
+        by_tag = self.by_tag
+        for child in elem:
+            field = by_tag.get(child.tag)
+            if field is not None:
+                key, convert, default = field
+                if convert is None:
+                    record[key] = child.text
+                elif child.text:
+                    record[key] = convert(child.text)
+        for key, compute in self.derived.items():
+            record[key] = compute(record)
+        return record
+
+
+def _total_adult_fare(f):
+    return f['adult_fare'] + f['fuel_surcharge'] + f['tax']
+
+
+def _total_child_fare(f):
+    return f['child_fare'] + f['fuel_surcharge'] + f['tax'] + f['child_tax_adjustment']
+
+
+#one <Availability> element, as returned by FlightAvailability and GetFlightDetail
+AVAILABILITY = Schema([
+    ('Airline', 'airline', TEXT, None),
+    ('AirlineLogo', 'airline_logo', TEXT, None),
+    ('FlightDate', 'flight_date', TEXT, None),
+    ('FlightNo', 'flight_no', TEXT, None),
+    ('Departure', 'departure', TEXT, None),
+    ('DepartureTime', 'departure_time', TEXT, None),
+    ('Arrival', 'arrival', TEXT, None),
+    ('ArrivalTime', 'arrival_time', TEXT, None),
+    ('AircraftType', 'aircraft_type', TEXT, None),
+    ('Adult', 'adult', INT, 0),
+    ('Child', 'child', INT, 0),
+    ('Infant', 'infant', INT, 0),
+    ('FlightId', 'flight_id', TEXT, None),
+    ('FlightClassCode', 'flight_class_code', TEXT, None),
+    ('Currency', 'currency', TEXT, None),
+    ('AdultFare', 'adult_fare', FLOAT, 0),
+    ('ChildFare', 'child_fare', FLOAT, 0),
+    ('InfantFare', 'infant_fare', FLOAT, 0),
+    ('FuelSurcharge', 'fuel_surcharge', FLOAT, 0),
+    ('Tax', 'tax', FLOAT, 0),
+    ('ChildTaxAdjustment', 'child_tax_adjustment', FLOAT, 0),
+    (None, 'total_adult_fare', None, 0),
+    (None, 'total_child_fare', None, 0),
+    ('Refundable', 'refundable', TEXT, None),
+    ('FreeBaggage', 'free_baggage', TEXT, None),
+    ('AgencyCommission', 'agency_commission', FLOAT, 0),
+    ('ChildCommission', 'child_commission', FLOAT, 0),
+], derived={
+    'total_adult_fare': _total_adult_fare,
+    'total_child_fare': _total_child_fare,
+})
+
+INBOUND_AVAILABILITY = Schema([
+    ('Airline', 'airline', TEXT, None),
+    ('FlightDate', 'flight_date', TEXT, None),
+    ('FlightNo', 'flight_no', TEXT, None),
+    ('Departure', 'departure', TEXT, None),
+    ('DepartureTime', 'departure_time', TEXT, None),
+    ('Arrival', 'arrival', TEXT, None),
+    ('ArrivalTime', 'arrival_time', TEXT, None),
+    ('FlightId', 'flight_id', TEXT, None),
+    ('AdultFare', 'adult_fare', FLOAT, 0),
+    ('ChildFare', 'child_fare', FLOAT, 0),
+    ('FuelSurcharge', 'fuel_surcharge', FLOAT, 0),
+    ('Tax', 'tax', FLOAT, 0),
+    ('ChildTaxAdjustment', 'child_tax_adjustment', FLOAT, 0),
+    (None, 'total_adult_fare', None, 0),
+    (None, 'total_child_fare', None, 0),
+], derived={
+    'total_adult_fare': _total_adult_fare,
+    'total_child_fare': _total_child_fare,
+})
+
+#one <Passenger> of an itinerary, as returned by IssueTicket and GetItinerary
+ITINERARY_PASSENGER = Schema([
+    ('Airline', 'airline', TEXT, None),
+    ('PnrNo', 'pnr_no', TEXT, None),
+    ('Title', 'title', TEXT, None),
+    ('Gender', 'gender', TEXT, None),
+    ('FirstName', 'first_name', TEXT, None),
+    ('LastName', 'last_name', TEXT, None),
+    ('PaxType', 'pax_type', TEXT, None),
+    ('Nationality', 'nationality', TEXT, None),
+    ('IssueFrom', 'issue_from', TEXT, None),
+    ('AgencyName', 'agency_name', TEXT, None),
+    ('IssueDate', 'issue_date', TEXT, None),
+    ('IssueBy', 'issue_by', TEXT, None),
+    ('FlightNo', 'flight_no', TEXT, None),
+    ('FlightDate', 'flight_date', TEXT, None),
+    ('Departure', 'departure', TEXT, None),
+    ('FlightTime', 'flight_time', TEXT, None),
+    ('TicketNo', 'ticket_no', TEXT, None),
+    ('BarCodeValue', 'barcode_value', TEXT, None),
+    ('BarcodeImage', 'barcode_image', TEXT, None),
+    ('Arrival', 'arrival', TEXT, None),
+    ('ArrivalTime', 'arrival_time', TEXT, None),
+    ('Sector', 'sector', TEXT, None),
+    ('ClassCode', 'class_code', TEXT, None),
+    ('Currency', 'currency', TEXT, None),
+    ('Fare', 'fare', TEXT, None),
+    ('Surcharge', 'surcharge', TEXT, None),
+    ('TaxCurrency', 'tax_currency', TEXT, None),
+    ('Tax', 'tax', TEXT, None),
+    ('CommissionAmount', 'commission_amount', TEXT, None),
+    ('Refundable', 'refundable', TEXT, None),
+    ('ReportingTime', 'reporting_time', TEXT, None),
+    ('FreeBaggage', 'free_baggage', TEXT, None),
+])
+
+ISSUED_PASSENGER = ITINERARY_PASSENGER.with_namespace(BOOK_NS)
+
+#one <TicketDetail> of a SalesReport
+TICKET_DETAIL = Schema([
+    ('PnrNo', 'pnr_no', TEXT, None),
+    ('Airline', 'airline', TEXT, None),
+    ('IssueDate', 'issue_date', TEXT, None),
+    ('FlightNo', 'flight_no', TEXT, None),
+    ('FlightDate', 'flight_date', TEXT, None),
+    ('SectorPair', 'sector_pair', TEXT, None),
+    ('ClassCode', 'class_code', TEXT, None),
+    ('TicketNo', 'ticket_no', TEXT, None),
+    ('PassengerName', 'passenger_name', TEXT, None),
+    ('Nationality', 'nationality', TEXT, None),
+    ('PaxType', 'pax_type', TEXT, None),
+    ('Currency', 'currency', TEXT, None),
+    ('Fare', 'fare', TEXT, None),
+    ('FSC', 'fsc', TEXT, None),
+    ('TAX', 'tax', TEXT, None),
+])
+
+SECTOR = Schema([
+    ('SectorCode', 'sector_code', TEXT, None),
+    ('SectorName', 'sector_name', TEXT, None),
+])
+
+BALANCE = Schema([
+    ('AirlineName', 'airline_name', TEXT, None),
+    ('AgencyName', 'agency_name', TEXT, None),
+    ('BalanceAmount', 'balance_amount', TEXT, None),
+])
+
+PNR_DETAIL = Schema([
+    ('AirlineID', 'airline_id', TEXT, None),
+    ('FlightId', 'flight_id', TEXT, None),
+    ('PNRNO', 'pnr_no', TEXT, None),
+    ('ReservationStatus', 'reservation_status', TEXT, None),
+    ('TTLDate', 'ttl_date', TEXT, None),
+    ('TTLTime', 'ttl_time', TEXT, None),
+])
+
+parse_availability = AVAILABILITY.decode
+parse_inbound_availability = INBOUND_AVAILABILITY.decode
+
+
+class AvailabilityStream:
+    """Incremental parser for FlightAvailability responses.
+
+    The envelope is read with expat and the text of its <return> element,
+    which holds the escaped availability document, is fed straight into a
+    pull parser. Each <Availability> is handed out as soon as its end tag
+    arrives and dropped afterwards, so neither document is ever held in
+    memory as a whole.
+    """
+
+    def __init__(self):
+        self.envelope = expat.ParserCreate(namespace_separator='}')
+        self.envelope.StartElementHandler = self._start
+        self.envelope.EndElementHandler = self._end
+        self.envelope.CharacterDataHandler = self._data
+        self.availability = xmlbackend.pull_parser()
+        self.in_return = False
+        self.found_return = False
+        self.direction = None
+        self.parent = None
+
+    def _start(self, name, attrs):
+        if name == 'http://booking.us.org/}return':
+            self.in_return = True
+            self.found_return = True
+
+    def _end(self, name):
+        if name == 'http://booking.us.org/}return':
+            self.in_return = False
+
+    def _data(self, data):
+        if self.in_return:
+            self.availability.feed(data)
+
+    def _events(self):
+        for event, elem in self.availability.read_events():
+            if event == 'start':
+                if elem.tag in ('Outbound', 'Inbound'):
+                    self.direction = elem.tag
+                    self.parent = elem
+            elif elem.tag == 'Availability' and self.direction is not None:
+                yield self.direction, elem
+                #drop the finished element so memory stays flat
+                self.parent.remove(elem)
+            elif elem.tag in ('Outbound', 'Inbound'):
+                self.direction = None
+
+    def feed(self, chunk):
+        self.envelope.Parse(chunk, False)
+        yield from self._events()
+
+    def close(self):
+        self.envelope.Parse(b'', True)
+        if not self.found_return:
+            raise ValueError('FlightAvailability response has no <return> element')
+        self.availability.close()
+        yield from self._events()
+
+
+def iter_flight_availability(chunks):
+    """Yield ('Outbound' | 'Inbound', <Availability>) pairs from raw response bytes."""
+    stream = AvailabilityStream()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+
+def _collect_availability(result, direction, a):
+    if direction == 'Outbound':
+        result['outbound_flights'].append(parse_availability(a))
+    else:
+        result['inbound_flights'].append(parse_inbound_availability(a))
+
+
+def parse_flight_availability_stream(chunks):
+    result = {'outbound_flights': [], 'inbound_flights': []}
+    for direction, a in iter_flight_availability(chunks):
+        _collect_availability(result, direction, a)
+    return result
+
+
+async def aparse_flight_availability_stream(chunks):
+    result = {'outbound_flights': [], 'inbound_flights': []}
+    stream = AvailabilityStream()
+    async for chunk in chunks:
+        for direction, a in stream.feed(chunk):
+            _collect_availability(result, direction, a)
+    for direction, a in stream.close():
+        _collect_availability(result, direction, a)
+    return result
+
+
+def parse_flight_availability(content):
+    if isinstance(content, str):
+        content = content.encode()
+    return parse_flight_availability_stream([content])
+
+
+def soap_return(content):
+    #text of the <book:return> element most operations wrap their payload in
+    return xmlbackend.find(xmlbackend.fromstring(content), 'return').text
+
+
+def parse_sector_codes(content):
+    sector_xml = xmlbackend.fromstring(soap_return(content).strip())
+    return [SECTOR.decode(sector) for sector in sector_xml.findall('Sector')]
+
+
+def parse_balance(content):
+    balance_xml = xmlbackend.fromstring(soap_return(content).strip())
+    return [BALANCE.decode(airline) for airline in balance_xml.findall('Airline')]
+
+
+def parse_reservation(content):
+    return PNR_DETAIL.decode(xmlbackend.fromstring(soap_return(content).strip()))
+
+
+def parse_flight_detail(content):
+    root = xmlbackend.fromstring(content)
+    return AVAILABILITY.decode(xmlbackend.find(root, 'Availability'))
+
+
+def parse_issue_ticket(content):
+    root = xmlbackend.fromstring(content)
+    itinerary = xmlbackend.find(root, 'Itinerary')
+    return [ISSUED_PASSENGER.decode(p) for p in itinerary.findall(f"{BOOK_NS}Passenger")]
+
+
+def parse_itinerary(content):
+    root = xmlbackend.fromstring(content)
+    itinerary = xmlbackend.fromstring(xmlbackend.find(root, 'Itinerary').text.strip())
+    return [ITINERARY_PASSENGER.decode(p) for p in itinerary.findall('Passenger')]
+
+
+def parse_sales_report(content):
+    root = xmlbackend.fromstring(content)
+    sales_summary = xmlbackend.find(root, 'SalesSummary')
+    return [TICKET_DETAIL.decode(t) for t in sales_summary.findall('TicketDetail')]
+
+
+def _sales_events(parser, state):
+    for event, elem in parser.read_events():
+        if event == 'start':
+            if elem.tag == f"{BOOK_NS}SalesSummary":
+                state['summary'] = elem
+        elif elem.tag == 'TicketDetail' and state['summary'] is not None:
+            yield TICKET_DETAIL.decode(elem)
+            state['summary'].remove(elem)
+
+
+def iter_sales_report(chunks):
+    """Yield SalesReport TicketDetail rows from raw response bytes as they are parsed.
+
+    Each row is dropped from the tree once decoded, so memory does not
+    grow with the size of the report.
+    """
+    parser = xmlbackend.pull_parser()
+    state = {'summary': None}
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from _sales_events(parser, state)
+    parser.close()
+    yield from _sales_events(parser, state)
+    if state['summary'] is None:
+        raise ValueError('SalesReport response has no <SalesSummary> element')
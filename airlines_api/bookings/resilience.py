@@ -0,0 +1,164 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class UpstreamError(Exception):
+    """The upstream could not be reached or answered in time."""
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamTimeout):
+    pass
+
+
+class CircuitOpen(UpstreamUnavailable):
+    def __init__(self, alias, retry_after):
+        super().__init__(f"Upstream endpoint '{alias}' is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream endpoint.
+
+    After `failures` failed calls in a row the circuit opens and calls
+    fail immediately for `reset_timeout` seconds. Then a single trial
+    call is let through (half-open): success closes the circuit again,
+    failure re-opens it.
+    """
+
+    def __init__(self, alias, failures=5, reset_timeout=30):
+        self.alias = alias
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_timeout or self._trial:
+                raise CircuitOpen(self.alias, max(self.reset_timeout - waited, 1))
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release(self):
+        #the call ended without an answer or an upstream failure, e.g. it was cancelled
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+_deadline = contextvars.ContextVar('soap_deadline', default=None)
+
+
+@contextmanager
+def budget(seconds):
+    """Give every upstream call made inside the block a share of one overall time budget.
+
+    Nested budgets can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    #seconds left in the current budget, None outside of one
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def backoff(attempt, base, cap):
+    #"full jitter": a random wait up to the exponential bound
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class HedgePolicy:
+    """When to send a second copy of a slow read-only call.
+
+    Keeps the latencies of the last `window` calls and hedges a call
+    once it has been outstanding longer than their `percentile`. Hedges
+    are capped at `max_percent` of recent calls, so a stalling upstream
+    never sees more than that much extra load.
+    """
+
+    def __init__(self, percentile=95, window=200, min_samples=20, max_percent=5):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_percent = max_percent
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        #one flag per recent call or hedge, True for hedges
+        self._sent = deque(maxlen=window)
+        self._hedges = 0
+
+    def _push(self, hedge):
+        if len(self._sent) == self._sent.maxlen and self._sent[0]:
+            self._hedges -= 1
+        self._sent.append(hedge)
+        self._hedges += hedge
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        #None until there are enough samples to know what slow means
+        with self._lock:
+            if not self._latencies or len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)]
+
+    def begin(self):
+        with self._lock:
+            self._push(False)
+
+    def allow_hedge(self):
+        with self._lock:
+            calls = len(self._sent) - self._hedges
+            if (self._hedges + 1) * 100 > calls * self.max_percent:
+                return False
+            self._push(True)
+            return True
@@ -0,0 +1,362 @@
+import base64
+import contextvars
+import csv
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from . import soap, parsers, envelopes, singleflight
+
+DEFAULT_CACHE = {
+    'PAST_TTL': 60 * 60 * 24 * 30,
+    'TODAY_TTL': 60 * 5,
+    #missing days are fetched in windows of at most this many days, all at once
+    'WINDOW_DAYS': 31,
+    'MAX_WORKERS': 8,
+}
+
+#upstream date format, e.g. 01-NOV-2025
+DATE_FORMAT = '%d-%b-%Y'
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+#longest from_date..to_date one request may ask for
+MAX_RANGE_DAYS = 366
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def cache_config():
+    return {**DEFAULT_CACHE, **getattr(settings, 'SALES_REPORT_CACHE', {})}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=cache_config()['MAX_WORKERS'],
+                    thread_name_prefix='sales'
+                )
+    return _executor
+
+
+def parse_date(value):
+    return datetime.strptime(value.strip(), DATE_FORMAT).date()
+
+
+def format_date(day):
+    return day.strftime(DATE_FORMAT).upper()
+
+
+def day_key(user_id, day):
+    return f"sales_{user_id}_{day:%Y%m%d}"
+
+
+def days_between(from_date, to_date):
+    return [from_date + timedelta(days=n) for n in range((to_date - from_date).days + 1)]
+
+
+def windows(days, size):
+    """Group sorted days into runs of consecutive days, at most size long."""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][-1] == timedelta(days=1) and len(runs[-1]) < size:
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+
+def fetch_window(user_creds, days):
+    """Pull one window from upstream and split it into per-day shards.
+
+    Returns (shards, tickets); shards is None when a ticket's IssueDate
+    can't be placed on one of the requested days, in which case the
+    window is served but not cached. Concurrent requests for the same
+    window, e.g. right after its shards expired, share one upstream call.
+    """
+    from_date, to_date = format_date(days[0]), format_date(days[-1])
+    tickets = singleflight.do(
+        singleflight.flight_key('SalesReport', user_creds['strUserId'], from_date, to_date),
+        lambda: parsers.parse_sales_report(
+            soap.call('SalesReport', envelopes.sales_report(user_creds, from_date, to_date)).content
+        )
+    )
+
+    shards = {day: [] for day in days}
+    for ticket in tickets:
+        try:
+            shards[parse_date(ticket['issue_date'])].append(ticket)
+        except (KeyError, ValueError, AttributeError):
+            return None, tickets
+    return shards, tickets
+
+
+def store(user_id, shards):
+    conf = cache_config()
+    today = timezone.localdate()
+    past = {day_key(user_id, day): tickets for day, tickets in shards.items() if day < today}
+    current = {day_key(user_id, day): tickets for day, tickets in shards.items() if day >= today}
+    if past:
+        cache.set_many(past, timeout=conf['PAST_TTL'])
+    if current:
+        cache.set_many(current, timeout=conf['TODAY_TTL'])
+
+
+def load(user_creds, days):
+    """({day: tickets}, uncached) for sorted days, filling the cache on the way.
+
+    Only the missing days go upstream, grouped into consecutive windows
+    that are fetched concurrently; tickets of a window that can't be
+    split into day shards come back in uncached instead.
+    """
+    user_id = user_creds['strUserId']
+    cached = cache.get_many([day_key(user_id, day) for day in days])
+
+    by_day = {day: cached[day_key(user_id, day)] for day in days if day_key(user_id, day) in cached}
+    missing = [day for day in days if day not in by_day]
+    futures = [
+        get_executor().submit(contextvars.copy_context().run, fetch_window, user_creds, window)
+        for window in windows(missing, cache_config()['WINDOW_DAYS'])
+    ]
+
+    uncached = []
+    fetched = {}
+    for future in futures:
+        shards, tickets = future.result()
+        if shards is None:
+            uncached.extend(tickets)
+        else:
+            fetched.update(shards)
+    if fetched:
+        store(user_id, fetched)
+    by_day.update(fetched)
+    return by_day, uncached
+
+
+def report(user_creds, from_date, to_date):
+    """Tickets issued from from_date to to_date, in day order.
+
+    Each day is cached on its own, so overlapping ranges share shards.
+    """
+    days = days_between(from_date, to_date)
+    by_day, uncached = load(user_creds, days)
+    return [ticket for day in days for ticket in by_day.get(day, ())] + uncached
+
+
+def stream_window(user_creds, days):
+    """Stream one window from upstream as (day, ticket) pairs while it is parsed.
+
+    A day is cached as soon as the upstream moves on to a later IssueDate.
+    That relies on tickets coming in IssueDate order; if one doesn't, the
+    days already written are dropped again and the rest is only streamed.
+    """
+    user_id = user_creds['strUserId']
+    response = soap.call(
+        'SalesReport',
+        envelopes.sales_report(user_creds, format_date(days[0]), format_date(days[-1])),
+        stream=True
+    )
+    pending = iter(days)
+    day = next(pending)
+    shard = []
+    stored = []
+    caching = True
+    with response:
+        for ticket in parsers.iter_sales_report(response.raw.stream(parsers.CHUNK_SIZE, decode_content=True)):
+            if caching:
+                try:
+                    issued = parse_date(ticket['issue_date'])
+                except (ValueError, AttributeError):
+                    issued = None
+                if issued is None or not day <= issued <= days[-1]:
+                    caching = False
+                    cache.delete_many([day_key(user_id, d) for d in stored])
+                else:
+                    while day < issued:
+                        store(user_id, {day: shard})
+                        stored.append(day)
+                        shard = []
+                        day = next(pending)
+                    shard.append(ticket)
+            yield day, ticket
+    if caching:
+        store(user_id, {day: shard, **{rest: [] for rest in pending}})
+
+
+def iter_report(user_creds, from_date, to_date):
+    """Yield (day, ticket) for the range in day order without building the report.
+
+    Cached days are read WINDOW_DAYS at a time and missing runs are
+    streamed from upstream, so memory is bounded by one window however
+    long the range is.
+    """
+    user_id = user_creds['strUserId']
+    days = days_between(from_date, to_date)
+    size = cache_config()['WINDOW_DAYS']
+    for start in range(0, len(days), size):
+        batch = days[start:start + size]
+        cached = cache.get_many([day_key(user_id, day) for day in batch])
+        missing = []
+        for day in batch:
+            key = day_key(user_id, day)
+            if key not in cached:
+                missing.append(day)
+                continue
+            if missing:
+                yield from stream_window(user_creds, missing)
+                missing = []
+            for ticket in cached.pop(key):
+                yield day, ticket
+        if missing:
+            yield from stream_window(user_creds, missing)
+
+
+def encode_cursor(day, offset):
+    return base64.urlsafe_b64encode(f"{day:%Y%m%d}.{offset}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    day, offset = base64.urlsafe_b64decode(cursor.encode()).decode().split('.')
+    return datetime.strptime(day, '%Y%m%d').date(), int(offset)
+
+
+def page(user_creds, from_date, to_date, cursor=None, page_size=100):
+    """One page of the report and the cursor of the next one (None on the last page).
+
+    A cursor is the day and position within that day of the page's first ticket.
+    Days are loaded WINDOW_DAYS at a time through load(), so every window a
+    page touches is cached in full and the following pages are served from
+    the cache instead of asking upstream for the rest of the range again.
+    """
+    start, skip = decode_cursor(cursor) if cursor else (from_date, 0)
+    if not from_date <= start <= to_date:
+        raise ValueError('cursor is outside the requested range')
+
+    rows = []
+    days = days_between(start, to_date)
+    size = cache_config()['WINDOW_DAYS']
+    for n in range(0, len(days), size):
+        batch = days[n:n + size]
+        by_day, uncached = load(user_creds, batch)
+        if uncached:
+            #tickets that couldn't be placed on a day are paged after the window's last one
+            by_day[batch[-1]] = [*by_day.get(batch[-1], ()), *uncached]
+        for day in batch:
+            tickets = by_day.get(day, ())
+            for offset in range(skip if day == start else 0, len(tickets)):
+                if len(rows) == page_size:
+                    return rows, encode_cursor(day, offset)
+                rows.append(tickets[offset])
+    return rows, None
+
+
+class _Line:
+    #file-like target for csv.writer that hands back the row it was given
+    def write(self, value):
+        return value
+
+
+def write_ndjson(tickets):
+    for ticket in tickets:
+        yield json.dumps(ticket) + '\n'
+
+
+def write_csv(tickets):
+    writer = csv.DictWriter(_Line(), fieldnames=list(parsers.TICKET_DETAIL.defaults), extrasaction='ignore')
+    yield writer.writeheader()
+    for ticket in tickets:
+        yield writer.writerow(ticket)
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', write_ndjson),
+    'csv': ('text/csv', write_csv),
+}
+
+
+#columns sales summaries can be grouped by, and the amounts they add up
+GROUP_FIELDS = ('airline', 'sector_pair', 'pax_type', 'class_code', 'issue_date')
+AMOUNT_FIELDS = ('fare', 'fsc', 'tax')
+
+
+def _amounts(values):
+    #upstream amounts are strings; missing or malformed ones count as 0
+    try:
+        return np.array([value or 0 for value in values], dtype=float)
+    except ValueError:
+        amounts = np.zeros(len(values))
+        for i, value in enumerate(values):
+            try:
+                amounts[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return amounts
+
+
+def load_columns(tickets):
+    """Columnar arrays of the group and amount fields of an iterable of tickets."""
+    columns = {field: [] for field in GROUP_FIELDS + AMOUNT_FIELDS}
+    for ticket in tickets:
+        for field, column in columns.items():
+            column.append(ticket.get(field))
+    return {
+        **{field: np.array([v or '' for v in columns[field]], dtype=object) for field in GROUP_FIELDS},
+        **{field: _amounts(columns[field]) for field in AMOUNT_FIELDS},
+    }
+
+
+def _totals(count, sums):
+    total = sum(sums.values())
+    return {
+        'tickets': int(count),
+        **{field: round(float(value), 2) for field, value in sums.items()},
+        'total': round(float(total), 2),
+        'average_fare': round(float(sums['fare'] / count), 2) if count else 0.0,
+        'average_total': round(float(total / count), 2) if count else 0.0,
+    }
+
+
+def summarize(columns, group_by):
+    """Grouped ticket counts, sums and averages, computed with numpy.
+
+    Each group column is factorized with np.unique, the codes are folded
+    into a single group id and every sum is one np.bincount over it.
+    """
+    size = len(columns[AMOUNT_FIELDS[0]])
+    codes = []
+    labels = []
+    for field in group_by:
+        values, inverse = np.unique(columns[field], return_inverse=True)
+        labels.append(values)
+        codes.append(inverse)
+
+    if size and group_by:
+        dims = tuple(len(values) for values in labels)
+        ids, group = np.unique(np.ravel_multi_index(codes, dims), return_inverse=True)
+        keys = np.unravel_index(ids, dims)
+    else:
+        ids, group, keys = np.zeros(1 if size else 0), np.zeros(size, dtype=np.intp), ()
+
+    counts = np.bincount(group, minlength=len(ids))
+    sums = {field: np.bincount(group, weights=columns[field], minlength=len(ids)) for field in AMOUNT_FIELDS}
+    groups = [
+        {
+            **{field: labels[n][keys[n][i]] for n, field in enumerate(group_by)},
+            **_totals(counts[i], {field: sums[field][i] for field in AMOUNT_FIELDS}),
+        }
+        for i in range(len(ids))
+    ]
+    groups.sort(key=lambda g: -g['total'])
+    return {
+        'group_by': list(group_by),
+        'groups': groups,
+        'totals': _totals(size, {field: columns[field].sum() for field in AMOUNT_FIELDS}),
+    }
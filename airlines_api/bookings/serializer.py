@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import *
+from . import lookups, batch
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,6 +10,8 @@ class UserSerializer(serializers.ModelSerializer):
             'api_password',
             'agency_id'
         ]
+        #the upstream password is only ever written, never listed
+        extra_kwargs = {'api_password': {'write_only': True}}
 
 class SectorSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,7 +26,8 @@ class AirlineSerializer(serializers.ModelSerializer):
 class PassengerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Passenger
-        fields = '__all__'
+        #the stored IssueTicket row is only served back through get_itinerary
+        exclude = ['itinerary']
 
 class BookingSerializer(serializers.ModelSerializer):
     passengers = PassengerSerializer(many=True, read_only=True)
@@ -34,9 +38,38 @@ class BookingSerializer(serializers.ModelSerializer):
                   'contact_mobile', 'reservation_status', 'ttl_date', 'ttl_time', 
                   'passengers']
 
+class LookupRelatedField(serializers.Field):
+    """PrimaryKeyRelatedField resolved from an in-process lookups table instead of the database."""
+
+    default_error_messages = serializers.PrimaryKeyRelatedField.default_error_messages
+
+    def __init__(self, table, **kwargs):
+        #the table's name in bookings.lookups; fields are deep-copied per serializer instance
+        self.table_name = table
+        super().__init__(**kwargs)
+
+    @property
+    def table(self):
+        return getattr(lookups, self.table_name)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except ValueError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.table.get('pk', pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+    def to_representation(self, value):
+        return value.pk
+
 class FlightAvailabilitySerializer(serializers.Serializer):
-    sector_from = serializers.PrimaryKeyRelatedField(queryset=Sector.objects.all())
-    sector_to = serializers.PrimaryKeyRelatedField(queryset=Sector.objects.all())
+    sector_from = LookupRelatedField('sectors')
+    sector_to = LookupRelatedField('sectors')
     flight_date = serializers.CharField()
     trip_type = serializers.CharField()
     return_date = serializers.CharField(required=False, allow_blank=True)
@@ -44,6 +77,20 @@ class FlightAvailabilitySerializer(serializers.Serializer):
     adult = serializers.IntegerField()
     child = serializers.IntegerField()
     client_ip = serializers.CharField(required = True)
+    #fan-out mode: search every configured airline (or the given subset) at once
+    fan_out = serializers.BooleanField(required=False, default=False)
+    airlines = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate_airlines(self, value):
+        unknown = [airline_id for airline_id in value if lookups.airlines.get('airline_id', airline_id) is None]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown airlines: {', '.join(unknown)}")
+        return value
+
+    def fan_out_airlines(self):
+        return self.validated_data.get('airlines') or list(
+            dict.fromkeys(airline.airline_id for airline in lookups.airlines.all())
+        )
 
 class ReservationSerializer(serializers.Serializer):
     flight_id = serializers.CharField()
@@ -66,6 +113,19 @@ class IssueTicketSerializer(serializers.Serializer):
     contact_mobile = serializers.CharField()
     passenger_detail = PassengerDetailSerializer(many=True)
 
+    def get_fields(self):
+        fields = super().get_fields()
+        #queue the upstream call as a TicketJob and answer 202; 'async' is a keyword, so it can't be declared above
+        fields['async'] = serializers.BooleanField(required=False, default=False)
+        return fields
+
+class TicketJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = TicketJob
+        fields = ['job_id', 'status', 'itinerary', 'error', 'error_status', 'created_at', 'finished_at']
+
 class GetItinerarySerializer(serializers.Serializer):
     pno_no = serializers.CharField()
     ticket_no = serializers.CharField()
@@ -74,6 +134,37 @@ class GetItinerarySerializer(serializers.Serializer):
 class GetFlightDetailsSerializer(serializers.Serializer):
     flight_id = serializers.CharField()
 
+def validate_batch_size(items):
+    limit = batch.config()['MAX_ITEMS']
+    if len(items) > limit:
+        raise serializers.ValidationError(f"At most {limit} items per batch")
+    return items
+
+class BatchFlightDetailSerializer(serializers.Serializer):
+    flight_ids = serializers.ListField(child=serializers.CharField(), allow_empty=False, validators=[validate_batch_size])
+
+class ItineraryLookupSerializer(serializers.Serializer):
+    pnr_no = serializers.CharField(required=False, allow_blank=True, default='')
+    ticket_no = serializers.CharField(required=False, allow_blank=True, default='')
+    airline_id = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, attrs):
+        if not attrs['pnr_no'] and not attrs['ticket_no']:
+            raise serializers.ValidationError('pnr_no or ticket_no is required')
+        return attrs
+
+class BatchItinerarySerializer(serializers.Serializer):
+    items = ItineraryLookupSerializer(many=True, allow_empty=False, validators=[validate_batch_size])
+
+    def validate_items(self, items):
+        #two different lookups under one result key would lose one of the results
+        seen = {}
+        for item in items:
+            key = batch.itinerary_key(item)
+            if seen.setdefault(key, item) != item:
+                raise serializers.ValidationError(f"{key} is given more than once with a different ticket_no or airline_id")
+        return items
+
 class SalesReportSerializer(serializers.Serializer):
     from_date = serializers.CharField()
     to_date = serializers.CharField()
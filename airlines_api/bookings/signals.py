@@ -1,11 +1,18 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Sector
-from django.core.cache import cache
+from .models import Sector, Airline, Booking, Passenger
+from . import lookups, generations
 
 @receiver([post_save, post_delete], sender=Sector)
 def invalidate_sector_cache(sender, **kwargs):
+    lookups.sectors.invalidate()
 
-    print("Invalidating sector cache")
+@receiver([post_save, post_delete], sender=Airline)
+def invalidate_airline_cache(sender, **kwargs):
+    lookups.airlines.invalidate()
 
-    cache.delete_pattern('*sector_list*')
\ No newline at end of file
+#booking lists embed their passengers, so a change to either moves both namespaces
+@receiver([post_save, post_delete], sender=Booking)
+@receiver([post_save, post_delete], sender=Passenger)
+def invalidate_booking_cache(sender, **kwargs):
+    generations.invalidate('booking', 'passenger')
\ No newline at end of file
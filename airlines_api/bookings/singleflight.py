@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from . import resilience
+
+DEFAULT_SINGLE_FLIGHT = {
+    #how long a leader that died mid-call can hold the key for everyone else
+    'LOCK_TIMEOUT': 30,
+    #followers in other workers pick the leader's result up from the cache
+    'RESULT_TTL': 10,
+    'POLL_INTERVAL': 0.05,
+}
+
+_MISSING = object()
+
+
+def config():
+    return {**DEFAULT_SINGLE_FLIGHT, **getattr(settings, 'SINGLE_FLIGHT', {})}
+
+
+def flight_key(operation, *args):
+    """Key for one upstream call: the operation and its normalized arguments."""
+    digest = hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+    return f"singleflight_{operation}_{digest}"
+
+
+def _wait_time():
+    left = resilience.remaining()
+    timeout = config()['LOCK_TIMEOUT']
+    return timeout if left is None else min(left, timeout)
+
+
+def _lead(key, token, fn):
+    try:
+        value = fn()
+        cache.set(f"{key}_{token}", value, timeout=config()['RESULT_TTL'])
+        return value
+    finally:
+        if cache.get(f"{key}_lock") == token:
+            cache.delete(f"{key}_lock")
+
+
+def _shared(key, fn):
+    #one caller per key across workers takes the cache lock; the rest poll for its result
+    conf = config()
+    deadline = time.monotonic() + _wait_time()
+    while True:
+        token = uuid.uuid4().hex
+        if cache.add(f"{key}_lock", token, timeout=conf['LOCK_TIMEOUT']):
+            return _lead(key, token, fn)
+        token = cache.get(f"{key}_lock")
+        if token is not None:
+            break
+
+    while time.monotonic() < deadline:
+        time.sleep(conf['POLL_INTERVAL'])
+        value = cache.get(f"{key}_{token}", _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(f"{key}_lock") != token:
+            #the result is written before the lock is released
+            value = cache.get(f"{key}_{token}", _MISSING)
+            if value is not _MISSING:
+                return value
+            break
+    #the leader failed or is too slow for this request: go upstream ourselves
+    return fn()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def do(key, fn):
+    """fn() run once for every concurrent caller with the same key.
+
+    Threads of this process wait on the first caller, which coordinates
+    with other workers through a lock in the cache, so a key makes one
+    upstream call at a time across the deployment. Every caller gets
+    the same object back and must treat it as read-only.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _shared(key, fn)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+async def _alead(key, token, afn):
+    try:
+        value = await afn()
+        await cache.aset(f"{key}_{token}", value, timeout=config()['RESULT_TTL'])
+        return value
+    finally:
+        if await cache.aget(f"{key}_lock") == token:
+            await cache.adelete(f"{key}_lock")
+
+
+async def _ashared(key, afn):
+    conf = config()
+    deadline = time.monotonic() + _wait_time()
+    while True:
+        token = uuid.uuid4().hex
+        if await cache.aadd(f"{key}_lock", token, timeout=conf['LOCK_TIMEOUT']):
+            return await _alead(key, token, afn)
+        token = await cache.aget(f"{key}_lock")
+        if token is not None:
+            break
+
+    while time.monotonic() < deadline:
+        await asyncio.sleep(conf['POLL_INTERVAL'])
+        value = await cache.aget(f"{key}_{token}", _MISSING)
+        if value is not _MISSING:
+            return value
+        if await cache.aget(f"{key}_lock") != token:
+            value = await cache.aget(f"{key}_{token}", _MISSING)
+            if value is not _MISSING:
+                return value
+            break
+    return await afn()
+
+
+#asyncio futures belong to the event loop that created them
+_aflights = weakref.WeakKeyDictionary()
+
+
+async def ado(key, afn):
+    flights = _aflights.setdefault(asyncio.get_running_loop(), {})
+    flight = flights.get(key)
+    if flight is not None:
+        #waiting doesn't cancel the leader if this caller is cancelled
+        await asyncio.wait([flight])
+        if flight.cancelled():
+            return await ado(key, afn)
+        return flight.result()
+
+    flight = flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        value = await _ashared(key, afn)
+        flight.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except BaseException as e:
+        flight.set_exception(e)
+        #mark it retrieved, there may be no follower to read it
+        flight.exception()
+        raise
+    finally:
+        del flights[key]
@@ -0,0 +1,462 @@
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from . import resilience
+from .resilience import UpstreamError, UpstreamTimeout, UpstreamUnavailable, DeadlineExceeded, CircuitOpen
+
+SOAP_HEADERS = {'Content-Type': 'text/xml; charset=utf-8'}
+
+DEFAULT_ENDPOINT = {
+    'URL': '',
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 30,
+    'ASYNC_POOL_SIZE': 200,
+}
+
+DEFAULT_RESILIENCE = {
+    'REQUEST_BUDGET': 30,
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+    'BACKOFF_MAX': 2,
+    'BREAKER_FAILURES': 5,
+    'BREAKER_RESET': 30,
+}
+
+DEFAULT_HEDGING = {
+    'ENABLED': False,
+    'OPERATIONS': ('GetFlightDetail', 'GetItinerary', 'CheckBalance'),
+    'PERCENTILE': 95,
+    'MAX_PERCENT': 5,
+    'WINDOW': 200,
+    'MIN_SAMPLES': 20,
+    'MAX_WORKERS': 32,
+}
+
+#read-only operations, safe to send again after a timeout or a gateway error
+IDEMPOTENT_OPERATIONS = frozenset({'GetFlightDetail', 'GetItinerary', 'SalesReport', 'CheckBalance', 'SectorCode'})
+
+#gateway errors count against the endpoint; a 500 carries a SOAP Fault and is passed through
+TRANSIENT_STATUS = frozenset({502, 503, 504})
+
+
+class SoapTransport:
+    """Keep-alive connection pool for one upstream SOAP endpoint.
+
+    One instance is shared by every thread of a worker process, so
+    connections opened for one request are reused by the next one.
+    """
+
+    def __init__(self, url, pool_size=10, connect_timeout=3.05, read_timeout=30):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def post(self, body, timeout=None, stream=False):
+        with self._lock:
+            self._requests += 1
+        return self.session.post(
+            self.url,
+            data=body,
+            headers=SOAP_HEADERS,
+            timeout=timeout or self.timeout,
+            stream=stream,
+        )
+
+    def stats(self):
+        pools = self.adapter.poolmanager.pools
+        connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        with self._lock:
+            sent = self._requests
+        return {
+            'url': self.url,
+            'requests': sent,
+            'connections_opened': connections,
+            'connections_reused': max(sent - connections, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncSoapTransport:
+    """asyncio counterpart of SoapTransport for ASGI views.
+
+    A single event loop can keep hundreds of upstream calls in flight,
+    bounded by the endpoint's ASYNC_POOL_SIZE.
+    """
+
+    def __init__(self, url, pool_size=200, connect_timeout=3.05, read_timeout=30):
+        self.url = url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.client = httpx.AsyncClient(
+            headers=SOAP_HEADERS,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._requests = 0
+
+    async def post(self, body, timeout=None, stream=False):
+        self._requests += 1
+        request = self.client.build_request('POST', self.url, content=body, timeout=timeout or self.timeout)
+        return await self.client.send(request, stream=stream)
+
+    def stats(self):
+        return {'url': self.url, 'requests': self._requests}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def endpoint_for(operation):
+    return getattr(settings, 'SOAP_OPERATION_ENDPOINTS', {}).get(operation, 'default')
+
+
+def endpoint_config(alias='default'):
+    endpoints = getattr(settings, 'SOAP_ENDPOINTS', {})
+    return {**DEFAULT_ENDPOINT, **endpoints.get(alias, endpoints.get('default', {}))}
+
+
+def get_transport(alias='default'):
+    transport = _transports.get(alias)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.get(alias)
+            if transport is None:
+                conf = endpoint_config(alias)
+                transport = SoapTransport(
+                    conf['URL'],
+                    pool_size=conf['POOL_SIZE'],
+                    connect_timeout=conf['CONNECT_TIMEOUT'],
+                    read_timeout=conf['READ_TIMEOUT'],
+                )
+                _transports[alias] = transport
+    return transport
+
+
+#httpx clients are bound to the event loop they were first used on; only ASGI requests use
+#them, where that loop lives as long as the worker (see async_views.AsyncBookingView)
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport(alias='default'):
+    transports = _async_transports.setdefault(asyncio.get_running_loop(), {})
+    transport = transports.get(alias)
+    if transport is None:
+        conf = endpoint_config(alias)
+        transport = AsyncSoapTransport(
+            conf['URL'],
+            pool_size=conf['ASYNC_POOL_SIZE'],
+            connect_timeout=conf['CONNECT_TIMEOUT'],
+            read_timeout=conf['READ_TIMEOUT'],
+        )
+        transports[alias] = transport
+    return transport
+
+
+def resilience_config():
+    return {**DEFAULT_RESILIENCE, **getattr(settings, 'SOAP_RESILIENCE', {})}
+
+
+_breakers = {}
+
+
+def get_breaker(alias='default'):
+    breaker = _breakers.get(alias)
+    if breaker is None:
+        with _transports_lock:
+            breaker = _breakers.get(alias)
+            if breaker is None:
+                conf = resilience_config()
+                breaker = resilience.CircuitBreaker(alias, conf['BREAKER_FAILURES'], conf['BREAKER_RESET'])
+                _breakers[alias] = breaker
+    return breaker
+
+
+def _timeouts(default, timeout):
+    #(connect, read) for one attempt, cut down to what is left of the request budget
+    connect, read = default
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+    elif timeout is not None:
+        read = timeout
+    left = resilience.remaining()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        raise DeadlineExceeded('Request budget spent before the upstream call')
+    return min(connect, left), min(read, left)
+
+
+def _backoff(attempt):
+    #None when the wait would not fit in the request budget
+    conf = resilience_config()
+    wait = resilience.backoff(attempt, conf['BACKOFF'], conf['BACKOFF_MAX'])
+    left = resilience.remaining()
+    if left is not None and wait >= left:
+        return None
+    return wait
+
+
+def _attempts(operation):
+    return 1 + resilience_config()['RETRIES'] if operation in IDEMPOTENT_OPERATIONS else 1
+
+
+def _upstream_error(operation, exc):
+    if is_timeout(exc):
+        return UpstreamTimeout(f"{operation} timed out")
+    return UpstreamUnavailable(f"{operation} failed: {exc}")
+
+
+def _call(operation, body, timeout=None, stream=False):
+    alias = endpoint_for(operation)
+    transport = get_transport(alias)
+    breaker = get_breaker(alias)
+    attempts = _attempts(operation)
+    for attempt in range(attempts):
+        timeouts = _timeouts(transport.timeout, timeout)
+        breaker.before_call()
+        try:
+            response = transport.post(body, timeout=timeouts, stream=stream)
+        except requests.RequestException as e:
+            breaker.record_failure()
+            error = _upstream_error(operation, e)
+            error.__cause__ = e
+        except BaseException:
+            #give a half-open trial back, or the circuit would stay open for good
+            breaker.release()
+            raise
+        else:
+            if response.status_code not in TRANSIENT_STATUS:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            response.close()
+            error = UpstreamUnavailable(f"{operation} returned HTTP {response.status_code}")
+
+        wait = _backoff(attempt) if attempt + 1 < attempts else None
+        if wait is None:
+            break
+        time.sleep(wait)
+    raise error
+
+
+async def _acall(operation, body, timeout=None, stream=False):
+    alias = endpoint_for(operation)
+    transport = get_async_transport(alias)
+    breaker = get_breaker(alias)
+    attempts = _attempts(operation)
+    for attempt in range(attempts):
+        connect, read = _timeouts((transport.timeout.connect, transport.timeout.read), timeout)
+        breaker.before_call()
+        try:
+            response = await transport.post(body, timeout=httpx.Timeout(read, connect=connect), stream=stream)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            error = _upstream_error(operation, e)
+            error.__cause__ = e
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if response.status_code not in TRANSIENT_STATUS:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            await response.aclose()
+            error = UpstreamUnavailable(f"{operation} returned HTTP {response.status_code}")
+
+        wait = _backoff(attempt) if attempt + 1 < attempts else None
+        if wait is None:
+            break
+        await asyncio.sleep(wait)
+    raise error
+
+
+def hedging_config():
+    return {**DEFAULT_HEDGING, **getattr(settings, 'SOAP_HEDGING', {})}
+
+
+def is_hedged(operation):
+    #only read-only operations: a hedged IssueTicket could issue twice
+    conf = hedging_config()
+    return conf['ENABLED'] and operation in conf['OPERATIONS'] and operation in IDEMPOTENT_OPERATIONS
+
+
+_hedge_policies = {}
+_hedge_executor = None
+
+
+def get_hedge_policy(operation):
+    policy = _hedge_policies.get(operation)
+    if policy is None:
+        with _transports_lock:
+            policy = _hedge_policies.get(operation)
+            if policy is None:
+                conf = hedging_config()
+                policy = resilience.HedgePolicy(
+                    percentile=conf['PERCENTILE'],
+                    window=conf['WINDOW'],
+                    min_samples=conf['MIN_SAMPLES'],
+                    max_percent=conf['MAX_PERCENT'],
+                )
+                _hedge_policies[operation] = policy
+    return policy
+
+
+def get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _transports_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=hedging_config()['MAX_WORKERS'],
+                    thread_name_prefix='soap-hedge'
+                )
+    return _hedge_executor
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _hedged_call(operation, body, timeout, stream):
+    policy = get_hedge_policy(operation)
+    policy.begin()
+    executor = get_hedge_executor()
+
+    def attempt():
+        start = time.monotonic()
+        response = _call(operation, body, timeout, stream)
+        policy.record(time.monotonic() - start)
+        return response
+
+    pending = {executor.submit(contextvars.copy_context().run, attempt)}
+    delay = policy.delay()
+    if delay is not None and not wait(pending, timeout=delay).done and policy.allow_hedge():
+        pending.add(executor.submit(contextvars.copy_context().run, attempt))
+
+    winner = error = None
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+            elif winner is None:
+                winner = future
+            else:
+                future.result().close()
+    #a request already on the wire can't be recalled; its connection is released when it lands
+    for future in pending:
+        if not future.cancel():
+            future.add_done_callback(_close_response)
+    if winner is None:
+        raise error
+    return winner.result()
+
+
+async def _ahedged_call(operation, body, timeout, stream):
+    policy = get_hedge_policy(operation)
+    policy.begin()
+
+    async def attempt():
+        start = time.monotonic()
+        response = await _acall(operation, body, timeout, stream)
+        policy.record(time.monotonic() - start)
+        return response
+
+    pending = {asyncio.ensure_future(attempt())}
+    delay = policy.delay()
+    if delay is not None:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and policy.allow_hedge():
+            pending.add(asyncio.ensure_future(attempt()))
+
+    winner = error = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif winner is None:
+                    winner = task
+                else:
+                    await task.result().aclose()
+    finally:
+        for task in pending:
+            task.cancel()
+    if winner is None:
+        raise error
+    return winner.result()
+
+
+def call(operation, body, timeout=None, stream=False):
+    """Send a SOAP envelope through the pooled transport of the operation's endpoint.
+
+    Every attempt goes through the endpoint's circuit breaker and gets a
+    timeout capped by the request budget. Idempotent operations are
+    retried with jittered backoff on timeouts, connection errors and
+    502/503/504. Failures surface as UpstreamError subclasses.
+
+    With SOAP_HEDGING enabled, a hedged operation that is still waiting
+    after the recent latency percentile is sent a second time and the
+    first answer wins.
+    """
+    if is_hedged(operation):
+        return _hedged_call(operation, body, timeout, stream)
+    return _call(operation, body, timeout, stream)
+
+
+async def acall(operation, body, timeout=None, stream=False):
+    if is_hedged(operation):
+        return await _ahedged_call(operation, body, timeout, stream)
+    return await _acall(operation, body, timeout, stream)
+
+
+def is_timeout(exc):
+    return isinstance(exc, (requests.Timeout, httpx.TimeoutException, TimeoutError, UpstreamTimeout))
+
+
+def http_status(exc):
+    """(status code, headers) to answer the client with for an UpstreamError."""
+    if isinstance(exc, CircuitOpen):
+        return 503, {'Retry-After': str(int(exc.retry_after + 0.5))}
+    if isinstance(exc, UpstreamTimeout):
+        return 504, {}
+    return 502, {}
+
+
+def stats():
+    return {alias: transport.stats() for alias, transport in list(_transports.items())}
+
+
+def reset_transports():
+    with _transports_lock:
+        for transport in _transports.values():
+            transport.close()
+        _transports.clear()
+        _async_transports.clear()
+        _breakers.clear()
+        _hedge_policies.clear()
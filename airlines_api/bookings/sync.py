@@ -0,0 +1,37 @@
+from django.db import transaction
+from .models import Sector
+from .signals import invalidate_sector_cache
+
+
+def sync_sectors(rows):
+    """Upsert SectorCode rows in one transaction, skipping unchanged names.
+
+    Returns the synced sectors in upstream order and the number of
+    sectors inserted, updated and left unchanged. bulk_create does not
+    send post_save, so the sector cache is invalidated once on commit.
+    """
+    names = {row['sector_code']: row['sector_name'] for row in rows}
+
+    with transaction.atomic():
+        existing = dict(
+            Sector.objects.filter(sector_code__in=names).values_list('sector_code', 'sector_name')
+        )
+        inserted = [code for code in names if code not in existing]
+        updated = [code for code in names if code in existing and existing[code] != names[code]]
+
+        changed = inserted + updated
+        if changed:
+            Sector.objects.bulk_create(
+                [Sector(sector_code=code, sector_name=names[code]) for code in changed],
+                update_conflicts=True,
+                unique_fields=['sector_code'],
+                update_fields=['sector_name'],
+            )
+            invalidate_sector_cache(sender=Sector)
+
+    sectors = Sector.objects.in_bulk(list(names), field_name='sector_code')
+    return [sectors[code] for code in names], {
+        'inserted': len(inserted),
+        'updated': len(updated),
+        'unchanged': len(names) - len(changed),
+    }
@@ -1,8 +1,38 @@
+import asyncio
+import io
+import json
+import httpx
+import threading
+import time
+import requests
+import urllib3
+import xml.etree.ElementTree as ET
+import datetime
+from datetime import timedelta
+from django.utils import timezone
 from .models import *
+from .serializer import BookingSerializer, PassengerSerializer
 from django.urls import reverse
+from django.utils.http import parse_http_date
 from rest_framework.test import APITestCase
 from rest_framework import status
-from unittest.mock import Mock, patch
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+from django.test import SimpleTestCase, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from . import soap, availability, parsers, xmlbackend, envelopes, lookups, generations, sales, fastpath, resilience, singleflight, jobs
+from .management.commands.bench_decoders import AVAILABILITY_XML, find_per_field
+
+
+def soap_response(body, status_code=200):
+    #a real requests.Response whose body can be read through .raw like an upstream reply
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = urllib3.HTTPResponse(body=io.BytesIO(body.encode()), status=status_code, preload_content=False)
+    return response
 
 class SectorAPITestCase(APITestCase):
     def setUp(self):
@@ -19,12 +49,59 @@ class SectorAPITestCase(APITestCase):
 
         self.sector_list_url = reverse('sector-list')
         self.sector_code_url = reverse('sector-sector-code')
+        cache.clear()
 
     def test_get_all_sectors(self):
         response = self.client.get(self.sector_list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
+    def test_sector_list_is_shared_and_revalidated_with_etag(self):
+        first = self.client.get(self.sector_list_url)
+        etag = first.headers['ETag']
+        self.assertTrue(first.headers['Last-Modified'])
+
+        other = User.objects.create_user(username='other', password='otherpass', user_id='USER002')
+        self.client.force_authenticate(other)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.sector_list_url)
+        self.assertEqual(second.headers['ETag'], etag)
+        self.assertEqual(second.data, first.data)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.sector_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.client.get(self.sector_list_url, HTTP_IF_MODIFIED_SINCE=first.headers['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_last_modified_follows_changes_not_cache_fills(self):
+        first = self.client.get(self.sector_list_url).headers['Last-Modified']
+        #the cached body expiring and being rebuilt later is not a change
+        cache.delete(f"sector_g{generations.current('sector')}_data")
+        with patch('bookings.generations.time.time', return_value=time.time() + 3600):
+            response = self.client.get(self.sector_list_url, HTTP_IF_MODIFIED_SINCE=first)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['Last-Modified'], first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Sector.objects.create(sector_code='BWA', sector_name='Bhairahawa')
+        response = self.client.get(self.sector_list_url, HTTP_IF_MODIFIED_SINCE=first)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(parse_http_date(response.headers['Last-Modified']), parse_http_date(first))
+
+    def test_sector_change_invalidates_the_etag(self):
+        etag = self.client.get(self.sector_list_url).headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Sector.objects.create(sector_code='BWA', sector_name='Bhairahawa')
+
+        response = self.client.get(self.sector_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.data), 3)
+
     
     def test_get_single_sector(self):
         sector_detail_url = reverse('sector-detail', kwargs={'pk': self.sector1.pk})
@@ -33,12 +110,11 @@ class SectorAPITestCase(APITestCase):
         self.assertEqual(response.data['sector_code'], 'KTM')
         self.assertEqual(response.data['sector_name'], 'Kathmandu')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_sector_code_return_sector_name_and_code(self, mock_post):
         # self.client.login(username='testuser', password='testpass123')
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = f"""
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
         xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -58,13 +134,46 @@ class SectorAPITestCase(APITestCase):
                 </book:SectorCodeResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
         
         response = self.client.post(self.sector_code_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['sectors']), 2)
 
+    @patch('bookings.generations.bump')
+    @patch('bookings.soap.SoapTransport.post')
+    def test_sector_code_bulk_upserts_only_changed_sectors(self, mock_post, mock_bump):
+        mock_post.return_value = soap_response("""
+        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+        xmlns:book="http://booking.us.org/">
+            <soapenv:Body>
+                <book:SectorCodeResponse>
+                    <book:return><![CDATA[
+                        <FlightSector>
+                            <Sector><SectorCode>KTM</SectorCode><SectorName>Kathmandu</SectorName></Sector>
+                            <Sector><SectorCode>PKR</SectorCode><SectorName>POKHARA</SectorName></Sector>
+                            <Sector><SectorCode>BWA</SectorCode><SectorName>Bhairahawa</SectorName></Sector>
+                        </FlightSector>
+                    ]]></book:return>
+                </book:SectorCodeResponse>
+            </soapenv:Body>
+        </soapenv:Envelope>
+        """)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.sector_code_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            (response.data['inserted'], response.data['updated'], response.data['unchanged']),
+            (1, 1, 1)
+        )
+        self.assertEqual([s['sector_code'] for s in response.data['sectors']], ['KTM', 'PKR', 'BWA'])
+        self.assertEqual(Sector.objects.get(sector_code='PKR').sector_name, 'POKHARA')
+        self.assertEqual(Sector.objects.count(), 3)
+        mock_bump.assert_called_once_with('sector')
+
 class AirlineAPITestCase(APITestCase):
     def setUp(self):
         self.admin_user = User.objects.create_superuser(
@@ -87,6 +196,7 @@ class AirlineAPITestCase(APITestCase):
 
         self.airline_list_url = reverse('airline-list')
         self.check_balance_url = reverse('airline-check-balance')
+        cache.clear()
 
     def test_get_airlines_requires_authentication(self):
         response = self.client.get(self.airline_list_url)
@@ -98,6 +208,17 @@ class AirlineAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
+    def test_airline_list_cache_is_invalidated_on_save(self):
+        self.client.force_authenticate(user=self.normal_user)
+        self.assertEqual(len(self.client.get(self.airline_list_url).data), 2)
+
+        Airline.objects.create(airline_id='S9', airline_name='Shree Airlines')
+        self.assertEqual(len(self.client.get(self.airline_list_url).data), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Airline.objects.filter(airline_id='S9').get().save()
+        self.assertEqual(len(self.client.get(self.airline_list_url).data), 3)
+
     def test_get_single_airline(self):
         self.client.force_authenticate(user=self.normal_user)
         airline_detail_url = reverse('airline-detail', kwargs={'pk': self.airline_buddha.pk})
@@ -106,12 +227,11 @@ class AirlineAPITestCase(APITestCase):
         self.assertEqual(response.data['airline_name'], 'Buddha Air')
         self.assertEqual(response.data['airline_id'], 'U4')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_check_balance_returns_correct_structure(self, mock_post):
         self.client.force_authenticate(user=self.normal_user)
 
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -128,7 +248,7 @@ class AirlineAPITestCase(APITestCase):
                 </book:CheckBalanceResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
 
         mock_post.return_value = mock_response
 
@@ -151,12 +271,11 @@ class ReservationAPITestCase(APITestCase):
 
         self.reservation_url = reverse('booking-test-reservation')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_reservation_success(self, mock_post):
         self.client.force_authenticate(user=self.user)
 
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -174,7 +293,7 @@ class ReservationAPITestCase(APITestCase):
                 </book:ReservationResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -198,12 +317,12 @@ class FlightAvailabilityAPITestCase(APITestCase):
         self.sector_ktm = Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
         self.sector_pkr = Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
         self.flight_availability_url = reverse('booking-test-flight-availability')
+        cache.clear()
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_flight_availability_one_way(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" book="" xmlns:book="http://booking.us.org/">
             <soapenv:Body>
                 <book:FlightAvailabilityResponse>
@@ -241,7 +360,7 @@ class FlightAvailabilityAPITestCase(APITestCase):
                 </book:FlightAvailabilityResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -261,11 +380,10 @@ class FlightAvailabilityAPITestCase(APITestCase):
         self.assertEqual(response.data['outbound_flights'][0]['flight_id'], 'abc-123-def')
         self.assertEqual(response.data['outbound_flights'][0]['total_adult_fare'], 6700)  # 5000+1500+200
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_flight_availability_round_trip(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
          <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" book="" xmlns:book="http://booking.us.org/">
             <soapenv:Body>
                 <book:FlightAvailabilityResponse>
@@ -316,7 +434,7 @@ class FlightAvailabilityAPITestCase(APITestCase):
                 </book:FlightAvailabilityResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -336,7 +454,345 @@ class FlightAvailabilityAPITestCase(APITestCase):
         self.assertIn('inbound_flights', response.data)
         self.assertEqual(len(response.data['inbound_flights']), 1)
 
+class AvailabilitySearchTestBase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123',
+            user_id='USER001', api_password='apipass123', agency_id='AGENCY001'
+        )
+        self.sector_ktm = Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        self.sector_pkr = Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        Airline.objects.create(airline_id='YT', airline_name='Yeti Airlines')
+        Airline.objects.create(airline_id='S9', airline_name='Shree Airlines')
+        self.flight_availability_url = reverse('booking-test-flight-availability')
+        cache.clear()
+        self.data = {
+            'sector_from': self.sector_ktm.pk,
+            'sector_to': self.sector_pkr.pk,
+            'flight_date': '30-09-2025',
+            'trip_type': 'O',
+            'nationality': 'NP',
+            'adult': 1,
+            'child': 0,
+            'client_ip': '127.0.0.1',
+            'fan_out': True,
+        }
+
+    def availability_response(self, airline, fare, commission=0):
+        mock_response = soap_response(f"""
+        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">
+            <soapenv:Body>
+                <book:FlightAvailabilityResponse>
+                    <book:return><![CDATA[
+                    <Flightavailability>
+                        <Outbound>
+                            <Availability>
+                                <Airline>{airline}</Airline>
+                                <FlightId>{airline}-1</FlightId>
+                                <AdultFare>{fare}</AdultFare>
+                                <FuelSurcharge>1500</FuelSurcharge>
+                                <Tax>200</Tax>
+                                <AgencyCommission>{commission}</AgencyCommission>
+                            </Availability>
+                        </Outbound>
+                        <Inbound/>
+                    </Flightavailability>]]></book:return>
+                </book:FlightAvailabilityResponse>
+            </soapenv:Body>
+        </soapenv:Envelope>
+        """)
+        return mock_response
+
+    def fake_upstream(self, body, timeout=None, **kwargs):
+        if b'<strAirlineId>S9</strAirlineId>' in body:
+            raise requests.Timeout()
+        if b'<strAirlineId>YT</strAirlineId>' in body:
+            return self.availability_response('YT', 4000)
+        return self.availability_response('U4', 5000)
+
+
+class FlightAvailabilityFanOutTestCase(AvailabilitySearchTestBase):
+    @patch('bookings.soap.SoapTransport.post')
+    def test_fan_out_merges_all_airlines_and_marks_timeouts(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.fake_upstream
+
+        response = self.client.post(self.flight_availability_url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual([f['flight_id'] for f in response.data['outbound_flights']], ['YT-1', 'U4-1'])
+        self.assertEqual(response.data['carriers'], {'U4': 'ok', 'YT': 'ok', 'S9': 'timeout'})
+        self.assertEqual(response.data['timed_out'], ['S9'])
+
+    @override_settings(AVAILABILITY_FAN_OUT={'DEADLINE': 0.3})
+    @patch('bookings.soap.SoapTransport.post')
+    def test_searches_still_queued_at_the_deadline_are_cancelled(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        released = threading.Event()
+        mock_post.side_effect = lambda body, timeout=None, **kwargs: released.wait(5) and self.fake_upstream(body)
+        #one thread: the first search stalls and the other two wait behind it
+        executor = ThreadPoolExecutor(max_workers=1)
+        with patch('bookings.availability.get_executor', return_value=executor):
+            response = self.client.post(self.flight_availability_url, self.data, format='json')
+        released.set()
+        executor.shutdown(wait=True)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['carriers'].values()), ['skipped', 'skipped', 'timeout'])
+        self.assertEqual(sorted(response.data['timed_out']), sorted(response.data['carriers']))
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_fan_out_requested_subset(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.fake_upstream
+
+        response = self.client.post(self.flight_availability_url, {**self.data, 'airlines': ['U4']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(response.data['carriers'], {'U4': 'ok'})
+
+    def test_fan_out_rejects_unknown_airline(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(self.flight_availability_url, {**self.data, 'airlines': ['ZZ']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class LookupTableTestCase(AvailabilitySearchTestBase):
+    def test_validation_does_not_query_the_database_once_warm(self):
+        from .serializer import FlightAvailabilitySerializer
+        serializer = FlightAvailabilitySerializer(data=self.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.fan_out_airlines()
+
+        with self.assertNumQueries(0):
+            serializer = FlightAvailabilitySerializer(data=self.data)
+            self.assertTrue(serializer.is_valid())
+            self.assertEqual(serializer.validated_data['sector_from'].sector_code, 'KTM')
+            self.assertEqual(serializer.fan_out_airlines(), ['U4', 'YT', 'S9'])
+
+    def test_unknown_sector_is_rejected(self):
+        from .serializer import FlightAvailabilitySerializer
+        serializer = FlightAvailabilitySerializer(data={**self.data, 'sector_to': 9999})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['sector_to'], ['Invalid pk "9999" - object does not exist.'])
+
+    def test_version_bump_reloads_other_workers(self):
+        self.assertEqual(lookups.airlines.get('airline_id', 'U4').airline_name, 'Buddha Air')
+        #a row changed by another worker: only the shared version counter moves here
+        Airline.objects.filter(airline_id='U4').update(airline_name='Buddha Air Pvt')
+        generations.bump('airline')
+
+        with override_settings(LOOKUP_TABLES_CHECK_INTERVAL=0):
+            self.assertEqual(lookups.airlines.get('airline_id', 'U4').airline_name, 'Buddha Air Pvt')
+
+    def test_saved_rows_are_picked_up_after_commit(self):
+        lookups.airlines.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            Airline.objects.create(airline_id='H9', airline_name='Himalaya Airlines')
+        self.assertIsNotNone(lookups.airlines.get('airline_id', 'H9'))
+
+class FlightAvailabilityCacheTestCase(AvailabilitySearchTestBase):
+    def setUp(self):
+        super().setUp()
+        self.data['fan_out'] = False
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_repeated_search_is_served_from_cache(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = lambda *args, **kwargs: self.availability_response('U4', 5000)
+
+        first = self.client.post(self.flight_availability_url, self.data, format='json')
+        second = self.client.post(
+            self.flight_availability_url,
+            {**self.data, 'client_ip': '10.0.0.9', 'nationality': 'np'},
+            format='json'
+        )
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(mock_post.call_count, 1)
+
+        third = self.client.post(self.flight_availability_url, {**self.data, 'adult': 2}, format='json')
+        self.assertEqual(third['X-Cache'], 'MISS')
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_hit_and_miss_counts_are_reported_to_staff(self, mock_post):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(reverse('stats')).status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = User.objects.create_user(username='staff', user_id='STAFF', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        before = self.client.get(reverse('stats')).data['availability_cache']
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = self.availability_response('U4', 5000)
+        self.client.post(self.flight_availability_url, self.data, format='json')
+        self.client.post(self.flight_availability_url, self.data, format='json')
+
+        self.client.force_authenticate(user=staff)
+        response = self.client.get(reverse('stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = response.data['availability_cache']
+        self.assertEqual((after['miss'] - before['miss'], after['hit'] - before['hit']), (1, 1))
+        #post itself is mocked, so only the pool shows up, not its request count
+        self.assertIn('connections_reused', response.data['soap_transports']['default'])
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_stale_entry_is_served_while_refreshing(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = self.availability_response('U4', 5000)
+        self.client.post(self.flight_availability_url, self.data, format='json')
+
+        mock_post.return_value = self.availability_response('U4', 4500)
+        executor = ThreadPoolExecutor(max_workers=1)
+        with patch('bookings.availability.time.time', return_value=time.time() + 120), \
+                patch('bookings.availability.get_refresh_executor', return_value=executor):
+            stale = self.client.post(self.flight_availability_url, self.data, format='json')
+            executor.shutdown(wait=True)
+        self.assertEqual(stale['X-Cache'], 'STALE')
+        self.assertEqual(stale.data['outbound_flights'][0]['adult_fare'], 5000)
+
+        fresh = self.client.post(self.flight_availability_url, self.data, format='json')
+        self.assertEqual(fresh['X-Cache'], 'HIT')
+        self.assertEqual(fresh.data['outbound_flights'][0]['adult_fare'], 4500)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_failed_refresh_is_logged_and_releases_its_claim(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = self.availability_response('U4', 5000)
+        self.client.post(self.flight_availability_url, self.data, format='json')
+
+        mock_post.return_value = soap_response('', status_code=500)
+        with patch('bookings.availability.time.time', return_value=time.time() + 120):
+            for attempt in range(2):
+                executor = ThreadPoolExecutor(max_workers=1)
+                with patch('bookings.availability.get_refresh_executor', return_value=executor), \
+                        self.assertLogs('bookings.availability', 'ERROR'):
+                    stale = self.client.post(self.flight_availability_url, self.data, format='json')
+                    executor.shutdown(wait=True)
+                self.assertEqual(stale['X-Cache'], 'STALE')
+        #the second stale hit could claim a refresh of its own
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_inventory_is_shared_across_agencies_with_own_commission(self, mock_post):
+        other_agency = User.objects.create_user(
+            username='otheruser', password='testpass123',
+            user_id='USER002', api_password='apipass123', agency_id='AGENCY002'
+        )
+        sector_bwa = Sector.objects.create(sector_code='BWA', sector_name='Bhairahawa')
+
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = self.availability_response('U4', 5000, commission=500)
+        first = self.client.post(self.flight_availability_url, self.data, format='json')
+        self.assertEqual(first.data['outbound_flights'][0]['agency_commission'], 500)
+
+        #the other agency is quoted its own commission on the same U4 fare on another route
+        self.client.force_authenticate(user=other_agency)
+        mock_post.return_value = self.availability_response('U4', 5000, commission=200)
+        self.client.post(self.flight_availability_url, {**self.data, 'sector_to': sector_bwa.pk}, format='json')
+
+        shared = self.client.post(self.flight_availability_url, self.data, format='json')
+        self.assertEqual(shared['X-Cache'], 'HIT')
+        self.assertEqual(shared.data['outbound_flights'][0]['adult_fare'], 5000)
+        self.assertEqual(shared.data['outbound_flights'][0]['agency_commission'], 200)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_commission_is_not_extrapolated_to_other_fares(self, mock_post):
+        other_agency = User.objects.create_user(
+            username='otheruser', password='testpass123',
+            user_id='USER002', api_password='apipass123', agency_id='AGENCY002'
+        )
+        sector_bwa = Sector.objects.create(sector_code='BWA', sector_name='Bhairahawa')
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = self.availability_response('U4', 5000, commission=500)
+        self.client.post(self.flight_availability_url, self.data, format='json')
+
+        #a flat 200 on a 4000 fare says nothing about what the 5000 fare pays
+        self.client.force_authenticate(user=other_agency)
+        mock_post.return_value = self.availability_response('U4', 4000, commission=200)
+        self.client.post(self.flight_availability_url, {**self.data, 'sector_to': sector_bwa.pk}, format='json')
+
+        mock_post.return_value = self.availability_response('U4', 5000, commission=200)
+        own = self.client.post(self.flight_availability_url, self.data, format='json')
+        self.assertEqual(own['X-Cache'], 'MISS')
+        self.assertEqual(own.data['outbound_flights'][0]['agency_commission'], 200)
+        self.assertEqual(mock_post.call_count, 3)
+
+class InlineExecutor:
+    #runs submitted work immediately, inside the test's transaction
+    def submit(self, fn, *args):
+        fn(*args)
+
+
 class IssueTicketAPITestCase(APITestCase):
+    issued = """
+    <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" book="" xmlns:book="http://booking.us.org/">
+        <soapenv:Body>
+            <book:IssueTicketResponse>
+                <book:Itinerary>
+                    <book:Passenger>
+                        <book:Airline>U4</book:Airline>
+                        <book:PnrNo>ABC123</book:PnrNo>
+                        <book:Title>MR</book:Title>
+                        <book:Gender>M</book:Gender>
+                        <book:FirstName>TANCHHO</book:FirstName>
+                        <book:LastName>LIMBU</book:LastName>
+                        <book:PaxType>ADULT</book:PaxType>
+                        <book:Nationality>NP</book:Nationality>
+                        <book:IssueFrom>AGENCY001</book:IssueFrom>
+                        <book:AgencyName>Test Agency</book:AgencyName>
+                        <book:IssueDate>21-NOV-2025</book:IssueDate>
+                        <book:IssueBy>USER001</book:IssueBy>
+                        <book:FlightNo>U4123</book:FlightNo>
+                        <book:FlightDate>05-OCT-2025</book:FlightDate>
+                        <book:Departure>KTM</book:Departure>
+                        <book:FlightTime>1000</book:FlightTime>
+                        <book:TicketNo>9999999999</book:TicketNo>
+                        <book:BarCodeValue>5555555</book:BarCodeValue>
+                        <book:BarcodeImage></book:BarcodeImage>
+                        <book:Arrival>PKR</book:Arrival>
+                        <book:ArrivalTime>10:30</book:ArrivalTime>
+                        <book:Sector>KTM-PKR</book:Sector>
+                        <book:ClassCode>Y</book:ClassCode>
+                        <book:Currency>NPR</book:Currency>
+                        <book:Fare>5000</book:Fare>
+                        <book:Surcharge>1500</book:Surcharge>
+                        <book:TaxCurrency>NPR</book:TaxCurrency>
+                        <book:Tax>200</book:Tax>
+                        <book:CommissionAmount>500</book:CommissionAmount>
+                        <book:Refundable>Refundable</book:Refundable>
+                        <book:ReportingTime>One hour in adnvace</book:ReportingTime>
+                        <book:FreeBaggage>20KG</book:FreeBaggage>
+                    </book:Passenger>
+                </book:Itinerary>
+            </book:IssueTicketResponse>
+        </soapenv:Body>
+    </soapenv:Envelope>
+    """
+
+    payload = {
+        'flight_id': 'abc-123-def',
+        'return_flight_id': '',
+        'contact_name': 'TANCHHO LIMBU',
+        'contact_email': 'a@b.com',
+        'contact_mobile': '9999999999',
+        'passenger_detail': [{
+            'pax_type': 'ADULT',
+            'title': 'MR',
+            'gender': 'M',
+            'first_name': 'TANCHHO',
+            'last_name': 'LIMBU',
+            'nationality': 'NP',
+            'remarks': 'N/A'
+        }]
+    }
+
     def setUp(self):
         self.user = User.objects.create_user(
             username='testuser', password='testpass123',
@@ -344,78 +800,145 @@ class IssueTicketAPITestCase(APITestCase):
         )
         self.issue_ticket_url = reverse('booking-test-issue-ticket')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_issue_ticket(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" book="" xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:IssueTicketResponse>
-                    <book:Itinerary>
-                        <book:Passenger>
-                            <book:Airline>U4</book:Airline>
-                            <book:PnrNo>ABC123</book:PnrNo>
-                            <book:Title>MR</book:Title>
-                            <book:Gender>M</book:Gender>
-                            <book:FirstName>TANCHHO</book:FirstName>
-                            <book:LastName>LIMBU</book:LastName>
-                            <book:PaxType>ADULT</book:PaxType>
-                            <book:Nationality>NP</book:Nationality>
-                            <book:IssueFrom>AGENCY001</book:IssueFrom>
-                            <book:AgencyName>Test Agency</book:AgencyName>
-                            <book:IssueDate>21-NOV-2025</book:IssueDate>
-                            <book:IssueBy>USER001</book:IssueBy>
-                            <book:FlightNo>U4123</book:FlightNo>
-                            <book:FlightDate>05-OCT-2025</book:FlightDate>
-                            <book:Departure>KTM</book:Departure>
-                            <book:FlightTime>1000</book:FlightTime>
-                            <book:TicketNo>9999999999</book:TicketNo>
-                            <book:BarCodeValue>5555555</book:BarCodeValue>
-                            <book:BarcodeImage></book:BarcodeImage>
-                            <book:Arrival>PKR</book:Arrival>
-                            <book:ArrivalTime>10:30</book:ArrivalTime>
-                            <book:Sector>KTM-PKR</book:Sector>
-                            <book:ClassCode>Y</book:ClassCode>
-                            <book:Currency>NPR</book:Currency>
-                            <book:Fare>5000</book:Fare>
-                            <book:Surcharge>1500</book:Surcharge>
-                            <book:TaxCurrency>NPR</book:TaxCurrency>
-                            <book:Tax>200</book:Tax>
-                            <book:CommissionAmount>500</book:CommissionAmount>
-                            <book:Refundable>Refundable</book:Refundable>
-                            <book:ReportingTime>One hour in adnvace</book:ReportingTime>
-                            <book:FreeBaggage>20KG</book:FreeBaggage>
-                        </book:Passenger>
-                    </book:Itinerary>
-                </book:IssueTicketResponse>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
-        mock_post.return_value = mock_response
+        mock_post.return_value = soap_response(self.issued)
 
-        data = {
-            'flight_id': 'abc-123-def',
-            'return_flight_id': '',
-            'contact_name': 'TANCHHO LIMBU',
-            'contact_email': 'a@b.com',
-            'contact_mobile': '9999999999',
-            'passenger_detail': [{
-                'pax_type': 'ADULT',
-                'title': 'MR',
-                'gender': 'M',
-                'first_name': 'TANCHHO',
-                'last_name': 'LIMBU',
-                'nationality': 'NP',
-                'remarks': 'N/A'
-            }]
-        }
-        response = self.client.post(self.issue_ticket_url, data, format='json')
+        response = self.client.post(self.issue_ticket_url, self.payload, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('itinerary', response.data)
         self.assertEqual(response.data['itinerary'][0]['ticket_no'], '9999999999')
         self.assertEqual(response.data['itinerary'][0]['pnr_no'], 'ABC123')
 
+    def test_issued_itinerary_is_stored_and_served_locally(self):
+        Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        self.test_issue_ticket()
+
+        booking = Booking.objects.get(pnr='ABC123')
+        self.assertEqual((booking.user, booking.flight_id, booking.flight_no), (self.user, 'abc-123-def', 'U4123'))
+        self.assertEqual((booking.departure.sector_code, booking.arrival.sector_code), ('KTM', 'PKR'))
+        passenger = booking.passengers.get()
+        self.assertEqual((passenger.pax_type, passenger.ticket_no, passenger.tax), ('ADT', '9999999999', 200))
+
+        with patch('bookings.soap.SoapTransport.post') as mock_post, self.assertNumQueries(1):
+            response = self.client.post(reverse('booking-test-get-itinerary'), {'pnr_no': 'ABC123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['itinerary'][0]['ticket_no'], '9999999999')
+        self.assertEqual(response.data['itinerary'][0]['free_baggage'], '20KG')
+        mock_post.assert_not_called()
+
+    def test_stored_itinerary_is_only_served_to_its_owner_on_an_exact_match(self):
+        Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        self.test_issue_ticket()
+        url = reverse('booking-test-get-itinerary')
+
+        other = User.objects.create_user(username='other', user_id='USER002')
+        for user, data in (
+            (None, {'pnr_no': 'ABC123'}),
+            (other, {'pnr_no': 'ABC123'}),
+            (self.user, {'pnr_no': 'ABC123', 'ticket_no': '1234567890'}),
+            (self.user, {'pnr_no': 'ABC123', 'airline_id': 'YT'}),
+        ):
+            self.client.force_authenticate(user)
+            with patch('bookings.soap.SoapTransport.post', return_value=soap_response('', status_code=500)) as mock_post:
+                self.client.post(url, data, format='json')
+            mock_post.assert_called_once()
+
+        #passenger rows don't carry the stored itinerary
+        response = self.client.get(reverse('passenger-list'))
+        self.assertNotIn('itinerary', response.data['results'][0])
+
+    def test_unknown_airline_is_issued_but_not_stored(self):
+        self.test_issue_ticket()
+        self.assertFalse(Booking.objects.exists())
+
+    def issue_async(self, mock_post):
+        #the job runs when the request's transaction commits; here, on the spot
+        with patch('bookings.jobs.get_executor', return_value=InlineExecutor()):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(self.issue_ticket_url, {**self.payload, 'async': True}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(response.data['status'], 'queued')
+            self.assertEqual(response['Location'], reverse('booking-test-ticket-job', kwargs={'job_id': response.data['job_id']}))
+            mock_post.assert_not_called()
+            for callback in callbacks:
+                callback()
+        return response['Location']
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_async_issue_ticket_returns_a_job_to_poll(self, mock_post):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = soap_response(self.issued)
+
+        location = self.issue_async(mock_post)
+        mock_post.assert_called_once()
+        response = self.client.get(location)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['itinerary'][0]['ticket_no'], '9999999999')
+        self.assertTrue(Booking.objects.filter(pnr='ABC123', user=self.user).exists())
+
+        #a job is only ever issued once
+        jobs.run(response.data['job_id'])
+        mock_post.assert_called_once()
+
+        other = User.objects.create_user(username='other', user_id='USER002')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(location).status_code, status.HTTP_404_NOT_FOUND)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_async_issue_ticket_records_upstream_failures(self, mock_post):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = requests.Timeout()
+
+        response = self.client.get(self.issue_async(mock_post))
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error_status'], 504)
+        self.assertIsNone(response.data['itinerary'])
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_async_false_issues_the_ticket_inline(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.return_value = soap_response(self.issued)
+        response = self.client.post(self.issue_ticket_url, {**self.payload, 'async': 'false'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(TicketJob.objects.exists())
+        mock_post.assert_called_once()
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_async_issue_ticket_validates_before_queueing(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(self.issue_ticket_url, {'async': True, 'flight_id': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TicketJob.objects.exists())
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_run_ticket_jobs_picks_up_jobs_left_queued(self, mock_post):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        mock_post.return_value = soap_response(self.issued)
+        stale = TicketJob.objects.create(user=self.user, payload=self.payload)
+        fresh = TicketJob.objects.create(user=self.user, payload=self.payload)
+        TicketJob.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+
+        call_command('run_ticket_jobs', stdout=io.StringIO())
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, fresh.status), ('done', 'queued'))
+        mock_post.assert_called_once()
+
 
 
 class GetItineraryAPITestCase(APITestCase):
@@ -426,11 +949,10 @@ class GetItineraryAPITestCase(APITestCase):
         )
         self.get_itinerary_url = reverse('booking-test-get-itinerary')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_get_itinerary_by_pnr(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -457,7 +979,7 @@ class GetItineraryAPITestCase(APITestCase):
                 </book:GetItineraryResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -470,11 +992,10 @@ class GetItineraryAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('itinerary', response.data)
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_get_itinerary_by_ticket_no(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -493,7 +1014,7 @@ class GetItineraryAPITestCase(APITestCase):
                 </book:GetItineraryResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -515,11 +1036,10 @@ class GetFlightDetailAPITestCase(APITestCase):
         )
         self.get_flight_detail_url = reverse('booking-test-get-flight-detail')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_get_flight_detail_success(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -542,7 +1062,7 @@ class GetFlightDetailAPITestCase(APITestCase):
                 </book:GetFlightDetailResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {'flight_id': 'abc-123-def'}
@@ -559,11 +1079,10 @@ class GetPnrDetailAPITestCase(APITestCase):
         )
         self.get_pnr_detail_url = reverse('booking-test-get-pnr-detail')
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_get_pnr_detail_returns_url(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -572,7 +1091,7 @@ class GetPnrDetailAPITestCase(APITestCase):
                 </book:GetPnrDetailResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_post.return_value = mock_response
 
         data = {
@@ -593,12 +1112,12 @@ class SalesReportAPITestCase(APITestCase):
             user_id='USER001', api_password='apipass123', agency_id='AGENCY001'
         )
         self.sales_report_url = reverse('booking-test-sales-report')
+        cache.clear()
 
-    @patch('requests.post')
+    @patch('bookings.soap.SoapTransport.post')
     def test_sales_report_success(self, mock_post):
         self.client.force_authenticate(user=self.user)
-        mock_response = Mock()
-        mock_response.text = """
+        mock_response = soap_response("""
         <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
             xmlns:book="http://booking.us.org/">
             <soapenv:Body>
@@ -625,7 +1144,7 @@ class SalesReportAPITestCase(APITestCase):
                 </book:SalesReportResponse>
             </soapenv:Body>
         </soapenv:Envelope>
-        """
+        """)
         mock_response.status_code = 200
         mock_post.return_value = mock_response
 
@@ -649,4 +1168,1042 @@ class SalesReportAPITestCase(APITestCase):
         self.assertEqual(ticket['passenger_name'], 'TANCHHO LIMBU')
         self.assertEqual(ticket['fare'], '5000')
         self.assertEqual(ticket['fsc'], '1500')
-        self.assertEqual(ticket['tax'], '200')
\ No newline at end of file
+        self.assertEqual(ticket['tax'], '200')
+
+    def sales_upstream(self, issued):
+        #answers SalesReport for any range with one ticket per issued day inside it
+        def post(body, **kwargs):
+            from_date = sales.parse_date(body.split(b'<strPnrNo>')[1].split(b'<')[0].decode())
+            to_date = sales.parse_date(body.split(b'<strTicketNo>')[1].split(b'<')[0].decode())
+            tickets = ''.join(
+                f"<TicketDetail><PnrNo>P{day}</PnrNo><IssueDate>{day}</IssueDate></TicketDetail>"
+                for day in issued if from_date <= sales.parse_date(day) <= to_date
+            )
+            return soap_response(
+                '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">'
+                f'<soapenv:Body><book:SalesReportResponse><book:SalesSummary>{tickets}</book:SalesSummary>'
+                '</book:SalesReportResponse></soapenv:Body></soapenv:Envelope>'
+            )
+        return post
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_overlapping_ranges_only_fetch_missing_days(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.sales_upstream(['02-NOV-2025', '06-NOV-2025', '11-NOV-2025'])
+
+        response = self.client.post(self.sales_report_url, {'from_date': '01-NOV-2025', 'to_date': '07-NOV-2025'}, format='json')
+        self.assertEqual(response.data['total_tickets'], 2)
+        self.assertEqual(mock_post.call_count, 1)
+
+        mock_post.reset_mock()
+        response = self.client.post(self.sales_report_url, {'from_date': '05-NOV-2025', 'to_date': '12-NOV-2025'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['pnr_no'] for t in response.data['sales_report']], ['P06-NOV-2025', 'P11-NOV-2025'])
+        self.assertEqual(mock_post.call_count, 1)
+        body = mock_post.call_args.args[0]
+        self.assertIn(b'<strPnrNo>08-NOV-2025</strPnrNo>', body)
+        self.assertIn(b'<strTicketNo>12-NOV-2025</strTicketNo>', body)
+
+    @override_settings(SALES_REPORT_CACHE={'WINDOW_DAYS': 7})
+    @patch('bookings.soap.SoapTransport.post')
+    def test_long_ranges_are_fetched_in_concurrent_windows(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.sales_upstream(['01-NOV-2025', '20-NOV-2025'])
+
+        response = self.client.post(self.sales_report_url, {'from_date': '01-NOV-2025', 'to_date': '20-NOV-2025'}, format='json')
+        self.assertEqual([t['pnr_no'] for t in response.data['sales_report']], ['P01-NOV-2025', 'P20-NOV-2025'])
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_export_streams_ndjson_and_csv(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.sales_upstream(['02-NOV-2025', '03-NOV-2025', '05-NOV-2025'])
+        data = {'from_date': '01-NOV-2025', 'to_date': '05-NOV-2025'}
+
+        response = self.client.post(self.sales_report_url, {**data, 'export': 'ndjson'}, format='json')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([r['pnr_no'] for r in rows], ['P02-NOV-2025', 'P03-NOV-2025', 'P05-NOV-2025'])
+        self.assertEqual(mock_post.call_count, 1)
+
+        #every day was cached while streaming
+        response = self.client.post(self.sales_report_url, {**data, 'export': 'csv'}, format='json')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['pnr_no', 'airline', 'issue_date'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['P02-NOV-2025', 'P03-NOV-2025', 'P05-NOV-2025'])
+        self.assertEqual(mock_post.call_count, 1)
+
+        response = self.client.post(self.sales_report_url, {**data, 'export': 'xlsx'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_cursor_pagination_walks_the_whole_report(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        issued = ['01-NOV-2025', '01-NOV-2025', '02-NOV-2025', '04-NOV-2025', '04-NOV-2025']
+        mock_post.side_effect = self.sales_upstream(issued)
+        data = {'from_date': '01-NOV-2025', 'to_date': '04-NOV-2025', 'page_size': 2}
+
+        pages = []
+        cursor = None
+        while True:
+            response = self.client.post(self.sales_report_url, {**data, 'cursor': cursor}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([t['issue_date'] for t in response.data['sales_report']])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [issued[0:2], issued[2:4], issued[4:]])
+        #the first page cached the whole window, the others never went upstream
+        self.assertEqual(mock_post.call_count, 1)
+
+        response = self.client.post(self.sales_report_url, {**data, 'cursor': 'bogus'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_sales_summary_is_built_from_the_cached_days(self, mock_post):
+        self.client.force_authenticate(user=self.user)
+        mock_post.side_effect = self.sales_upstream(['01-NOV-2025', '01-NOV-2025', '03-NOV-2025'])
+        data = {'from_date': '01-NOV-2025', 'to_date': '03-NOV-2025'}
+        self.client.post(self.sales_report_url, data, format='json')
+
+        response = self.client.post(reverse('booking-test-sales-summary'), {**data, 'group_by': ['issue_date']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(
+            [(g['issue_date'], g['tickets']) for g in response.data['groups']],
+            [('01-NOV-2025', 2), ('03-NOV-2025', 1)]
+        )
+        self.assertEqual(response.data['totals']['tickets'], 3)
+
+        response = self.client.post(reverse('booking-test-sales-summary'), {**data, 'group_by': ['pnr_no']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_range_is_rejected(self):
+        self.client.force_authenticate(user=self.user)
+        for data in (
+            {'from_date': '2025-11-01', 'to_date': '30-NOV-2025'},
+            {'from_date': '30-NOV-2025', 'to_date': '01-NOV-2025'},
+            {'from_date': '01-JAN-1900', 'to_date': '31-DEC-2100'},
+        ):
+            with patch('bookings.soap.SoapTransport.post') as mock_post:
+                response = self.client.post(self.sales_report_url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            mock_post.assert_not_called()
+
+    def test_past_days_are_kept_longer_than_today(self):
+        today = timezone.localdate()
+        sales.store('USER001', {today: [], today - timedelta(days=1): []})
+        self.assertLessEqual(cache.ttl(sales.day_key('USER001', today)), sales.DEFAULT_CACHE['TODAY_TTL'])
+        self.assertGreater(cache.ttl(sales.day_key('USER001', today - timedelta(days=1))), sales.DEFAULT_CACHE['TODAY_TTL'])
+
+
+class ListEndpointQueryTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123', user_id='USER001')
+        other = User.objects.create_user(username='other', password='otherpass', user_id='USER002')
+        airline = Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        ktm = Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        pkr = Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        for n in range(14):
+            booking = Booking.objects.create(
+                user=self.user if n < 12 else other, pnr=f"PNR{n:02}", airline=airline,
+                flight_id=f"F{n}", flight_no='U4123', flight_date=timezone.localdate(),
+                departure=ktm, arrival=pkr, contact_name='TANCHHO LIMBU',
+                contact_email='a@b.com', contact_mobile='9999999999', reservation_status='ISSUED',
+            )
+            Passenger.objects.bulk_create([
+                Passenger(booking=booking, title='MR', gender='M', first_name=f"PAX{i}", last_name='LIMBU', nationality='NP')
+                for i in range(3)
+            ])
+        self.client.force_authenticate(self.user)
+
+    def test_booking_list_query_count_does_not_depend_on_page_size(self):
+        for page_size in (2, 10):
+            #one query for the page, one for all of its passengers
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('booking-test-list'), {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertTrue(all(len(b['passengers']) == 3 for b in response.data['results']))
+
+    def test_booking_list_pages_through_own_bookings_newest_first(self):
+        pnrs = []
+        url = reverse('booking-test-list') + '?page_size=5'
+        while url:
+            response = self.client.get(url)
+            pnrs.extend(b['pnr'] for b in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(pnrs, [f"PNR{n:02}" for n in reversed(range(12))])
+
+    def test_fast_read_path_matches_the_serializers(self):
+        booking = Booking.objects.filter(user=self.user).first()
+        booking.ttl_date = timezone.localdate()
+        booking.ttl_time = datetime.time(10, 30)
+        booking.save()
+        Passenger.objects.filter(booking=booking).update(
+            pax_type='CHD', ticket_no='9999999999', fuel_surcharge='1500', tax='200.5', itinerary={'free_baggage': '20KG'}
+        )
+
+        queryset = Booking.objects.filter(user=self.user).order_by('-created_at', '-id')
+        expected = BookingSerializer(queryset.prefetch_related('passengers'), many=True).data
+        self.assertEqual(fastpath.bookings(fastpath.booking_values(queryset)), json.loads(json.dumps(expected)))
+        self.assertEqual(
+            [list(b) for b in fastpath.bookings(fastpath.booking_values(queryset))],
+            [list(b) for b in expected]
+        )
+
+        passengers = Passenger.objects.order_by('pk')
+        self.assertEqual(
+            fastpath.passengers(fastpath.passenger_values(passengers)),
+            json.loads(json.dumps(PassengerSerializer(passengers, many=True).data))
+        )
+
+        response = self.client.get(reverse('booking-test-detail', kwargs={'pk': booking.pk}))
+        self.assertEqual(response.data['ttl_time'], '10:30:00')
+        self.assertEqual(response.data['passengers'][0]['tax'], '200.50')
+        other = Booking.objects.exclude(user=self.user).first()
+        response = self.client.get(reverse('booking-test-detail', kwargs={'pk': other.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_passenger_and_user_lists_are_single_queries(self):
+        for page_size in (5, 20):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('passenger-list'), {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-list'))
+        self.assertEqual(response.data['results'], [{'user_id': 'USER001', 'agency_id': ''}])
+
+    def test_user_list_is_private(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(reverse('user-list')).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        staff = User.objects.create_user(username='staff', user_id='STAFF', api_password='SECRETPW', is_staff=True)
+        self.client.force_authenticate(staff)
+        response = self.client.get(reverse('user-list'))
+        self.assertEqual([u['user_id'] for u in response.data['results']], ['STAFF', 'USER002', 'USER001'])
+        self.assertNotIn('SECRETPW', response.content.decode())
+
+    def test_passenger_list_is_private_and_read_only(self):
+        url = reverse('passenger-list')
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        #each user only sees the passengers of their own bookings, never a list cached for someone else
+        for user, count in ((self.user, 36), (User.objects.get(user_id='USER002'), 6)):
+            self.client.force_authenticate(user)
+            response = self.client.get(url, {'page_size': 100})
+            self.assertEqual(len(response.data['results']), count)
+            self.assertEqual(
+                {p['booking'] for p in response.data['results']},
+                set(Booking.objects.filter(user=user).values_list('pk', flat=True))
+            )
+        theirs = Passenger.objects.filter(booking__user=self.user).first()
+        self.assertEqual(self.client.get(reverse('passenger-detail', kwargs={'pk': theirs.pk})).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(reverse('passenger-detail', kwargs={'pk': theirs.pk})).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.post(url, {}, format='json').status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+class QueryIndexTestCase(APITestCase):
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {index}", plan)
+
+    def test_lookups_use_their_index(self):
+        user = User.objects.create_user(username='testuser', password='testpass123', user_id='USER001')
+        today = timezone.localdate()
+        self.assertUsesIndex(Booking.objects.filter(pnr='ABC123'), 'booking_pnr_idx')
+        self.assertUsesIndex(Booking.objects.filter(user=user).order_by('-created_at'), 'booking_user_created_idx')
+        self.assertUsesIndex(Booking.objects.filter(flight_date=today), 'booking_flight_date_idx')
+        self.assertUsesIndex(
+            Booking.objects.filter(ttl_date__isnull=False, ttl_date__lte=today).order_by('ttl_date', 'ttl_time'),
+            'booking_ttl_idx'
+        )
+        self.assertUsesIndex(Passenger.objects.filter(ticket_no='9999999999'), 'passenger_ticket_no_idx')
+        self.assertUsesIndex(
+            Passenger.objects.filter(booking__pnr='ABC123', last_name='LIMBU'),
+            'passenger_booking_name_idx'
+        )
+
+
+@override_settings(
+    SOAP_ENDPOINTS={
+        'default': {'URL': 'http://upstream.test/booking', 'POOL_SIZE': 4},
+        'search': {'URL': 'http://search.test/booking', 'POOL_SIZE': 32, 'READ_TIMEOUT': 60},
+    },
+    SOAP_OPERATION_ENDPOINTS={'FlightAvailability': 'search'},
+)
+class SoapTransportTestCase(SimpleTestCase):
+    def setUp(self):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+
+    def test_transport_is_shared_per_endpoint(self):
+        self.assertIs(soap.get_transport('default'), soap.get_transport('default'))
+        self.assertIsNot(soap.get_transport('default'), soap.get_transport('search'))
+
+    def test_pool_size_and_timeouts_come_from_endpoint_settings(self):
+        search = soap.get_transport(soap.endpoint_for('FlightAvailability'))
+        self.assertEqual(search.url, 'http://search.test/booking')
+        self.assertEqual(search.adapter._pool_maxsize, 32)
+        self.assertEqual(search.timeout, (3.05, 60))
+        default = soap.get_transport(soap.endpoint_for('SalesReport'))
+        self.assertEqual(default.adapter._pool_maxsize, 4)
+
+    def test_call_posts_with_timeout(self):
+        with patch('requests.Session.post') as mock_post:
+            soap.call('SalesReport', '<Envelope/>')
+        args, kwargs = mock_post.call_args
+        self.assertEqual(args[0], 'http://upstream.test/booking')
+        self.assertEqual(kwargs['timeout'], (3.05, 30))
+        self.assertEqual(kwargs['headers']['Content-Type'], 'text/xml; charset=utf-8')
+        self.assertEqual(soap.stats()['default']['requests'], 1)
+
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def test_opens_after_consecutive_failures_and_recovers_through_one_trial(self):
+        breaker = resilience.CircuitBreaker('default', failures=3, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        for _ in range(3):
+            breaker.before_call()
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(resilience.CircuitOpen):
+            breaker.before_call()
+
+        with patch('bookings.resilience.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(breaker.state, 'half-open')
+            breaker.before_call()
+            #only one trial call at a time
+            with self.assertRaises(resilience.CircuitOpen):
+                breaker.before_call()
+            breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    @override_settings(SOAP_RESILIENCE={'RETRIES': 0, 'BREAKER_FAILURES': 1, 'BREAKER_RESET': 30})
+    def test_an_unfinished_trial_does_not_wedge_the_circuit(self):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        with patch('bookings.soap.SoapTransport.post', side_effect=requests.Timeout()):
+            with self.assertRaises(resilience.UpstreamTimeout):
+                soap.call('GetFlightDetail', b'<envelope/>')
+        breaker = soap.get_breaker()
+        self.assertEqual(breaker.state, 'open')
+
+        later = time.monotonic() + 31
+        with patch('bookings.resilience.time.monotonic', return_value=later):
+            #no time left: the call never reaches the breaker
+            with resilience.budget(0), self.assertRaises(resilience.DeadlineExceeded):
+                soap.call('GetFlightDetail', b'<envelope/>')
+            #a trial that dies on something other than an upstream failure hands its slot back
+            with patch('bookings.soap.SoapTransport.post', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    soap.call('GetFlightDetail', b'<envelope/>')
+
+            async def cancelled(body, timeout=None, stream=False):
+                raise asyncio.CancelledError
+
+            async def acall():
+                with patch('bookings.soap.AsyncSoapTransport.post', side_effect=cancelled):
+                    await soap.acall('GetFlightDetail', b'<envelope/>')
+
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(acall())
+
+            with patch('bookings.soap.SoapTransport.post', return_value=soap_response('ok')):
+                self.assertEqual(soap.call('GetFlightDetail', b'<envelope/>').content, b'ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_budget_only_shrinks(self):
+        self.assertIsNone(resilience.remaining())
+        with resilience.budget(10):
+            with resilience.budget(60):
+                self.assertLessEqual(resilience.remaining(), 10)
+        self.assertIsNone(resilience.remaining())
+
+
+@override_settings(SOAP_RESILIENCE={'RETRIES': 2, 'BACKOFF': 0, 'BREAKER_FAILURES': 3, 'BREAKER_RESET': 30})
+class UpstreamResilienceTestCase(APITestCase):
+    def setUp(self):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123',
+            user_id='USER001', api_password='apipass123', agency_id='AGENCY001'
+        )
+        self.client.force_authenticate(user=self.user)
+        self.flight_detail = soap_response(
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">'
+            '<soapenv:Body><book:GetFlightDetailResponse><book:Availability><Airline>U4</Airline>'
+            '</book:Availability></book:GetFlightDetailResponse></soapenv:Body></soapenv:Envelope>'
+        )
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_idempotent_operations_are_retried(self, mock_post):
+        mock_post.side_effect = [requests.Timeout(), soap_response('', status_code=503), self.flight_detail]
+        response = self.client.post(reverse('booking-test-get-flight-detail'), {'flight_id': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_issue_ticket_is_never_retried(self, mock_post):
+        mock_post.side_effect = requests.Timeout()
+        with self.assertRaises(resilience.UpstreamTimeout):
+            soap.call('IssueTicket', b'<envelope/>')
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_upstream_failures_map_to_gateway_errors_and_open_the_circuit(self, mock_post):
+        mock_post.side_effect = requests.Timeout()
+        response = self.client.post(reverse('booking-test-get-flight-detail'), {'flight_id': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(mock_post.call_count, 3)
+
+        #three failures in a row: the endpoint is now short-circuited
+        mock_post.reset_mock()
+        response = self.client.post(reverse('booking-test-get-flight-detail'), {'flight_id': 'abc'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        mock_post.assert_not_called()
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_soap_faults_are_passed_through(self, mock_post):
+        mock_post.return_value = soap_response('<fault/>', status_code=500)
+        self.assertEqual(soap.call('GetFlightDetail', b'<envelope/>').status_code, 500)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_timeouts_come_out_of_the_request_budget(self, mock_post):
+        mock_post.return_value = self.flight_detail
+        with resilience.budget(2):
+            soap.call('GetFlightDetail', b'<envelope/>')
+        connect, read = mock_post.call_args.kwargs['timeout']
+        self.assertLessEqual(read, 2)
+
+        with resilience.budget(0):
+            with self.assertRaises(resilience.DeadlineExceeded):
+                soap.call('GetFlightDetail', b'<envelope/>')
+        self.assertEqual(mock_post.call_count, 1)
+
+
+class HedgePolicyTestCase(SimpleTestCase):
+    def test_delay_is_the_percentile_of_recent_latencies(self):
+        policy = resilience.HedgePolicy(percentile=90, window=10, min_samples=5)
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            policy.record(seconds)
+        self.assertIsNone(policy.delay())
+        for n in range(5, 21):
+            policy.record(n / 10)
+        #only the last 10 samples, 1.1 to 2.0, count
+        self.assertEqual(policy.delay(), 2.0)
+
+    def test_hedges_are_capped_at_a_share_of_calls(self):
+        policy = resilience.HedgePolicy(window=100, max_percent=10)
+        allowed = 0
+        for _ in range(50):
+            policy.begin()
+            allowed += policy.allow_hedge()
+        self.assertEqual(allowed, 5)
+
+
+HEDGING = {'ENABLED': True, 'MIN_SAMPLES': 5, 'PERCENTILE': 50, 'MAX_PERCENT': 100}
+
+
+@override_settings(SOAP_HEDGING=HEDGING, SOAP_RESILIENCE={'RETRIES': 0})
+class HedgedCallTestCase(SimpleTestCase):
+    def setUp(self):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+
+    def warm_up(self, operation='GetFlightDetail'):
+        #policies are built from the settings in effect when first used
+        for _ in range(5):
+            soap.get_hedge_policy(operation).record(0.05)
+
+    def stalling_post(self, stall):
+        #the first request stalls, every later one answers at once
+        calls = []
+        lock = threading.Lock()
+
+        def post(body, timeout=None, stream=False):
+            with lock:
+                calls.append(body)
+                first = len(calls) == 1
+            if first:
+                stall()
+                return soap_response('slow')
+            return soap_response('fast')
+        return post, calls
+
+    def test_a_stalled_read_is_answered_by_the_hedge(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+        self.warm_up()
+        post, calls = self.stalling_post(lambda: released.wait(5))
+        with patch('bookings.soap.SoapTransport.post', side_effect=post):
+            start = time.monotonic()
+            response = soap.call('GetFlightDetail', b'<envelope/>')
+            self.assertEqual(response.content, b'fast')
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(len(calls), 2)
+
+    def test_fast_reads_are_not_hedged(self):
+        self.warm_up()
+        with patch('bookings.soap.SoapTransport.post', return_value=soap_response('fast')) as mock_post:
+            soap.call('GetFlightDetail', b'<envelope/>')
+        mock_post.assert_called_once()
+
+    @override_settings(SOAP_HEDGING={**HEDGING, 'MAX_PERCENT': 0})
+    def test_hedging_stops_at_its_load_cap(self):
+        self.warm_up()
+        post, calls = self.stalling_post(lambda: time.sleep(0.3))
+        with patch('bookings.soap.SoapTransport.post', side_effect=post):
+            self.assertEqual(soap.call('GetFlightDetail', b'<envelope/>').content, b'slow')
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(SOAP_HEDGING={**HEDGING, 'OPERATIONS': ('GetFlightDetail', 'IssueTicket')})
+    def test_writes_are_never_hedged(self):
+        self.warm_up('IssueTicket')
+        post, calls = self.stalling_post(lambda: time.sleep(0.3))
+        with patch('bookings.soap.SoapTransport.post', side_effect=post):
+            self.assertEqual(soap.call('IssueTicket', b'<envelope/>').content, b'slow')
+        self.assertEqual(len(calls), 1)
+
+    def test_async_hedge_cancels_the_stalled_request(self):
+        cancelled = []
+
+        async def post(body, timeout=None, stream=False):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+            return httpx.Response(200, text='fast')
+
+        self.warm_up()
+        async def run():
+            with patch('bookings.soap.AsyncSoapTransport.post', side_effect=post):
+                response = await soap.acall('GetFlightDetail', b'<envelope/>')
+                await asyncio.sleep(0)
+            return response
+
+        self.assertEqual(asyncio.run(run()).text, 'fast')
+        self.assertEqual(cancelled, [True])
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.key = singleflight.flight_key('SectorCode')
+
+    def concurrently(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_concurrent_callers_share_one_call(self):
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'sectors': ['KTM']}
+
+        threads = self.concurrently(lambda: results.append(singleflight.do(self.key, fetch)), 1)
+        started.wait(5)
+        threads += self.concurrently(lambda: results.append(singleflight.do(self.key, fetch)), 4)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result is results[0] for result in results))
+        #the flight is over, the next call goes upstream again
+        singleflight.do(self.key, fetch)
+        self.assertEqual(len(calls), 2)
+
+    def test_followers_get_the_leaders_error(self):
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise resilience.UpstreamTimeout('SectorCode timed out')
+
+        def call():
+            try:
+                singleflight.do(self.key, fail)
+            except resilience.UpstreamTimeout as e:
+                errors.append(e)
+
+        threads = self.concurrently(call, 1)
+        started.wait(5)
+        threads += self.concurrently(call, 2)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 3)
+
+    @override_settings(SINGLE_FLIGHT={'POLL_INTERVAL': 0.01})
+    def test_waits_for_a_leader_in_another_worker(self):
+        cache.add(f"{self.key}_lock", 'other-worker', timeout=30)
+
+        def finish():
+            time.sleep(0.1)
+            cache.set(f"{self.key}_other-worker", ['KTM'])
+            cache.delete(f"{self.key}_lock")
+
+        self.concurrently(finish, 1)
+        fetch = lambda: self.fail('the other worker is already fetching')
+        self.assertEqual(singleflight.do(self.key, fetch), ['KTM'])
+
+    @override_settings(SINGLE_FLIGHT={'POLL_INTERVAL': 0.01})
+    def test_goes_upstream_when_the_other_leader_fails(self):
+        cache.add(f"{self.key}_lock", 'other-worker', timeout=30)
+        self.concurrently(lambda: (time.sleep(0.1), cache.delete(f"{self.key}_lock")), 1)
+        self.assertEqual(singleflight.do(self.key, lambda: ['PKR']), ['PKR'])
+
+    def test_async_callers_share_one_call(self):
+        calls = []
+
+        async def afetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ['KTM']
+
+        async def run():
+            return await asyncio.gather(*(singleflight.ado(self.key, afetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), [['KTM']] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_availability_followers_get_their_own_commission(self):
+        key = 'availability_test'
+        result = {
+            'outbound_flights': [{
+                'airline': 'U4', 'flight_class_code': 'Y', 'adult_fare': 1000, 'child_fare': 500,
+                'agency_commission': 100, 'child_commission': 50,
+            }],
+            'inbound_flights': [],
+        }
+        cache.set(availability.commission_key('AGENCY002'), {'U4:Y:1000:500': (200, 100)})
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], {}
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return result
+
+        def search(agency_id):
+            return lambda: results.setdefault(agency_id, availability.coalesced(key, agency_id, fetch))
+
+        threads = self.concurrently(search('AGENCY001'), 1)
+        started.wait(5)
+        threads += self.concurrently(search('AGENCY002'), 1)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertIs(results['AGENCY001'], result)
+        self.assertEqual(results['AGENCY002']['outbound_flights'][0]['agency_commission'], 200)
+
+
+def flight_detail_response(flight_id):
+    return soap_response(
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">'
+        '<soapenv:Body><book:GetFlightDetailResponse><book:Availability><Airline>U4</Airline>'
+        f'<FlightId>{flight_id}</FlightId><AdultFare>5000</AdultFare>'
+        '</book:Availability></book:GetFlightDetailResponse></soapenv:Body></soapenv:Envelope>'
+    )
+
+
+@override_settings(SOAP_RESILIENCE={'RETRIES': 0})
+class BatchLookupAPITestCase(APITestCase):
+    def setUp(self):
+        soap.reset_transports()
+        self.addCleanup(soap.reset_transports)
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123',
+            user_id='USER001', api_password='apipass123', agency_id='AGENCY001'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_batch_flight_detail_runs_items_concurrently(self, mock_post):
+        def post(body, timeout=None, stream=False):
+            flight_id = ET.fromstring(body).find('.//strFlightId').text
+            if flight_id == 'stalled':
+                raise requests.Timeout()
+            time.sleep(0.2)
+            return flight_detail_response(flight_id)
+        mock_post.side_effect = post
+
+        flight_ids = [f"flight-{n}" for n in range(5)] + ['stalled', 'flight-0']
+        start = time.monotonic()
+        response = self.client.post(reverse('booking-test-batch-flight-detail'), {'flight_ids': flight_ids}, format='json')
+        self.assertLess(time.monotonic() - start, 0.8)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(list(results), flight_ids[:-1])
+        self.assertEqual(results['flight-3']['status'], 200)
+        self.assertEqual(results['flight-3']['flight_detail']['flight_id'], 'flight-3')
+        self.assertEqual(results['stalled']['status'], 504)
+        self.assertIn('error', results['stalled'])
+        #the repeated flight-0 is looked up once
+        self.assertEqual(mock_post.call_count, 6)
+
+    @override_settings(BATCH_LOOKUPS={'MAX_ITEMS': 2})
+    def test_batch_size_is_validated(self):
+        url = reverse('booking-test-batch-flight-detail')
+        self.assertEqual(self.client.post(url, {'flight_ids': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {'flight_ids': ['a', 'b', 'c']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('flight_ids', response.data)
+        response = self.client.post(reverse('booking-test-batch-itinerary'), {'items': [{'airline_id': 'U4'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('booking-test-batch-itinerary'), {'items': [
+            {'pnr_no': 'ABC123', 'airline_id': 'U4'}, {'pnr_no': 'ABC123', 'airline_id': 'YT'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('items', response.data)
+
+    @patch('bookings.soap.SoapTransport.post')
+    def test_batch_itinerary_serves_stored_tickets_and_fetches_the_rest(self, mock_post):
+        airline = Airline.objects.create(airline_id='U4', airline_name='Buddha Air')
+        ktm = Sector.objects.create(sector_code='KTM', sector_name='Kathmandu')
+        pkr = Sector.objects.create(sector_code='PKR', sector_name='Pokhara')
+        booking = Booking.objects.create(
+            user=self.user, pnr='STORED', airline=airline, flight_id='F1', flight_no='U4123',
+            flight_date=datetime.date(2025, 10, 5), departure=ktm, arrival=pkr, contact_name='TANCHHO LIMBU',
+            contact_email='a@b.com', contact_mobile='9999999999', reservation_status='ISSUED',
+        )
+        Passenger.objects.create(
+            booking=booking, title='MR', gender='M', first_name='TANCHHO', last_name='LIMBU',
+            nationality='NP', ticket_no='1111111111', itinerary={'pnr_no': 'STORED', 'ticket_no': '1111111111'},
+        )
+        mock_post.return_value = soap_response("""
+        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">
+            <soapenv:Body><book:GetItineraryResponse><book:Itinerary><![CDATA[
+                <Itinerary><Passenger><Airline>U4</Airline><PnrNo>ABC123</PnrNo><TicketNo>9999999999</TicketNo></Passenger></Itinerary>
+            ]]></book:Itinerary></book:GetItineraryResponse></soapenv:Body>
+        </soapenv:Envelope>
+        """)
+
+        response = self.client.post(reverse('booking-test-batch-itinerary'), {'items': [
+            {'pnr_no': 'STORED'},
+            {'ticket_no': '9999999999', 'airline_id': 'U4'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(list(results), ['STORED', '9999999999'])
+        self.assertEqual(results['STORED']['itinerary'], [{'pnr_no': 'STORED', 'ticket_no': '1111111111'}])
+        self.assertEqual(results['9999999999']['itinerary'][0]['pnr_no'], 'ABC123')
+        mock_post.assert_called_once()
+
+
+class AsyncFlightDetailTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', password='testpass123',
+            user_id='USER001', api_password='apipass123', agency_id='AGENCY001'
+        )
+        self.url = reverse('async-booking-get-flight-detail')
+
+    async def test_async_flight_detail_requires_authentication(self):
+        response = await self.async_client.post(self.url, {'flight_id': 'abc'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @patch('bookings.soap.AsyncSoapTransport.post', new_callable=AsyncMock)
+    async def test_async_flight_detail_success(self, mock_post):
+        await self.async_client.aforce_login(self.user)
+        mock_response = httpx.Response(200, text="""
+        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+            xmlns:book="http://booking.us.org/">
+            <soapenv:Body>
+                <book:GetFlightDetailResponse>
+                    <book:Availability>
+                        <Airline>U4</Airline>
+                        <FlightNo>U4123</FlightNo>
+                        <FlightId>abc-123-def</FlightId>
+                        <AdultFare>5000</AdultFare>
+                        <FuelSurcharge>1500</FuelSurcharge>
+                        <Tax>200</Tax>
+                    </book:Availability>
+                </book:GetFlightDetailResponse>
+            </soapenv:Body>
+        </soapenv:Envelope>
+        """)
+        mock_post.return_value = mock_response
+
+        response = await self.async_client.post(self.url, {'flight_id': 'abc-123-def'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['flight_detail']['flight_id'], 'abc-123-def')
+        self.assertEqual(response.json()['flight_detail']['total_adult_fare'], 6700)
+        self.assertIn(b'<strFlightId>abc-123-def</strFlightId>', mock_post.call_args.args[0])
+
+    @patch('bookings.soap.AsyncSoapTransport.post', new_callable=AsyncMock)
+    @patch('bookings.soap.SoapTransport.post')
+    def test_wsgi_requests_use_the_pooled_sync_transport(self, mock_post, mock_apost):
+        #under WSGI every call gets a one-off event loop: no per-loop httpx client for it
+        self.client.force_login(self.user)
+        mock_post.return_value = soap_response(
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">'
+            '<soapenv:Body><book:GetFlightDetailResponse><book:Availability><FlightId>abc-123-def</FlightId>'
+            '</book:Availability></book:GetFlightDetailResponse></soapenv:Body></soapenv:Envelope>'
+        )
+        response = self.client.post(self.url, {'flight_id': 'abc-123-def'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['flight_detail']['flight_id'], 'abc-123-def')
+        mock_post.assert_called_once()
+        mock_apost.assert_not_called()
+
+    @patch('bookings.soap.AsyncSoapTransport.post', new_callable=AsyncMock)
+    async def test_async_flight_availability_validates_sectors(self, mock_post):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('async-booking-flight-availability'),
+            {'sector_from': 999, 'sector_to': 998, 'flight_date': '30-09-2025', 'trip_type': 'O',
+             'nationality': 'NP', 'adult': 1, 'child': 0, 'client_ip': '127.0.0.1'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sector_from', response.json())
+        mock_post.assert_not_called()
+
+
+class AvailabilityStreamTestCase(SimpleTestCase):
+    envelope = (
+        b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+        b'xmlns:book="http://booking.us.org/"><soapenv:Body><book:FlightAvailabilityResponse>'
+        b'<book:return><![CDATA[<Flightavailability><Outbound>'
+        + b''.join(b'<Availability><FlightId>out-%d</FlightId><AdultFare>5000</AdultFare></Availability>' % i for i in range(50))
+        + b'</Outbound><Inbound><Availability><FlightId>in-1</FlightId></Availability></Inbound>'
+        b'</Flightavailability>]]></book:return></book:FlightAvailabilityResponse></soapenv:Body></soapenv:Envelope>'
+    )
+
+    def test_records_are_yielded_before_the_body_is_complete(self):
+        stream = parsers.AvailabilityStream()
+        half = len(self.envelope) // 2
+        first_half = list(stream.feed(self.envelope[:half]))
+        self.assertTrue(first_half)
+        self.assertEqual(first_half[0][0], 'Outbound')
+        rest = list(stream.feed(self.envelope[half:])) + list(stream.close())
+        self.assertEqual(len(first_half) + len(rest), 51)
+        self.assertEqual(rest[-1][0], 'Inbound')
+
+    def test_small_chunks_match_whole_body(self):
+        chunks = [self.envelope[i:i + 13] for i in range(0, len(self.envelope), 13)]
+        self.assertEqual(
+            parsers.parse_flight_availability_stream(chunks),
+            parsers.parse_flight_availability(self.envelope)
+        )
+
+    def test_missing_return_element_raises(self):
+        with self.assertRaises(ValueError):
+            parsers.parse_flight_availability(b'<Envelope><Body/></Envelope>')
+
+
+class SalesReportStreamTestCase(SimpleTestCase):
+    def test_ticket_details_are_yielded_as_they_are_parsed(self):
+        body = (
+            b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:book="http://booking.us.org/">'
+            b'<soapenv:Body><book:SalesReportResponse><book:SalesSummary>'
+            + b''.join(b'<TicketDetail><PnrNo>P%d</PnrNo><Fare>%d</Fare></TicketDetail>' % (n, n) for n in range(50))
+            + b'</book:SalesSummary></book:SalesReportResponse></soapenv:Body></soapenv:Envelope>'
+        )
+        chunks = (body[i:i + 7] for i in range(0, len(body), 7))
+        rows = parsers.iter_sales_report(chunks)
+        self.assertEqual(next(rows)['pnr_no'], 'P0')
+        self.assertEqual([r['fare'] for r in rows], [str(n) for n in range(1, 50)])
+
+    def test_missing_summary_is_an_error(self):
+        with self.assertRaises(ValueError):
+            list(parsers.iter_sales_report([b'<a><b/></a>']))
+
+
+class SalesSummaryTestCase(SimpleTestCase):
+    tickets = [
+        {'airline': 'U4', 'pax_type': 'ADULT', 'fare': '5000', 'fsc': '1500', 'tax': '200'},
+        {'airline': 'U4', 'pax_type': 'CHILD', 'fare': '3500', 'fsc': '1500', 'tax': '200'},
+        {'airline': 'YT', 'pax_type': 'ADULT', 'fare': '4000.50', 'fsc': '1000', 'tax': None},
+        {'airline': 'U4', 'pax_type': 'ADULT', 'fare': '5000', 'fsc': '1500', 'tax': 'N/A'},
+    ]
+
+    def test_grouped_sums_counts_and_averages(self):
+        summary = sales.summarize(sales.load_columns(self.tickets), ['airline'])
+        u4, yt = summary['groups']
+        self.assertEqual((u4['airline'], u4['tickets'], u4['fare'], u4['tax']), ('U4', 3, 13500.0, 400.0))
+        self.assertEqual(u4['average_fare'], 4500.0)
+        self.assertEqual((yt['airline'], yt['tickets'], yt['total']), ('YT', 1, 5000.5))
+        self.assertEqual(summary['totals']['total'], 23400.5)
+
+    def test_multiple_group_fields(self):
+        summary = sales.summarize(sales.load_columns(self.tickets), ['airline', 'pax_type'])
+        self.assertEqual(
+            sorted((g['airline'], g['pax_type'], g['tickets']) for g in summary['groups']),
+            [('U4', 'ADULT', 2), ('U4', 'CHILD', 1), ('YT', 'ADULT', 1)]
+        )
+
+    def test_empty_report(self):
+        summary = sales.summarize(sales.load_columns([]), ['airline'])
+        self.assertEqual(summary['groups'], [])
+        self.assertEqual(summary['totals']['tickets'], 0)
+
+
+class SchemaDecoderTestCase(SimpleTestCase):
+    def test_availability_schema_matches_find_per_field(self):
+        element = ET.fromstring(AVAILABILITY_XML)
+        self.assertEqual(parsers.AVAILABILITY.decode(element), find_per_field(element))
+        self.assertEqual(list(parsers.AVAILABILITY.decode(element)), list(find_per_field(element)))
+
+    def test_missing_fields_keep_defaults(self):
+        decoded = parsers.INBOUND_AVAILABILITY.decode(ET.fromstring(
+            '<Availability><FlightId>x</FlightId><AdultFare>100</AdultFare><Unknown>1</Unknown></Availability>'
+        ))
+        self.assertEqual(decoded['flight_id'], 'x')
+        self.assertIsNone(decoded['airline'])
+        self.assertEqual(decoded['child_tax_adjustment'], 0)
+        self.assertEqual(decoded['total_adult_fare'], 100)
+        self.assertNotIn('Unknown', decoded)
+
+
+class ElementTreeBackendMixin:
+    #re-run the SOAP fixtures on the stdlib fallback; the default backend is lxml when installed
+    def setUp(self):
+        previous = xmlbackend.backend.name
+        xmlbackend.use('etree')
+        self.addCleanup(xmlbackend.use, previous)
+        super().setUp()
+
+
+class ElementTreeSectorAPITestCase(ElementTreeBackendMixin, SectorAPITestCase):
+    pass
+
+
+class ElementTreeAirlineAPITestCase(ElementTreeBackendMixin, AirlineAPITestCase):
+    pass
+
+
+class ElementTreeReservationAPITestCase(ElementTreeBackendMixin, ReservationAPITestCase):
+    pass
+
+
+class ElementTreeFlightAvailabilityAPITestCase(ElementTreeBackendMixin, FlightAvailabilityAPITestCase):
+    pass
+
+
+class ElementTreeIssueTicketAPITestCase(ElementTreeBackendMixin, IssueTicketAPITestCase):
+    pass
+
+
+class ElementTreeGetItineraryAPITestCase(ElementTreeBackendMixin, GetItineraryAPITestCase):
+    pass
+
+
+class ElementTreeGetFlightDetailAPITestCase(ElementTreeBackendMixin, GetFlightDetailAPITestCase):
+    pass
+
+
+class ElementTreeGetPnrDetailAPITestCase(ElementTreeBackendMixin, GetPnrDetailAPITestCase):
+    pass
+
+
+class ElementTreeSalesReportAPITestCase(ElementTreeBackendMixin, SalesReportAPITestCase):
+    pass
+
+
+class ElementTreeAvailabilityStreamTestCase(ElementTreeBackendMixin, AvailabilityStreamTestCase):
+    pass
+
+
+class XmlBackendTestCase(SimpleTestCase):
+    def test_auto_prefers_lxml_when_installed(self):
+        self.assertEqual(xmlbackend.use('auto').name, 'lxml' if xmlbackend.etree is not None else 'etree')
+
+    def test_backends_decode_identically(self):
+        envelope = AvailabilityStreamTestCase.envelope
+        results = []
+        for name in xmlbackend.BACKENDS:
+            xmlbackend.use(name)
+            results.append(parsers.parse_flight_availability(envelope))
+        xmlbackend.use('auto')
+        self.assertTrue(all(result == results[0] for result in results))
+
+
+class GenerationTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_moves_only_its_namespace(self):
+        sector, airline = generations.prefix('sector'), generations.prefix('airline')
+        generations.bump('sector')
+        self.assertNotEqual(generations.prefix('sector'), sector)
+        self.assertEqual(generations.prefix('airline'), airline)
+
+    def test_evicted_counter_does_not_reuse_an_old_generation(self):
+        generations.bump('booking')
+        old = generations.current('booking')
+        cache.delete(generations.key('booking'))
+        self.assertGreater(generations.current('booking'), old)
+
+        cache.delete(generations.key('booking'))
+        generations.bump('booking')
+        self.assertGreater(generations.current('booking'), old)
+
+
+class EnvelopeBuilderTestCase(SimpleTestCase):
+    def test_envelope_is_compact_escaped_bytes(self):
+        body = envelopes.get_pnr_detail(
+            {'strUserId': 'USER001', 'strPassword': 'p<&>', 'strAgencyId': 'AGENCY001'},
+            'ABC123', 'O\'BRIEN & SONS'
+        )
+        self.assertIsInstance(body, bytes)
+        self.assertNotIn(b'\n', body)
+        root = ET.fromstring(body)
+        request = root.find('.//{http://booking.us.org/}GetPnrDetail')
+        self.assertEqual(request.findtext('strPassword'), 'p<&>')
+        self.assertEqual(request.findtext('strLastName'), "O'BRIEN & SONS")
+
+    def test_optional_field_is_left_out_when_empty(self):
+        data = {
+            'sector_from': Sector(sector_code='KTM'), 'sector_to': Sector(sector_code='PKR'),
+            'flight_date': '30-09-2025', 'trip_type': 'O', 'nationality': 'NP',
+            'adult': 1, 'child': 0, 'client_ip': '127.0.0.1',
+        }
+        creds = {'strUserId': 'U', 'strPassword': 'P', 'strAgencyId': 'A'}
+        self.assertNotIn(b'strAirlineId', envelopes.flight_availability(creds, data))
+        self.assertIn(b'<strAirlineId>U4</strAirlineId>', envelopes.flight_availability(creds, data, airline_id='U4'))
+
+    def test_issue_ticket_passenger_detail_in_cdata(self):
+        body = envelopes.issue_ticket({
+            'flight_id': 'abc', 'contact_name': 'A & B', 'contact_email': 'a@b.com',
+            'contact_mobile': '999',
+            'passenger_detail': [{
+                'pax_type': 'ADULT', 'title': 'MR', 'gender': 'M',
+                'first_name': 'TANCHHO', 'last_name': 'LIMBU <JR>', 'nationality': 'NP',
+            }],
+        })
+        root = ET.fromstring(body)
+        detail = ET.fromstring(root.find('.//strPassengerDetail').text)
+        passenger = detail.find('Passenger')
+        self.assertEqual(passenger.findtext('LastName'), 'LIMBU <JR>')
+        self.assertEqual(passenger.findtext('PaxRemarks'), 'N/A')
+        self.assertEqual(root.find('.//strContactName').text, 'A & B')
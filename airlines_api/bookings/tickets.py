@@ -0,0 +1,124 @@
+import logging
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .models import Airline, Sector, Booking, Passenger, PassengerType
+from . import generations, sales
+
+logger = logging.getLogger(__name__)
+
+#upstream PaxType labels (ADULT, CHILD, INFANT) and codes to PassengerType values
+PAX_TYPES = {
+    **{label.upper(): value for value, label in PassengerType.choices},
+    **{value: value for value in PassengerType.values},
+}
+
+
+def _amount(value):
+    try:
+        return Decimal(value)
+    except (TypeError, InvalidOperation):
+        return None
+
+
+def _segments(itinerary):
+    #one Booking per flight of the PNR, in the order the upstream listed them
+    segments = {}
+    for row in itinerary:
+        segments.setdefault((row['pnr_no'], row['flight_no'], row['flight_date']), []).append(row)
+    return list(segments.values())
+
+
+def build_bookings(user, data, itinerary):
+    """Unsaved (Booking, [Passenger]) pairs for an IssueTicket itinerary.
+
+    Raises LookupError when the airline or a sector isn't known locally.
+    """
+    flight_ids = [data['flight_id'], data.get('return_flight_id', '')]
+    pairs = []
+    for n, rows in enumerate(_segments(itinerary)):
+        first = rows[0]
+        #read from the database, not lookups: a snapshot a second old could point at a deleted row
+        airline = Airline.objects.filter(airline_id=first['airline']).order_by('pk').first()
+        sectors = Sector.objects.in_bulk([first['departure'], first['arrival']], field_name='sector_code')
+        departure, arrival = sectors.get(first['departure']), sectors.get(first['arrival'])
+        if airline is None or departure is None or arrival is None:
+            raise LookupError(f"Unknown airline or sector in {first['airline']} {first['sector']}")
+
+        booking = Booking(
+            user=user,
+            pnr=first['pnr_no'],
+            airline=airline,
+            flight_id=flight_ids[n] if n < len(flight_ids) else '',
+            flight_no=first['flight_no'],
+            flight_date=sales.parse_date(first['flight_date']),
+            departure=departure,
+            arrival=arrival,
+            contact_name=data['contact_name'],
+            contact_email=data['contact_email'],
+            contact_mobile=data['contact_mobile'],
+            reservation_status='ISSUED',
+        )
+        passengers = [
+            Passenger(
+                booking=booking,
+                pax_type=PAX_TYPES.get((row['pax_type'] or '').upper(), PassengerType.ADULT),
+                title=row['title'] or '',
+                gender=row['gender'] or '',
+                first_name=row['first_name'] or '',
+                last_name=row['last_name'] or '',
+                nationality=row['nationality'] or '',
+                ticket_no=row['ticket_no'],
+                fuel_surcharge=_amount(row['surcharge']),
+                tax=_amount(row['tax']),
+                itinerary=row,
+            )
+            for row in rows
+        ]
+        pairs.append((booking, passengers))
+    return pairs
+
+
+def save_issued(user, data, itinerary):
+    """Write the issued bookings and their passengers with two bulk inserts.
+
+    The ticket is already issued upstream at this point, so a failure
+    here is logged and swallowed; get_itinerary still has the upstream.
+    """
+    try:
+        pairs = build_bookings(user, data, itinerary)
+    except (LookupError, ValueError) as e:
+        logger.info('Not storing issued itinerary: %s', e)
+        return []
+    try:
+        with transaction.atomic():
+            bookings = Booking.objects.bulk_create([booking for booking, passengers in pairs])
+            Passenger.objects.bulk_create([p for _, passengers in pairs for p in passengers])
+            #bulk_create sends no post_save
+            generations.invalidate('booking', 'passenger')
+        return bookings
+    except Exception:
+        logger.exception('Could not store issued itinerary locally')
+        return []
+
+
+def find_itinerary(user, pnr_no, ticket_no, airline_id=''):
+    """The user's stored itinerary rows for a PNR and/or ticket number, None on a miss.
+
+    Every given field has to match. Anonymous callers and a PNR stored
+    under more than one airline are misses too, left to the upstream.
+    """
+    if not user.is_authenticated or not (pnr_no or ticket_no):
+        return None
+    passengers = Passenger.objects.filter(booking__user=user)
+    if pnr_no:
+        passengers = passengers.filter(booking__pnr=pnr_no)
+    if ticket_no:
+        passengers = passengers.filter(ticket_no=ticket_no)
+    if airline_id:
+        passengers = passengers.filter(booking__airline__airline_id=airline_id)
+    rows = list(passengers.order_by('booking_id', 'pk').values_list('booking__airline_id', 'itinerary'))
+    if not rows or not all(itinerary for airline, itinerary in rows):
+        return None
+    if len({airline for airline, itinerary in rows}) > 1:
+        return None
+    return [itinerary for airline, itinerary in rows]
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from . import views
+from . import views, async_views
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -11,4 +11,9 @@ router.register('bookings', views.BookingViewSet,basename='booking-test')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('stats/', views.StatsView.as_view(), name='stats'),
+
+    #native async views, used when served through airlines_api/asgi.py
+    path('async/bookings/flight_availability/', async_views.FlightAvailabilityView.as_view(), name='async-booking-flight-availability'),
+    path('async/bookings/get_flight_detail/', async_views.FlightDetailView.as_view(), name='async-booking-get-flight-detail'),
 ]
\ No newline at end of file
@@ -1,159 +1,146 @@
-import requests, json
-from django.shortcuts import render
+import json
+import itertools
+from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.http import StreamingHttpResponse
+from django.db.models import Prefetch
 from .serializer import *
 from rest_framework import viewsets, filters
 from rest_framework.permissions import(
     IsAuthenticated,
+    IsAdminUser,
     AllowAny
 )
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from .models import *
 from .serializer import *
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-import xml.etree.ElementTree as ET
+from rest_framework.views import APIView
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.vary import vary_on_headers
-from .mixins import UserAuthenticationMixin 
-from django.core.cache import cache
+from .mixins import UserAuthenticationMixin, SharedListMixin
+from .pagination import KeysetPagination, IdKeysetPagination
+from . import soap, parsers, envelopes, availability, sync, sales, tickets, fastpath, singleflight, batch, jobs
+
+
+def upstream_error(exc):
+    #timeouts, unreachable upstream and open circuits get a 502/503/504 instead of an opaque 500
+    status_code, headers = soap.http_status(exc)
+    return Response({'error': str(exc)}, status=status_code, headers=headers)
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Booking.objects.select_related(
-        'user',
-        'airline', 
-        'departure',
-        'arrival'
-    ).prefetch_related(
-        'passengers'
-    )
+    queryset = User.objects.all()
     serializer_class = UserSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = IdKeysetPagination
+
+    def get_queryset(self):
+        #staff see every user, everyone else only themselves
+        queryset = super().get_queryset()
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(pk=self.request.user.pk)
 
-class SectorViewSet(UserAuthenticationMixin, viewsets.ReadOnlyModelViewSet):
+class SectorViewSet(UserAuthenticationMixin, SharedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset= Sector.objects.all()  
     serializer_class = SectorSerializer
     permission_classes = [IsAuthenticated]
-
-    @method_decorator(vary_on_headers('Authorization'))
-    @method_decorator(cache_page(60 * 15, key_prefix='sector_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-    
-    def get_queryset(self):
-        import time
-        time.sleep(2)
-        return super().get_queryset()
+    list_namespace = 'sector'
 
     @action(methods=['POST'],detail=False)
     def sector_code(self,request):
         user_creds = self.get_user_credentials()
         
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:SectorCode>
-                    <strUserId>{user_creds['strUserId']}</strUserId>
-                </book:SectorCode>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        soap_body = envelopes.sector_code(user_creds['strUserId'])
         try:
-            response = requests.post( #send SOAP request to server
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
+            #the sector list is the same for every user, so concurrent syncs share one upstream call
+            rows = singleflight.do(
+                singleflight.flight_key('SectorCode'),
+                lambda: parsers.parse_sector_codes(soap.call('SectorCode', soap_body).content)
             )
-            root = ET.fromstring(response.text) #parse xml response to str
-            sector_data = root.find(".//{http://booking.us.org/}return").text.strip()
-            sector_xml = ET.fromstring(sector_data)
-            sector_list = []
-
-            for sector in sector_xml.findall('Sector'):
-                code = sector.find('SectorCode').text
-                name = sector.find('SectorName').text
-                #save/update to database
-                sector_obj, created = Sector.objects.update_or_create(
-                    sector_code=code,
-                    defaults={"sector_name": name}
-                )
-                sector_list.append(sector_obj)
+            #save/update to database
+            sector_list, counts = sync.sync_sectors(rows)
 
             serializer = SectorSerializer(sector_list, many=True)
             return Response({
-                'sectors': serializer.data
+                'sectors': serializer.data,
+                **counts
             })
 
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class AirlinesViewSet(UserAuthenticationMixin, viewsets.ReadOnlyModelViewSet):
+class AirlinesViewSet(UserAuthenticationMixin, SharedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Airline.objects.all()
     serializer_class = AirlineSerializer
     permission_classes = [IsAuthenticated]
-
-    @method_decorator(vary_on_headers('Authorization'))
-    @method_decorator(cache_page(60 * 15, key_prefix='airline_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    list_namespace = 'airline'
 
     @action(methods=['POST'],detail=False)
     def check_balance(self,request):
         user_creds = self.get_user_credentials()
         airline_id = request.data.get('airline_id')
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:CheckBalance>
-                    <strUserId>{user_creds['strUserId']}</strUserId>
-                    <strAirlineId>{airline_id}</strAirlineId>
-                </book:CheckBalance>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        soap_body = envelopes.check_balance(user_creds['strUserId'], airline_id)
         
         try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
-
-            root = ET.fromstring(response.text)
-            balance_data = root.find(".//{http://booking.us.org/}return").text.strip()
-            balance_xml = ET.fromstring(balance_data)
+            response = soap.call('CheckBalance', soap_body)
 
-            balance_list = []
-            for airline in balance_xml.findall('Airline'):
-                balance_list.append({
-                    'airline_name': airline.find('AirlineName').text,
-                    'agency_name': airline.find('AgencyName').text,
-                    'balance_amount': airline.find('BalanceAmount').text
-                })
+            balance_list = parsers.parse_balance(response.content)
 
             return Response({'balances': balance_list}, status=status.HTTP_200_OK)
    
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PassengerViewSet(viewsets.ModelViewSet):
+class PassengerViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Passenger.objects.all()
     serializer_class = PassengerSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = IdKeysetPagination
+
+    def get_queryset(self):
+        #passengers belong to bookings, so each user only sees those of their own bookings
+        return self.queryset.filter(booking__user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        #reads go through fastpath: .values() rows instead of model instances and PassengerSerializer
+        page = self.paginate_queryset(fastpath.passenger_values(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(fastpath.passengers(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        row = get_object_or_404(fastpath.passenger_values(self.get_queryset()), pk=kwargs['pk'])
+        return Response(fastpath.passengers([row])[0])
 
 class BookingViewSet(UserAuthenticationMixin, viewsets.ModelViewSet):
-    queryset = Passenger.objects.select_related(
-        'booking',
-        'booking__airline',
-        'booking__departure',
-        'booking__arrival'
+    #BookingSerializer renders airline/departure/arrival as pks, so passengers is the only relation it reads
+    queryset = Booking.objects.prefetch_related(
+        Prefetch('passengers', queryset=Passenger.objects.order_by('pk'))
     )
     serializer_class = BookingSerializer
+    pagination_class = KeysetPagination
     # permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        #each user only sees their own bookings
+        if not self.request.user.is_authenticated:
+            return self.queryset.none()
+        return self.queryset.filter(user=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        #reads go through fastpath: .values() rows instead of model instances and nested serializers
+        page = self.paginate_queryset(fastpath.booking_values(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(fastpath.bookings(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        row = get_object_or_404(fastpath.booking_values(self.get_queryset()), pk=kwargs['pk'])
+        return Response(fastpath.bookings([row])[0])
+
     @action(methods=['POST'], detail=False)
     def flight_availability(self, request):
         serializer = FlightAvailabilitySerializer(data=request.data)
@@ -161,113 +148,20 @@ class BookingViewSet(UserAuthenticationMixin, viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
         
-        sector_from = data['sector_from'].sector_code
-        sector_to = data['sector_to'].sector_code
-
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:FlightAvailability>
-                    <strUserId>{user_creds['strUserId']}</strUserId>
-                    <strPassword>{user_creds['strPassword']}</strPassword>
-                    <strAgencyId>{user_creds['strAgencyId']}</strAgencyId>
-                    <strSectorFrom>{sector_from}</strSectorFrom>
-                    <strSectorTo>{sector_to}</strSectorTo>
-                    <strFlightDate>{data['flight_date']}</strFlightDate>
-                    <strReturnDate>{data.get('return_date', '')}</strReturnDate>
-                    <strTripType>{data['trip_type']}</strTripType>
-                    <strNationality>{data['nationality']}</strNationality>
-                    <intAdult>{data['adult']}</intAdult>
-                    <intChild>{data['child']}</intChild>
-                    <strClientIP>{data['client_ip']}</strClientIP>
-                </book:FlightAvailability>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
-
-        #TODO: Parse XML to JSON
+        if data['fan_out']:
+            airline_ids = serializer.fan_out_airlines()
+            fetch = lambda: availability.fan_out(user_creds, data, airline_ids)
+        else:
+            airline_ids = None
+            fetch = lambda: availability.search(user_creds, data)
+        cache_key = availability.search_key(data, airline_ids)
+
         try:
-            response = requests.post(
-                'soapurl',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
-            root = ET.fromstring(response.text)
-            flight_xml = ET.fromstring(root.find(".//{http://booking.us.org/}return").text)
-            
-            outbound = flight_xml.find('Outbound')
-            inbound = flight_xml.find('Inbound')
-            
-            outbound_flights = []
-            for a in (outbound.findall('Availability') if outbound is not None else []):
-                adult_fare = float(a.find('AdultFare').text)
-                child_fare = float(a.find('ChildFare').text)
-                fuel_surcharge = float(a.find('FuelSurcharge').text)
-                tax = float(a.find('Tax').text)
-                child_tax_adj = float(a.find('ChildTaxAdjustment').text) if a.find('ChildTaxAdjustment') is not None else 0
-                
-                outbound_flights.append({
-                    'airline': a.find('Airline').text,
-                    'airline_logo': a.find('AirlineLogo').text,
-                    'flight_date': a.find('FlightDate').text,
-                    'flight_no': a.find('FlightNo').text,
-                    'departure': a.find('Departure').text,
-                    'departure_time': a.find('DepartureTime').text,
-                    'arrival': a.find('Arrival').text,
-                    'arrival_time': a.find('ArrivalTime').text,
-                    'aircraft_type': a.find('AircraftType').text,
-                    'adult': int(a.find('Adult').text),
-                    'child': int(a.find('Child').text),
-                    'infant': int(a.find('Infant').text),
-                    'flight_id': a.find('FlightId').text,
-                    'flight_class_code': a.find('FlightClassCode').text,
-                    'currency': a.find('Currency').text,
-                    'adult_fare': adult_fare,
-                    'child_fare': child_fare,
-                    'infant_fare': float(a.find('InfantFare').text),
-                    'fuel_surcharge': fuel_surcharge,
-                    'tax': tax,
-                    'child_tax_adjustment': child_tax_adj,
-                    'total_adult_fare': adult_fare + fuel_surcharge + tax,
-                    'total_child_fare': child_fare + fuel_surcharge + tax + child_tax_adj,
-                    'refundable': a.find('Refundable').text,
-                    'free_baggage': a.find('FreeBaggage').text,
-                    'agency_commission': float(a.find('AgencyCommission').text),
-                    'child_commission': float(a.find('ChildCommission').text) if a.find('ChildCommission') is not None else 0,
-                })
-            
-            inbound_flights = []
-            for a in (inbound.findall('Availability') if inbound is not None else []):
-                adult_fare = float(a.find('AdultFare').text)
-                child_fare = float(a.find('ChildFare').text)
-                fuel_surcharge = float(a.find('FuelSurcharge').text)
-                tax = float(a.find('Tax').text)
-                child_tax_adj = float(a.find('ChildTaxAdjustment').text) if a.find('ChildTaxAdjustment') is not None else 0
-                
-                inbound_flights.append({
-                    'airline': a.find('Airline').text,
-                    'flight_date': a.find('FlightDate').text,
-                    'flight_no': a.find('FlightNo').text,
-                    'departure': a.find('Departure').text,
-                    'departure_time': a.find('DepartureTime').text,
-                    'arrival': a.find('Arrival').text,
-                    'arrival_time': a.find('ArrivalTime').text,
-                    'flight_id': a.find('FlightId').text,
-                    'adult_fare': adult_fare,
-                    'child_fare': child_fare,
-                    'fuel_surcharge': fuel_surcharge,
-                    'tax': tax,
-                    'child_tax_adjustment': child_tax_adj,
-                    'total_adult_fare': adult_fare + fuel_surcharge + tax,
-                    'total_child_fare': child_fare + fuel_surcharge + tax + child_tax_adj,
-                })
-            
-            return Response({
-                'outbound_flights': outbound_flights,
-                'inbound_flights': inbound_flights
-            }, status=status.HTTP_200_OK)
+            result, cache_state = availability.cached_search(cache_key, user_creds['strAgencyId'], fetch)
+            return Response(result, status=status.HTTP_200_OK, headers={'X-Cache': cache_state})
             
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -278,37 +172,15 @@ class BookingViewSet(UserAuthenticationMixin, viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True) 
         data = serializer.validated_data
 
-        soap_body=f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:Reservation>
-                    <strFlightId>{data['flight_id']}</strFlightId>
-                    <strReturnFlightId>{data.get('return_flight_id', '')}</strReturnFlightId>
-                </book:Reservation>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        soap_body = envelopes.reservation(data)
 
         try:
-            response = requests.post(
-                'soapurl',
-                data = soap_body,
-                headers={'Content-Type': 'text/xml'},
-            )
+            response = soap.call('Reservation', soap_body)
 
-            root = ET.fromstring(response.text)
-            pnr_detail = root.find(".//{http://booking.us.org/}return") 
-            pnr_element = ET.fromstring(pnr_detail.text)                
-            reservation_info = {
-                'airline_id':pnr_element.find('AirlineID').text,
-                'flight_id': pnr_element.find('FlightId').text,
-                'pnr_no': pnr_element.find('PNRNO').text,
-                'reservation_status': pnr_element.find('ReservationStatus').text,
-                'ttl_date': pnr_element.find('TTLDate').text,
-                'ttl_time': pnr_element.find('TTLTime').text,
-            }
+            reservation_info = parsers.parse_reservation(response.content)
             return Response({'reservation info': reservation_info}, status=status.HTTP_200_OK)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except Exception as e:
             print("RESERVATION ERROR:", e)
             raise
@@ -318,125 +190,54 @@ class BookingViewSet(UserAuthenticationMixin, viewsets.ModelViewSet):
         serializer = IssueTicketSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
+        run_async = data.pop('async')
 
-        #building passenger XML
-        xml_parts = ['<?xml version="1.0" ?><PassengerDetail>']
-        for pax in data['passenger_detail']:
-            xml_parts.append(f"""<Passenger>
-                <PaxType>{pax['pax_type']}</PaxType>
-                <Title>{pax['title']}</Title>
-                <Gender>{pax['gender']}</Gender>
-                <FirstName>{pax['first_name']}</FirstName>
-                <LastName>{pax['last_name']}</LastName>
-                <Nationality>{pax['nationality']}</Nationality>
-                <PaxRemarks>{pax.get('remarks', 'N/A')}</PaxRemarks>
-            </Passenger>""")
-        xml_parts.append('</PassengerDetail>')
-        passenger_xml = ''.join(xml_parts)
-        
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:IssueTicket>
-                    <strFlightId>{data['flight_id']}</strFlightId>
-                    <strReturnFlightId>{data.get('return_flight_id', '')}</strReturnFlightId>
-                    <strContactName>{data['contact_name']}</strContactName>
-                    <strContactEmail>{data['contact_email']}</strContactEmail>
-                    <strContactMobile>{data['contact_mobile']}</strContactMobile>
-                    <strPassengerDetail><![CDATA[{passenger_xml}]]></strPassengerDetail>
-                </book:IssueTicket>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        #async mode: the upstream call runs on the ticket job pool, poll ticket_jobs/<job_id>/
+        if run_async:
+            job = jobs.enqueue(request.user, data)
+            location = reverse('booking-test-ticket-job', kwargs={'job_id': job.pk})
+            return Response(TicketJobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+        soap_body = envelopes.issue_ticket(data)
         
         try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL', 
-                data=soap_body, 
-                headers={'Content-Type': 'text/xml'}
-                )
-            root = ET.fromstring(response.text)
-            ns = {'book': 'http://booking.us.org/'}
-            itinerary = root.find('.//book:Itinerary', ns)
-            passengers = []
-
-            for p in itinerary.findall('book:Passenger', ns):
-                passengers.append({
-                    'airline': p.find('book:Airline', ns).text,
-                    'pnr_no': p.find('book:PnrNo', ns).text,
-                    'title': p.find('book:Title', ns).text,
-                    'gender': p.find('book:Gender', ns).text,
-                    'first_name': p.find('book:FirstName', ns).text,
-                    'last_name': p.find('book:LastName', ns).text,
-                    'pax_type': p.find('book:PaxType', ns).text,
-                    'nationality': p.find('book:Nationality', ns).text,
-                    'issue_from': p.find('book:IssueFrom', ns).text,
-                    'agency_name': p.find('book:AgencyName', ns).text,
-                    'issue_date': p.find('book:IssueDate', ns).text,
-                    'issue_by': p.find('book:IssueBy', ns).text,
-                    'flight_no': p.find('book:FlightNo', ns).text,
-                    'flight_date': p.find('book:FlightDate', ns).text,
-                    'departure': p.find('book:Departure', ns).text,
-                    'flight_time': p.find('book:FlightTime', ns).text,
-                    'ticket_no': p.find('book:TicketNo', ns).text,
-                    'barcode_value': p.find('book:BarCodeValue', ns).text,
-                    'barcode_image': p.find('book:BarcodeImage', ns).text,
-                    'arrival': p.find('book:Arrival', ns).text,
-                    'arrival_time': p.find('book:ArrivalTime', ns).text,
-                    'sector': p.find('book:Sector', ns).text,
-                    'class_code': p.find('book:ClassCode', ns).text,
-                    'currency': p.find('book:Currency', ns).text,
-                    'fare': p.find('book:Fare', ns).text,
-                    'surcharge': p.find('book:Surcharge', ns).text,
-                    'tax_currency': p.find('book:TaxCurrency', ns).text,
-                    'tax': p.find('book:Tax', ns).text,
-                    'commission_amount': p.find('book:CommissionAmount', ns).text,
-                    'refundable': p.find('book:Refundable', ns).text,
-                    'reporting_time': p.find('book:ReportingTime', ns).text,
-                    'free_baggage': p.find('book:FreeBaggage', ns).text,
-                })
-            
+            response = soap.call('IssueTicket', soap_body)
+            passengers = parsers.parse_issue_ticket(response.content)
+            if request.user.is_authenticated:
+                tickets.save_issued(request.user, data, passengers)
             return Response({'itinerary': passengers, 'message': 'Ticket issued successfully'}, status=status.HTTP_200_OK)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+    @action(methods=['GET'], detail=False, url_path=r'ticket_jobs/(?P<job_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})')
+    def ticket_job(self, request, job_id=None):
+        user = request.user if request.user.is_authenticated else None
+        job = get_object_or_404(TicketJob, pk=job_id, user=user)
+        return Response(TicketJobSerializer(job).data, status=status.HTTP_200_OK)
+
     @action(methods=['POST'], detail=False)
     def get_itinerary(self, request):
         pnr_no = request.data.get('pnr_no', '')
         ticket_no = request.data.get('ticket_no', '')
         airline_id = request.data.get('airline_id', '')
 
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:GetItinerary>
-                    <strPnoNo>{pnr_no}</strPnoNo>
-                    <strTicketNo>{ticket_no}</strTicketNo>
-                    <strAgencyId>{airline_id}</strAgencyId>
-                </book:GetItinerary>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        #most lookups come minutes after issue_ticket stored the itinerary
+        stored = tickets.find_itinerary(request.user, pnr_no, ticket_no, airline_id)
+        if stored is not None:
+            return Response({'itinerary': stored}, status=status.HTTP_200_OK)
 
-        try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
-
-            root = ET.fromstring(response.text)
-            itinerary_root = root.find(".//{http://booking.us.org/}Itinerary")
-            itinerary  = ET.fromstring(itinerary_root)
-            passengers = []
+        soap_body = envelopes.get_itinerary(pnr_no, ticket_no, airline_id)
 
-            for passenger in itinerary.findall('Passenger'):
-                    passengers.append(self._parse_passenger_itinerary(passenger))
+        try:
+            response = soap.call('GetItinerary', soap_body)
 
+            passengers = parsers.parse_itinerary(response.content)
             return Response({'itinerary': passengers}, status=status.HTTP_200_OK)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -445,133 +246,163 @@ class BookingViewSet(UserAuthenticationMixin, viewsets.ModelViewSet):
     def get_flight_detail(self, request):
         user = request.user
         flight_id = request.data.get('flight_id')
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:GetFlightDetail>
-                    <strUserId>{user.user_id}</strUserId>
-                    <strFlightId>{flight_id}</strFlightId>
-                </book:GetFlightDetail>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        soap_body = envelopes.get_flight_detail(user.user_id, flight_id)
     
         try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
+            response = soap.call('GetFlightDetail', soap_body)
             
-            root = ET.fromstring(response.text)
-            availability = root.find(".//{http://booking.us.org/}Availability")
-            flight_detail = self._parse_flight_availability(availability)
+            flight_detail = parsers.parse_flight_detail(response.content)
             return Response({'flight_detail': flight_detail}, status=status.HTTP_200_OK)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
+    @action(methods=['POST'], detail=False)
+    def batch_flight_detail(self, request):
+        serializer = BatchFlightDetailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_id = request.user.user_id
+
+        flight_ids = dict.fromkeys(serializer.validated_data['flight_ids'])
+        results = batch.run(batch.flight_detail, [(flight_id, (user_id, flight_id)) for flight_id in flight_ids])
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=False)
+    def batch_itinerary(self, request):
+        serializer = BatchItinerarySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        items = {
+            batch.itinerary_key(item): (item['pnr_no'], item['ticket_no'], item['airline_id'])
+            for item in serializer.validated_data['items']
+        }
+        results = batch.itineraries(request.user, items)
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
     @action(methods=['POST'], detail=False)
     def get_pnr_detail(self, request):
-        user = request.user
         pnr_no = request.data.get('pnr_no')
         last_name = request.data.get('last_name')
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:GetPnrDetail>
-                    <strUserId>{user.user_id}</strUserId>
-                    <strPassword>{user.api_password}</strPassword>
-                    <strAgencyId>{user.agency_id}</strAgencyId>
-                    <strPnrNo>{pnr_no}</strPnrNo>
-                    <strLastName>{last_name}</strLastName>
-                </book:GetPnrDetail>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
+        soap_body = envelopes.get_pnr_detail(self.get_user_credentials(), pnr_no, last_name)
 
         try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
-            root = ET.fromstring(response.text)
-            pnr_detail = root.find(".//{http://booking.us.org/}return")
-            return Response({'pnr_maintenance_url': pnr_detail.text}, status=status.HTTP_200_OK)
+            response = soap.call('GetPnrDetail', soap_body)
+            return Response({'pnr_maintenance_url': parsers.soap_return(response.content)}, status=status.HTTP_200_OK)
 
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     @action(methods=['POST'], detail=False)
     def sales_report(self, request):
-        user = request.user
-        from_date = request.data.get('from_date')
-        to_date = request.data.get('to_date')
+        from_date, to_date, error = self._sales_range(request)
+        if error:
+            return error
 
-        cache_key = f"sales_{user.user_id}_{from_date}_{to_date}"
-        cached_data = cache.get(cache_key)
+        export = request.data.get('export')
+        if export is not None:
+            return self._sales_export(export, from_date, to_date)
+        if request.data.get('cursor') or request.data.get('page_size'):
+            return self._sales_page(request, from_date, to_date)
 
-        if cached_data:
-            return Response(cached_data, status=status.HTTP_200_OK)
-            
-        soap_body = f"""
-        <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
-        xmlns:book="http://booking.us.org/">
-            <soapenv:Body>
-                <book:SalesReport>
-                    <strUserId>{user.user_id}</strUserId>
-                    <strPassword>{user.api_password}</strPassword>
-                    <strAgencyId>{user.agency_id}</strAgencyId>
-                    <strPnrNo>{from_date}</strPnrNo>
-                    <strTicketNo>{to_date}</strTicketNo>
-                </book:SalesReport>
-            </soapenv:Body>
-        </soapenv:Envelope>
-        """
-        
         try:
-            response = requests.post(
-                'SOAP_ENDPOINT_URL',
-                data=soap_body,
-                headers={'Content-Type': 'text/xml'}
-            )
-            
-            root = ET.fromstring(response.text)
-            sales_summary = root.find(".//{http://booking.us.org/}SalesSummary")
-            tickets = []
-            for ticket_detail in sales_summary.findall('TicketDetail'):
-                tickets.append({
-                    'pnr_no': ticket_detail.find('PnrNo').text,
-                    'airline': ticket_detail.find('Airline').text,
-                    'issue_date': ticket_detail.find('IssueDate').text,
-                    'flight_no': ticket_detail.find('FlightNo').text,
-                    'flight_date': ticket_detail.find('FlightDate').text,
-                    'sector_pair': ticket_detail.find('SectorPair').text,
-                    'class_code': ticket_detail.find('ClassCode').text,
-                    'ticket_no': ticket_detail.find('TicketNo').text,
-                    'passenger_name': ticket_detail.find('PassengerName').text,
-                    'nationality': ticket_detail.find('Nationality').text,
-                    'pax_type': ticket_detail.find('PaxType').text,
-                    'currency': ticket_detail.find('Currency').text,
-                    'fare': ticket_detail.find('Fare').text,
-                    'fsc': ticket_detail.find('FSC').text,
-                    'tax': ticket_detail.find('TAX').text,
-                })
-
-            report_data = {
-                'sales_report': tickets,
-                'total_tickets': len(tickets)
-            }
+            tickets = sales.report(self.get_user_credentials(), from_date, to_date)
 
-            cache.set(cache_key, report_data, timeout=900)
-            
             return Response({
                 'sales_report': tickets,
                 'total_tickets': len(tickets)
             }, status=status.HTTP_200_OK)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
+        except:
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(methods=['POST'], detail=False)
+    def sales_summary(self, request):
+        from_date, to_date, error = self._sales_range(request)
+        if error:
+            return error
+        group_by = request.data.get('group_by') or ['airline']
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        unknown = [field for field in group_by if field not in sales.GROUP_FIELDS]
+        if unknown:
+            return Response({'error': f"group_by must be taken from {', '.join(sales.GROUP_FIELDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            tickets = (ticket for day, ticket in sales.iter_report(self.get_user_credentials(), from_date, to_date))
+            summary = sales.summarize(sales.load_columns(tickets), list(dict.fromkeys(group_by)))
+        except soap.UpstreamError as e:
+            return upstream_error(e)
+        except:
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(summary, status=status.HTTP_200_OK)
+
+    def _sales_range(self, request):
+        #(from_date, to_date, None) or (None, None, error response)
+        try:
+            from_date = sales.parse_date(request.data.get('from_date'))
+            to_date = sales.parse_date(request.data.get('to_date'))
+        except (TypeError, AttributeError, ValueError):
+            return None, None, Response({'error': 'from_date and to_date must be dates like 01-NOV-2025'}, status=status.HTTP_400_BAD_REQUEST)
+        if to_date < from_date:
+            return None, None, Response({'error': 'to_date is before from_date'}, status=status.HTTP_400_BAD_REQUEST)
+        if (to_date - from_date).days >= sales.MAX_RANGE_DAYS:
+            return None, None, Response({'error': f"The range can span at most {sales.MAX_RANGE_DAYS} days"}, status=status.HTTP_400_BAD_REQUEST)
+        return from_date, to_date, None
+
+    def _sales_page(self, request, from_date, to_date):
+        try:
+            page_size = min(int(request.data.get('page_size') or sales.PAGE_SIZE), sales.MAX_PAGE_SIZE)
+            if page_size < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({'error': 'page_size must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            rows, next_cursor = sales.page(
+                self.get_user_credentials(), from_date, to_date,
+                cursor=request.data.get('cursor'), page_size=page_size
+            )
+        except ValueError:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
         except:
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({'sales_report': rows, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+
+    def _sales_export(self, export, from_date, to_date):
+        if export not in sales.EXPORT_FORMATS:
+            return Response({'error': f"export must be one of {', '.join(sales.EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        tickets = (ticket for day, ticket in sales.iter_report(self.get_user_credentials(), from_date, to_date))
+        try:
+            #pull the first row here so an upstream failure can still become a 500
+            first = next(tickets, None)
+        except soap.UpstreamError as e:
+            return upstream_error(e)
+        except:
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        rows = itertools.chain([first] if first is not None else [], tickets)
+
+        content_type, write = sales.EXPORT_FORMATS[export]
+        response = StreamingHttpResponse(write(rows), content_type=content_type)
+        if export == 'csv':
+            response['Content-Disposition'] = f'attachment; filename="sales_{from_date:%Y%m%d}_{to_date:%Y%m%d}.csv"'
+        return response
+
+
+class StatsView(APIView):
+    """Counters of the worker process that answers: availability cache hits and SOAP connection reuse."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'availability_cache': availability.cache_stats.snapshot(),
+            'soap_transports': soap.stats(),
+        })
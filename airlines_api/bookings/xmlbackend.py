@@ -0,0 +1,87 @@
+import xml.etree.ElementTree as ET
+from django.conf import settings
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+BOOK_URI = 'http://booking.us.org/'
+
+#namespaced response elements looked up by the parsers, first match in document order
+BOOK_ELEMENTS = ('return', 'Itinerary', 'Availability', 'SalesSummary')
+
+
+class EtreeBackend:
+    name = 'etree'
+
+    def __init__(self):
+        self.paths = {tag: f".//{{{BOOK_URI}}}{tag}" for tag in BOOK_ELEMENTS}
+
+    def fromstring(self, content):
+        return ET.fromstring(content)
+
+    def find(self, root, tag):
+        return root.find(self.paths[tag])
+
+    def pull_parser(self):
+        return ET.XMLPullParser(events=('start', 'end'))
+
+
+class LxmlBackend:
+    name = 'lxml'
+
+    def __init__(self):
+        options = dict(resolve_entities=False, no_network=True, remove_comments=True, remove_pis=True)
+        self.parser = etree.XMLParser(**options)
+        #str input was already decoded, so ignore any encoding declaration in it
+        self.text_parser = etree.XMLParser(encoding='utf-8', **options)
+        self.options = options
+        #compiled once at import instead of re-parsing a path string on every call
+        self.paths = {
+            tag: etree.XPath(f"(//book:{tag})[1]", namespaces={'book': BOOK_URI})
+            for tag in BOOK_ELEMENTS
+        }
+
+    def fromstring(self, content):
+        if isinstance(content, str):
+            return etree.fromstring(content.encode('utf-8'), self.text_parser)
+        return etree.fromstring(content, self.parser)
+
+    def find(self, root, tag):
+        found = self.paths[tag](root)
+        return found[0] if found else None
+
+    def pull_parser(self):
+        return etree.XMLPullParser(events=('start', 'end'), **self.options)
+
+
+BACKENDS = {'etree': EtreeBackend}
+if etree is not None:
+    BACKENDS['lxml'] = LxmlBackend
+
+backend = None
+
+
+def use(name='auto'):
+    """Select the parser backend; 'auto' picks lxml when it is installed."""
+    global backend
+    if name == 'auto':
+        name = 'lxml' if 'lxml' in BACKENDS else 'etree'
+    backend = BACKENDS[name]()
+    return backend
+
+
+def fromstring(content):
+    return backend.fromstring(content)
+
+
+def find(root, tag):
+    return backend.find(root, tag)
+
+
+def pull_parser():
+    return backend.pull_parser()
+
+
+use(getattr(settings, 'SOAP_XML_BACKEND', 'auto'))